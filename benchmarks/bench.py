@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+import contextlib
+import json
+import os
+import os.path
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from os.path import basename, dirname
+
+# pylint: disable=pointless-string-statement
+'''
+Times swcert on synthetic environments made in a temp dir: CA, list.d with many domains,
+NSS profiles made by `certutil -N`, deep fake ~/.mozilla trees. Results are written as JSON,
+`--compare` shows the change against an older result file.
+
+Usage:
+benchmarks/bench.py [--out <file.json>] [--compare <old.json>] [--sizes 10,100,1000,10000] [--profiles <count>]
+                    [--repeat <count>] [--system]
+
+--system also times `Ca.find_or_new_ca_crt` and a full `swcert.py` run, they install the CA into this machine
+'''
+
+ROOT = dirname(dirname(os.path.abspath(__file__)))
+SWCERT = os.path.join(ROOT, 'swcert.py')
+REGRESSION_RATIO = 1.2  # slower than that against --compare is reported
+
+
+def usage():
+    msg = 'Usage:\n'
+    msg += f'\t{basename(__file__)} [--out <file.json>] [--compare <old.json>] [--sizes 10,100,1000,10000] ' \
+           '[--profiles <count>] [--repeat <count>] [--system]\n'
+    sys.exit(msg)
+
+
+class Bench:
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = {}
+
+    def time(self, name, func, setup=None, repeat=None):
+        """runs setup() untimed and func() timed `repeat` times"""
+        runs = []
+        for _ in range(repeat or self.repeat):
+            if setup:
+                setup()
+            started = time.perf_counter()
+            func()
+            runs.append(time.perf_counter() - started)
+        self.results[name] = {'min': min(runs), 'median': statistics.median(runs), 'runs': len(runs)}
+        print(f'{name:<40} {self.results[name]["median"] * 1000:10.2f} ms', file=sys.stderr)
+
+
+def make_ca(home):
+    from swcertificate import Ca  # pylint: disable=import-outside-toplevel
+    ca = Ca(ca_key=os.path.join(home, 'ca', 'ca.key'), ca_crt=os.path.join(home, 'ca', 'ca.crt'))
+    os.makedirs(os.path.join(home, 'ca'), exist_ok=True)
+    ca.make_ca_key()
+    ca.make_ca_crt()
+    return ca
+
+
+def make_profiles(home, count):
+    """NSS dbs as browsers have them"""
+    nss_dirs = []
+    for i in range(count):
+        nss_dir = os.path.join(home, 'nss', f'profile{i}')
+        os.makedirs(nss_dir)
+        subprocess.run(['certutil', '-N', '-d', f'sql:{nss_dir}', '--empty-password'], check=True,
+                       capture_output=True)
+        nss_dirs.append(nss_dir)
+    return nss_dirs
+
+
+def make_mozilla_tree(home, profiles, subdir='extensions', name='.mozilla', depth=6, width=8):
+    """~/.mozilla like tree, cert9.db files are hidden among deep dirs under `subdir` of every profile.
+    `extensions` is walked, a NSS_PRUNE_DIRS one like `storage` is skipped"""
+    from swcertificate.settings import NSS_NAME  # pylint: disable=import-outside-toplevel
+    top = os.path.join(home, name)
+    for i in range(profiles):
+        profile = os.path.join(top, 'firefox', f'{i:04x}.default')
+        os.makedirs(profile)
+        open(os.path.join(profile, NSS_NAME), 'a').close()
+        for w in range(width):
+            os.makedirs(os.path.join(profile, subdir, *[f'd{w}'] * depth))
+    return top
+
+
+def bench_ca(bench, home):
+    from swcertificate import Ca  # pylint: disable=import-outside-toplevel
+    ca = make_ca(home)
+    bench.time('ca.make_ca_key', ca.make_ca_key)
+    bench.time('ca.make_ca_crt', ca.make_ca_crt)
+    bench.time('ca.get_crt_serial', lambda: Ca.get_crt_serial(ca.ca_crt, ca.backend))
+    return ca
+
+
+def bench_issue(bench, home, ca, sizes):
+    from swcertificate import Cert  # pylint: disable=import-outside-toplevel
+    from swcertificate.registry import Registry  # pylint: disable=import-outside-toplevel
+    for size in sizes:
+        cert_home = os.path.join(home, f'cert{size}')
+        cert = Cert(ca, cert_list=os.path.join(cert_home, 'list.d'), csr=os.path.join(cert_home, 'swcert.csr'),
+                    key=os.path.join(cert_home, 'swcert.key'), crt=os.path.join(cert_home, 'swcert.crt'),
+                    digest=os.path.join(cert_home, 'swcert.sha256'))
+        cert.set_domains([f'host{i}.bench.lan' for i in range(size)])
+        cert.find_or_new_csr_key()
+        bench.time(f'cert.issue_cert[{size}]', cert.issue_cert)
+        bench.time(f'cert.is_issued[{size}]', cert.is_issued)
+        bench.time(f'registry.load[{size}]', lambda: Registry.of_cert_list(cert.cert_list).load())
+
+
+def bench_nss(bench, home, ca, profiles):
+    from swcertificate import Ca, Nss  # pylint: disable=import-outside-toplevel
+    nss_dirs = make_profiles(home, profiles)
+    ca_serial = Ca.get_crt_serial(ca.ca_crt, ca.backend)
+
+    def forget():
+        for nss_dir in nss_dirs:
+            Nss.delete_cert(nss_dir)
+
+    bench.time(f'nss.sync_install[{profiles}]', lambda: Nss.sync(nss_dirs, ca_serial, ca.ca_crt), setup=forget)
+    bench.time(f'nss.sync_install_serial[{profiles}]', lambda: Nss.sync(nss_dirs, ca_serial, ca.ca_crt, workers=1),
+               setup=forget)
+    bench.time(f'nss.sync_up_to_date[{profiles}]', lambda: Nss.sync(nss_dirs, ca_serial, ca.ca_crt))
+
+
+def bench_find(bench, home, profiles):
+    from swcertificate import Nss  # pylint: disable=import-outside-toplevel
+    top = make_mozilla_tree(home, profiles)
+    pruned_top = make_mozilla_tree(home, profiles, subdir='storage', name='.mozilla-pruned')
+    index = os.path.join(home, 'nss_index.json')
+
+    def drop_index():
+        if os.path.exists(index):
+            os.remove(index)
+
+    bench.time(f'nss.find_cold[{profiles}]', lambda: Nss.find(nss_dirs=[top], index=index), setup=drop_index)
+    bench.time(f'nss.find_indexed[{profiles}]', lambda: Nss.find(nss_dirs=[top], index=index))
+    bench.time(f'nss.find_cold_pruned[{profiles}]', lambda: Nss.find(nss_dirs=[pruned_top], index=index),
+               setup=drop_index)
+
+
+def bench_swcert(bench, home, sizes, system):
+    for size in sizes:
+        env_home = os.path.join(home, f'swcert{size}')
+        list_d = os.path.join(env_home, 'cert', 'list.d')
+        os.makedirs(list_d)
+        with open(os.path.join(list_d, '.domains'), 'w') as f:
+            f.writelines(sorted(f'host{i}.bench.lan\n' for i in range(size)))
+        env = {**os.environ, 'SW_HOME': env_home}
+        bench.time(f'swcert.py --list[{size}]',
+                   lambda: subprocess.run([sys.executable, SWCERT, '--list'], env=env, check=True, capture_output=True))
+        if system:
+            bench.time(f'swcert.py add[{size}]', lambda: subprocess.run(
+                [sys.executable, SWCERT, 'bench.lan'], env=env, check=True, capture_output=True), repeat=1)
+
+
+def bench_system(bench):
+    """touches the real trust store"""
+    from swcertificate import Ca  # pylint: disable=import-outside-toplevel
+    ca = Ca()
+    ca.find_or_new_ca_key()
+    bench.time('ca.find_or_new_ca_crt', ca.find_or_new_ca_crt)
+
+
+def meta():
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True, capture_output=True,
+                             text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        rev = None
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'rev': rev,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def compare(results, old_file):
+    """prints median change, returns names slower than REGRESSION_RATIO"""
+    with open(old_file) as f:
+        old_results = json.load(f)['results']
+    regressions = []
+    for name, result in results.items():
+        if name not in old_results:
+            continue
+        ratio = result['median'] / old_results[name]['median'] if old_results[name]['median'] else 1
+        mark = ''
+        if ratio > REGRESSION_RATIO:
+            regressions.append(name)
+            mark = '  REGRESSION'
+        print(f'{name:<40} {ratio:6.2f}x{mark}', file=sys.stderr)
+    return regressions
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    options = {'--out': None, '--compare': None, '--sizes': '10,100,1000,10000', '--profiles': '8', '--repeat': '5'}
+    system = False
+    while args:
+        if args[0] == '--system':
+            system = True
+            args = args[1:]
+            continue
+        if args[0] not in options or len(args) < 2:
+            usage()
+        options[args[0]] = args[1]
+        args = args[2:]
+
+    try:
+        sizes = [int(size) for size in options['--sizes'].split(',')]
+        profiles = int(options['--profiles'])
+        bench = Bench(int(options['--repeat']))
+    except ValueError as e:
+        sys.exit(e)
+
+    with tempfile.TemporaryDirectory(prefix='swcert-bench-') as home, open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):  # swcert progress messages
+        if not system:
+            os.environ['SW_HOME'] = os.path.join(home, 'swcert')  # before settings are imported
+        sys.path.insert(0, ROOT)
+        ca = bench_ca(bench, home)
+        bench_issue(bench, home, ca, sizes)
+        if shutil.which('certutil'):
+            bench_nss(bench, home, ca, profiles)
+        else:  # NSS profiles are made by certutil
+            print('Skip NSS benchmarks: `certutil` not found, install libnss3-tools', file=sys.stderr)
+        bench_find(bench, home, profiles)
+        bench_swcert(bench, home, sizes, system)
+        if system:
+            bench_system(bench)
+
+    report = {'meta': meta(), 'results': bench.results}
+    if options['--out']:
+        with open(options['--out'], 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if options['--compare'] and compare(bench.results, options['--compare']):
+        sys.exit(1)
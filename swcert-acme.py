@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+import signal
+import sys
+from os.path import basename
+
+from swcertificate import Ca
+from swcertificate.acme import serve
+from swcertificate.settings import ACME_HOST, ACME_PORT, ACME_TLS
+
+# pylint: disable=pointless-string-statement
+'''
+Local ACME (RFC 8555) server issuing from swcert CA.
+Any ACME client gets certificates for local names (*.lan, *.test, localhost ...) without challenges:
+    certbot certonly --server https://localhost:14000/directory --standalone -d somehost.lan
+
+Usage:
+sudo swcert-acme [--host <host>] [--port <port>] [--http]
+'''
+
+
+def usage():
+    msg = 'Usage:\n'
+    msg += f'\t{basename(__file__)} [--host <host>] [--port <port>] [--http]\n'
+    msg += f'\tdefault https://{ACME_HOST}:{ACME_PORT}/directory\n'
+    sys.exit(msg)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    options = {'--host': ACME_HOST, '--port': ACME_PORT}
+    tls = ACME_TLS
+    while args:
+        if args[0] == '--http':
+            tls = False
+            args = args[1:]
+            continue
+        if args[0] not in options or len(args) < 2:
+            usage()
+        options[args[0]] = args[1]
+        args = args[2:]
+
+    try:
+        port = int(options['--port'])
+    except ValueError as e:
+        sys.exit(e)
+
+    ca = Ca()
+    ca.find_or_new_ca_key()
+    ca.find_or_new_ca_crt()
+
+    signal.signal(signal.SIGTERM, lambda _signum, _frame: sys.exit())
+    serve(ca, host=options['--host'], port=port, tls=tls)
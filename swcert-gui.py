@@ -4,14 +4,14 @@ gi.require_version("Gtk", "3.0")
 from gi.repository import Gtk
 from gi.repository import GLib
 
-import sys
 import threading
 import time
 
-from swcertificate import Ca, Cert, Nginx, Nss
+from swcertificate import Ca, Cert
+from swcertificate.deploy import Deployer
 from swcertificate.gtkutils import TreeViewUtils
-from swcertificate.settings import NGINX_KEY, NGINX_CRT, GLADE_MAIN_WINDOW
-from swcertificate import utils
+from swcertificate.pipeline import Cancelled, Setup
+from swcertificate.settings import GLADE_MAIN_WINDOW
 
 
 def threaded(fn):
@@ -27,11 +27,18 @@ class Handlers:
 
         self.domains_lst = self.builder.get_object('domains_lst')
         self.entry = self.builder.get_object('domain_entry')
+        self.search_entry = self.builder.get_object('search_entry')
         self.restart_nginx = self.builder.get_object('restart_nginx')
+        self.save_btn = self.builder.get_object('save_btn')
+        self.cancel_btn = self.builder.get_object('cancel_btn')
+        self.save_progress = self.builder.get_object('save_progress')
+        self.stage_label = self.builder.get_object('stage_label')
         self.message_widget = self.builder.get_object('message_widget')
         self.message_label = self.builder.get_object('message_label')
 
-        self.selected_iter = None
+        self.search = ''
+        self.cancel_event = None  # threading.Event of the running save
+        self.stages = {}  # stage name: status of the running save
 
         self.color_black = '#000000'
 
@@ -41,7 +48,6 @@ class Handlers:
     def set_selected(self, selection):
         selected_iter = selection.get_selected()[1]
         if selected_iter:
-            self.selected_iter = selected_iter
             domain_name = TreeViewUtils.get_record(self.domains_lst, selected_iter)
         else:
             domain_name = ''
@@ -56,34 +62,89 @@ class Handlers:
         self.entry.set_text('')
 
     def remove_domain(self, _widget):
-        selected_iter = self.selected_iter
+        selected_iter = self.domains_lst.get_selection().get_selected()[1]  # a stored one is stale after refilter
         TreeViewUtils.delete_record(self.domains_lst, selected_iter)
 
+    def filter_domains(self, search_entry):
+        self.search = search_entry.get_text().strip().lower()
+        self.domains_lst.get_model().refilter()
+
+    def is_domain_visible(self, model, iterator, _data):
+        return not self.search or self.search in model[iterator][0]
+
     def save(self, _widget):
         self.add_domain(None)  # add entered but not added domain
         widget_domains = TreeViewUtils.get_records(self.domains_lst)
         if not widget_domains:
             return
 
-        ca = setup_ca()
-
-        cert = Cert()
-        # delete all domains
-        existing_domains = cert.list_domains()
-        for domain in existing_domains:
-            cert.delete_domain(domain)
-
-        for domain in widget_domains:
-            cert.add_domain(domain)
-        cert = issue_cert(ca)
-        popup_msg = 'Certificate saved'
-        if self.restart_nginx.get_active():
-            try:
-                setup_nginx(cert)
-            except RuntimeError as e:
-                self.display_message(self.color_black, "Can't update Nginx\n" + str(e))
-                return
-            popup_msg += '\nNginx reloaded'
+        self.cancel_event = threading.Event()
+        self.stages = {}
+        self.save_btn.set_sensitive(False)
+        self.cancel_btn.set_sensitive(True)
+        self.save_progress.set_fraction(0)
+        self.save_progress.set_text('Saving')
+        self.save_progress.show()
+        self.stage_label.set_text('')
+        self.stage_label.show()
+        self.save_worker(widget_domains, self.restart_nginx.get_active(), self.cancel_event)
+
+    def cancel(self, _widget):
+        """stages already running finish, the rest are not started"""
+        if self.cancel_event:
+            self.cancel_event.set()
+            self.cancel_btn.set_sensitive(False)
+            self.save_progress.set_text('Cancelling')
+
+    @threaded
+    def save_worker(self, domains, restart_nginx, cancel_event):
+        """the main loop keeps drawing, widgets are touched from GLib.idle_add only"""
+        try:
+            Cert().set_domains(domains)
+            ca = Ca()
+            cert = Cert(ca)
+            setup = Setup(ca, lambda: issue_cert(cert), prepare=cert.find_or_new_csr_key,
+                          deploy=(lambda: deploy_cert(cert)) if restart_nginx else None,
+                          on_stage=lambda name, status: GLib.idle_add(self.show_stage, name, status),
+                          cancel=cancel_event)
+            GLib.idle_add(self.show_stages, list(setup.pipeline.stages))
+            setup.run()
+        except Cancelled:
+            popup_msg = 'Cancelled'
+        except ValueError as e:
+            popup_msg = str(e)
+        except (RuntimeError, OSError) as e:
+            popup_msg = "Can't update certificate\n" + str(e)
+        except SystemExit as e:  # a stage gave up, the window stays
+            popup_msg = "Can't update certificate\n" + str(e.code)
+        else:
+            popup_msg = 'Certificate saved'
+            if restart_nginx:
+                popup_msg += '\nTLS servers reloaded'
+        GLib.idle_add(self.save_done, popup_msg)
+
+    def show_stages(self, names):
+        self.stages = {name: self.stages.get(name, 'waiting') for name in names}
+        self.update_progress()
+
+    def show_stage(self, name, status):
+        self.stages[name] = status
+        self.update_progress()
+
+    def update_progress(self):
+        finished = [name for name, status in self.stages.items() if status not in ('waiting', 'running')]
+        running = [name for name, status in self.stages.items() if status == 'running']
+        if self.stages:
+            self.save_progress.set_fraction(len(finished) / len(self.stages))
+        if running and self.cancel_btn.get_sensitive():
+            self.save_progress.set_text(', '.join(running))
+        self.stage_label.set_text('\n'.join(f'{name}: {status}' for name, status in self.stages.items()))
+
+    def save_done(self, popup_msg):
+        self.cancel_event = None
+        self.save_btn.set_sensitive(True)
+        self.cancel_btn.set_sensitive(False)
+        self.save_progress.hide()
         self.display_message(self.color_black, popup_msg)
 
     def display_message(self, color, text):
@@ -102,61 +163,37 @@ class MainWindow(Gtk.Window):
     def __init__(self):
         self.builder = Gtk.Builder()
         self.builder.add_from_file(GLADE_MAIN_WINDOW)
-        self.builder.connect_signals(Handlers(builder=self.builder))
+        self.handlers = Handlers(builder=self.builder)
+        self.builder.connect_signals(self.handlers)
         self.builder.get_object('main_window').show()
 
         self.set_domains_list('domains_lst')
 
     def set_domains_list(self, treeview_id):
+        """filled in chunks, saving is off until the list is complete"""
         domains_lst = self.builder.get_object(treeview_id)
 
         TreeViewUtils.add_column_text(domains_lst, title='Trusted domains')
-        model = TreeViewUtils.set_model(domains_lst)
+        TreeViewUtils.set_filter_model(domains_lst, self.handlers.is_domain_visible)
 
+        save_btn = self.builder.get_object('save_btn')
+        save_btn.set_sensitive(False)
         all_domains = Cert().list_domains()
-        for domain_name in all_domains:
-            model.append([domain_name])
-
-
-def setup_ca():
-    # check CA key/crt or make new
-    ca = Ca()
-    ca.find_or_new_ca_key()
-    ca.find_or_new_ca_crt()
-
-    # setup NSS
-    ca_serial = Ca.get_crt_serial(ca.ca_crt)
-    if not utils.is_installed('certutil'):
-        sys.exit('Install `certutil` be your self.\nUbuntu ex.\n\tsudo apt install libnss3-tools\nOr browsers will not '
-                 'trust your https')
-
-    found_nss_dirs = Nss.find()
-    if not found_nss_dirs:
-        sys.exit('NSS dirs not found\nBrowsers will not trust your https')
-    for nss_dir in found_nss_dirs:
-        nss_ca_serial = Nss.get_crt_serial(nss_dir)
-        if not nss_ca_serial:
-            Nss.install_ca(nss_dir)
-        elif nss_ca_serial != ca_serial:
-            Nss.delete_cert(nss_dir)
-            Nss.install_ca(nss_dir)
-    return ca
-
-
-def issue_cert(ca):
-    cert = Cert(ca)
-    cert.issue_csr_key()
-    cert.issue_cert()
-    return cert
-
-
-def setup_nginx(cert):
-    if not utils.is_installed('nginx'):
-        return
-
-    utils.copy(cert.key, NGINX_KEY)
-    utils.copy(cert.crt, NGINX_CRT)
-    Nginx.restart()
+        TreeViewUtils.add_records_chunked(domains_lst, ([domain_name] for domain_name in all_domains),
+                                          done=lambda: save_btn.set_sensitive(True))
+
+
+def issue_cert(cert):
+    if not cert.is_issued():
+        cert.issue_cert()
+
+
+def deploy_cert(cert):
+    results = Deployer().deploy(cert.key, cert.crt)
+    failed = [f'{target_name}: {result["error"]}' for target_name, result in results.items()
+              if result['status'] == 'failed']
+    if failed:
+        raise RuntimeError('\n'.join(failed))
 
 
 if __name__ == '__main__':
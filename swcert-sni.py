@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+import signal
+import sys
+from os.path import basename
+
+from swcertificate import Ca
+from swcertificate.backend import check_key_alg
+from swcertificate.settings import KEY_ALG, SNI_HOST, SNI_PORT, SNI_UPSTREAM_HOST, SNI_UPSTREAM_PORT
+from swcertificate.sni import serve
+
+# pylint: disable=pointless-string-statement
+'''
+TLS front minting a certificate from swcert CA for every new local SNI name, no list.d and no nginx reload.
+Decrypted connection goes to upstream as is.
+
+Usage:
+sudo swcert-sni [--host <host>] [--port <port>] [--upstream <host:port>] [--key-alg <alg>]
+'''
+
+
+def usage():
+    msg = 'Usage:\n'
+    msg += f'\t{basename(__file__)} [--host <host>] [--port <port>] [--upstream <host:port>] [--key-alg <alg>]\n'
+    msg += f'\tdefault {SNI_HOST}:{SNI_PORT} -> {SNI_UPSTREAM_HOST}:{SNI_UPSTREAM_PORT}\n'
+    sys.exit(msg)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    options = {'--host': SNI_HOST, '--port': SNI_PORT, '--upstream': f'{SNI_UPSTREAM_HOST}:{SNI_UPSTREAM_PORT}',
+               '--key-alg': KEY_ALG}
+    while args:
+        if args[0] not in options or len(args) < 2:
+            usage()
+        options[args[0]] = args[1]
+        args = args[2:]
+
+    try:
+        check_key_alg(options['--key-alg'])
+        port = int(options['--port'])
+        upstream_host, _, upstream_port = options['--upstream'].rpartition(':')
+        upstream_port = int(upstream_port)
+    except ValueError as e:
+        sys.exit(e)
+
+    ca = Ca()
+    ca.find_or_new_ca_key()
+    ca.find_or_new_ca_crt()
+
+    signal.signal(signal.SIGTERM, lambda _signum, _frame: sys.exit())
+    serve(ca, key_alg=options['--key-alg'], host=options['--host'], port=port,
+          upstream_host=upstream_host or SNI_UPSTREAM_HOST, upstream_port=upstream_port)
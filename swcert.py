@@ -1,10 +1,11 @@
 #!/usr/bin/env python3
+import atexit
 import sys
-from os.path import basename
+from os.path import basename, dirname
 
-from swcertificate import Ca, Cert, Nginx, Nss
-from swcertificate.settings import NGINX_CRT, NGINX_KEY, NGINX_USE
-from swcertificate import utils
+from swcertificate.registry import Registry
+from swcertificate.settings import CERT_LIST, CERT_SHARDS, DEPLOY_TARGETS, KEY_ALG, NGINX_SHARD_MAP, NSS_DIRS, \
+    PIPELINE_CONCURRENCY
 
 # pylint: disable=pointless-string-statement
 '''
@@ -21,72 +22,207 @@ def usage():
     msg = 'Usage:\n'
     msg += f'\t{basename(__file__)} <domain_name> [<domain_name>...] - trust domain\n'
     msg += f'\t{basename(__file__)} -d <domain_name> [<domain_name>...] - forget domain\n'
+    msg += f'\t{basename(__file__)} --list - list trusted domains\n'
+    msg += f'\t{basename(__file__)} --import <file> - trust domains from file, one per line. `-` for stdin\n'
+    msg += f'\t{basename(__file__)} --export - print trusted domains, one per line\n'
+    msg += f'\t{basename(__file__)} --watch - re-issue on every change of domains list or CA\n'
+    msg += f'\t{basename(__file__)} --rollback - put the previous certificate back and reload TLS servers\n'
+    msg += 'Options:\n'
+    msg += f'\t--key-alg <alg> - new keys algorithm, default {KEY_ALG}\n'
+    msg += '\t--rotate-key - issue a new key instead of reusing the existing one\n'
+    msg += '\t--all-users - trust CA in browsers of every user of this machine, snap and flatpak ones too\n'
+    msg += f'\t--shards <count> - spread domains over several certificates, default {CERT_SHARDS}\n'
+    msg += f'\t--jobs <count> - independent steps run at once, default {PIPELINE_CONCURRENCY}\n'
+    msg += '\t--profile - print time spent per phase and the slowest subprocesses\n'
+    msg += '\t--trace <file> - write Chrome trace-event JSON, open in chrome://tracing or ui.perfetto.dev\n'
     sys.exit(msg)
 
 
+def pop_option(args, name):
+    """removes `name value` from args, returns value or None"""
+    if name not in args:
+        return None
+    i = args.index(name)
+    if i + 1 >= len(args):
+        usage()
+    value = args[i + 1]
+    del args[i:i + 2]
+    return value
+
+
+def watch(key_alg, shards, nss_dirs):
+    """issue and deploy once per burst of changes in list.d or CA crt"""
+    from swcertificate import utils  # pylint: disable=import-outside-toplevel
+    from swcertificate.daemon import Engine  # pylint: disable=import-outside-toplevel
+    from swcertificate.watch import Watcher  # pylint: disable=import-outside-toplevel
+
+    engine = Engine(key_alg=key_alg, shards=shards, nss_dirs=nss_dirs)
+    ca_crt = engine.ca.ca_crt
+    try:
+        utils.make_real_dir(dirname(ca_crt))
+        utils.make_real_dir(CERT_LIST)  # fresh install, inotify needs both dirs
+        watcher = Watcher({CERT_LIST: None, dirname(ca_crt): {basename(ca_crt)}})
+    except OSError as e:
+        sys.exit(e)
+
+    with watcher:
+        print(f'Watch {CERT_LIST} and {ca_crt}')
+        changed = {CERT_LIST}
+        while True:
+            print(f'Changed {", ".join(sorted(changed))}')
+            try:
+                result = engine.issue()
+            except (RuntimeError, OSError, ValueError, SystemExit) as e:
+                print(f'Issue failed: {e}', file=sys.stderr)
+            else:
+                print(f'Issued: {result["issued"]}, nginx reloaded: {result["reloaded"]}')
+            changed = watcher.burst()
+
+
+def report(profile, trace_file):
+    """at exit, the run may end with sys.exit anywhere"""
+    from swcertificate.trace import tracer  # pylint: disable=import-outside-toplevel
+
+    if profile:
+        print(tracer.report(), file=sys.stderr)
+    if trace_file:
+        tracer.write_chrome_trace(trace_file)
+        print(f'Trace written to {trace_file}', file=sys.stderr)
+
+
+def pop_flag(args, name):
+    """removes `name` from args, returns True if it was there"""
+    if name not in args:
+        return False
+    args.remove(name)
+    return True
+
+
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
+    args = sys.argv[1:]
+
+    # read-only commands, no crypto, NSS or nginx imports
+    if args == ['--list']:
+        print(*Registry.of_cert_list().load(), sep='\n')
+        sys.exit()
+    elif args == ['--export']:
+        Registry.of_cert_list().export(sys.stdout)
+        sys.exit()
+
+    # pylint: disable=wrong-import-position
+    from swcertificate import Ca, Cert, Nginx, Nss, Shards, utils
+    from swcertificate.backend import check_key_alg
+    from swcertificate.deploy import Deployer
+    from swcertificate.pipeline import Setup
+    from swcertificate.trace import tracer
+
+    profile = pop_flag(args, '--profile')
+    trace_file = pop_option(args, '--trace')
+    if profile or trace_file:
+        tracer.enable()
+        atexit.register(report, profile, trace_file)
+
+    key_alg = pop_option(args, '--key-alg') or KEY_ALG
+    rotate_key = pop_flag(args, '--rotate-key')
+    nss_dirs = Nss.all_users_dirs() if pop_flag(args, '--all-users') else NSS_DIRS
+    shards = pop_option(args, '--shards') or CERT_SHARDS
+    jobs = pop_option(args, '--jobs') or PIPELINE_CONCURRENCY
+    try:
+        check_key_alg(key_alg)
+        shards = int(shards)
+        jobs = int(jobs)
+        shard_targets = [target for target in DEPLOY_TARGETS if target == 'nginx']  # shards are for nginx only
+        deployer = Deployer(shard_targets if shards else DEPLOY_TARGETS)
+    except ValueError as e:
+        sys.exit(e)
+
+    if args == ['--watch']:
+        try:
+            watch(key_alg, shards, nss_dirs)
+        except KeyboardInterrupt:
+            sys.exit()
+
+    if args == ['--rollback']:
+        try:
+            Deployer.print_results(deployer.rollback([Shards.store_name(shard) for shard in range(shards)]
+                                                     if shards else ['swcert']))
+        except RuntimeError as e:
+            sys.exit(e)
+        sys.exit()
+
+    if not args:
         usage()
 
-    if sys.argv[1] == '-d':
-        if len(sys.argv) < 3:
+    if args[0] == '-d':
+        if len(args) < 2:
+            usage()
+
+        print(f'Remove domains {", ".join(args[1:])} from certificate subj list')
+        not_found = Cert().delete_domains(args[1:])
+        if not_found:
+            sys.exit(f'Domain not found {", ".join(not_found)}')
+    elif args[0] in ('--list', '--export'):
+        usage()
+    elif args[0] == '--import':
+        if len(args) != 2:
             usage()
 
-        for domain_name in sys.argv[2:]:
-            print(f'Remove domain `{domain_name}` from certificate subj list')
-            Cert().delete_domain(domain_name)
-    elif sys.argv[1] == '--list':
+        try:
+            if args[1] == '-':
+                added = Cert().registry.import_file(sys.stdin)
+            else:
+                with open(args[1]) as import_file:
+                    added = Cert().registry.import_file(import_file)
+        except (OSError, ValueError) as e:
+            sys.exit(e)
+        print(f'Added {len(added)} domains to certificate subj list')
+    else:
+        print(f'Add domains {", ".join(args)} to certificate subj list')
+        try:
+            Cert().add_domains(args)
+        except ValueError as e:
+            sys.exit(e)
+
+    ca = Ca(key_alg=key_alg)
+    if shards:
+        sharded = Shards(ca, count=shards, key_alg=key_alg)
         domain_names = Cert().list_domains()
-        print(*domain_names, sep='\n')
-        sys.exit()
+        prepare = None
+
+        def issue():
+            sharded.issue(domain_names, rotate=rotate_key)
+
+        def deploy():
+            if not utils.is_installed('nginx'):
+                sys.exit('`Nginx` is not installed. Skip install Nginx certificates')
+            if sharded.deploy(domain_names):
+                Nginx.reload()
+            else:
+                print('Nginx certificates are up to date. Skip nginx reload')
+            Nginx.print_shard_config(NGINX_SHARD_MAP)
     else:
-        for domain_name in sys.argv[1:]:
-            print(f'Add domain `{domain_name}` to certificate subj list')
-            Cert().add_domain(domain_name)
+        cert = Cert(ca, key_alg=key_alg)
 
-    # check CA key/crt or make new
-    ca = Ca()
+        def prepare():
+            cert.find_or_new_csr_key(rotate=rotate_key)
+
+        def issue():
+            if cert.is_issued():
+                print('Certificate is up to date. Skip issue')
+            else:
+                cert.issue_cert()
+
+        def deploy():
+            results = deployer.deploy(cert.key, cert.crt)
+            Deployer.print_results(results)
+            deployer.print_config(key_alg, results)
+            failed = [target_name for target_name, result in results.items() if result['status'] == 'failed']
+            if failed:
+                raise RuntimeError(f'Deploy to {", ".join(failed)} failed')
+
+    # CA trust, NSS and the certificate as stages, independent ones run at once
     try:
-        ca.find_or_new_ca_key()
-        ca.find_or_new_ca_crt()
+        Setup(ca, issue, prepare=prepare, deploy=deploy if deployer.targets else None, concurrency=jobs,
+              nss_dirs=nss_dirs).run()
     except RuntimeError as e:
         sys.exit(e)
-
-    # setup NSS
-    ca_serial = Ca.get_crt_serial(ca.ca_crt)
-    if not utils.is_installed('certutil'):
-        sys.exit('Install `certutil` by your self.\nUbuntu ex.\n\tsudo apt install libnss3-tools\nOr browsers will not '
-                 'trust your https')
-
-    found_nss_dirs = Nss.find()
-    if not found_nss_dirs:
-        sys.exit('NSS dirs not found\nBrowsers will not trust your https')
-    for nss_dir in found_nss_dirs:
-        nss_ca_serial = Nss.get_crt_serial(nss_dir)
-        if not nss_ca_serial:
-            Nss.install_ca(nss_dir)
-        elif nss_ca_serial != ca_serial:
-            Nss.delete_cert(nss_dir)
-            Nss.install_ca(nss_dir)
-
-    # issue cert
-    cert = Cert(ca)
-    cert.issue_csr_key()
-    cert.issue_cert()
-
-    # install cert to nginx
-    if NGINX_USE:
-        if utils.is_installed('nginx'):
-            try:
-                utils.copy(cert.key, NGINX_KEY)
-                utils.copy(cert.crt, NGINX_CRT)
-            except RuntimeError as e:
-                sys.exit(e)
-
-            Nginx.restart()
-            print("Don't forget edit nginx config")
-            print('\tlisten 443 ssl http2;')
-            print(f'\tssl_certificate_key {NGINX_KEY};')
-            print(f'\tssl_certificate {NGINX_CRT};')
-        else:
-            print('`Nginx` is not installed. Skip install Nginx certificates')
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+import signal
+import sys
+from os.path import basename
+
+from swcertificate.backend import check_key_alg
+from swcertificate.daemon import serve
+from swcertificate.nss import Nss
+from swcertificate.settings import CERT_SHARDS, DAEMON_SOCKET, KEY_ALG, NSS_DIRS
+
+# pylint: disable=pointless-string-statement
+'''
+Keeps CA, NSS discovery and trust state warm, serves swcert over a unix socket.
+One JSON request per line, one JSON response per line:
+    {"cmd": "add", "domains": ["somehost.lan"], "issue": true}
+    {"cmd": "remove", "domains": ["somehost.lan"], "issue": true}
+    {"cmd": "list"}
+    {"cmd": "issue", "rotate": false}
+
+Usage:
+sudo swcertd [--socket <path>] [--all-users]
+'''
+
+
+def usage():
+    msg = 'Usage:\n'
+    msg += f'\t{basename(__file__)} [--socket <path>] [--key-alg <alg>] [--shards <count>] [--all-users]\n'
+    msg += f'\tdefault socket {DAEMON_SOCKET}\n'
+    sys.exit(msg)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    all_users = '--all-users' in args  # browsers of every user, homes are taken once at start
+    if all_users:
+        args.remove('--all-users')
+    options = {'--socket': DAEMON_SOCKET, '--key-alg': KEY_ALG, '--shards': CERT_SHARDS}
+    while args:
+        if args[0] not in options or len(args) < 2:
+            usage()
+        options[args[0]] = args[1]
+        args = args[2:]
+
+    try:
+        check_key_alg(options['--key-alg'])
+        shards = int(options['--shards'])
+    except ValueError as e:
+        sys.exit(e)
+
+    signal.signal(signal.SIGTERM, lambda _signum, _frame: sys.exit())
+    serve(options['--socket'], key_alg=options['--key-alg'], shards=shards,
+          nss_dirs=Nss.all_users_dirs() if all_users else NSS_DIRS)
@@ -1,8 +1,32 @@
 # empty list
 # sudo with alert
 
-from . import utils
-from .ca import Ca
-from .cert import Cert
-from .nginx import Nginx
-from .nss import Nss
+import importlib
+
+# submodules are imported on first use, `swcert --list` does not need crypto or NSS
+_LAZY = {
+    'utils': ('.utils', None),
+    'Ca': ('.ca', 'Ca'),
+    'Cert': ('.cert', 'Cert'),
+    'Ledger': ('.ledger', 'Ledger'),
+    'Nginx': ('.nginx', 'Nginx'),
+    'Nss': ('.nss', 'Nss'),
+    'Shards': ('.shard', 'Shards'),
+    'Trust': ('.trust', 'Trust'),
+}
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    module_name, attr = _LAZY[name]
+    module = importlib.import_module(module_name, __name__)
+    value = getattr(module, attr) if attr else module
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
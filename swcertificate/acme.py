@@ -0,0 +1,484 @@
+import asyncio
+import base64
+import datetime
+import hashlib
+import json
+import os
+import secrets
+import ssl
+import sys
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from . import utils
+from .backend import Signer
+from .settings import ACME_CERT_DAYS, ACME_HOME, ACME_HOST, ACME_LOCAL_SUFFIXES, ACME_NONCE_MAX, ACME_NONCE_TTL, \
+    ACME_ORDER_DAYS, ACME_PORT, ACME_TLS
+
+try:
+    from cryptography import x509
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding, rsa
+    from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+except ImportError:  # pragma: no cover - checked by Signer
+    x509 = None
+
+ERROR_NS = 'urn:ietf:params:acme:error:'
+MAX_BODY = 1024 * 1024
+
+
+def b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def is_local(domain, suffixes=ACME_LOCAL_SUFFIXES):
+    name = domain[2:] if domain.startswith('*.') else domain
+    return any(name == suffix or name.endswith('.' + suffix) for suffix in suffixes)
+
+
+class AcmeError(Exception):
+    """RFC 8555 problem document"""
+
+    def __init__(self, error_type, detail, status=400):
+        super().__init__(detail)
+        self.error_type = error_type
+        self.detail = detail
+        self.status = status
+
+
+class Jws:
+    """Flattened JWS of an ACME request, RFC 8555 section 6.2"""
+    HEADER_TYPES = {'alg': str, 'nonce': str, 'url': str, 'kid': str, 'jwk': dict}
+
+    def __init__(self, body):
+        try:
+            jws = json.loads(body)
+            self.protected = json.loads(b64decode(jws['protected']))
+            if not isinstance(self.protected, dict):
+                raise ValueError('protected header is not an object')
+            for name, kind in Jws.HEADER_TYPES.items():
+                if name in self.protected and not isinstance(self.protected[name], kind):
+                    raise ValueError(f'`{name}` is not {kind.__name__}')
+            self.payload_b64 = jws['payload']
+            self.signature = b64decode(jws['signature'])
+            self.signing_input = f'{jws["protected"]}.{jws["payload"]}'.encode('ascii')
+        except (ValueError, KeyError, TypeError) as e:
+            raise AcmeError('malformed', f'Bad JWS: {e}')
+
+    @property
+    def payload(self):
+        """None for POST-as-GET"""
+        if not self.payload_b64:
+            return None
+        try:
+            payload = json.loads(b64decode(self.payload_b64))
+        except ValueError as e:
+            raise AcmeError('malformed', f'Bad payload: {e}')
+        if not isinstance(payload, dict):
+            raise AcmeError('malformed', 'Bad payload: not an object')
+        return payload
+
+    def verify(self, jwk):
+        alg = self.protected.get('alg')
+        public_key = Jws.public_key(jwk)
+        try:
+            if alg == 'RS256' and isinstance(public_key, rsa.RSAPublicKey):
+                public_key.verify(self.signature, self.signing_input, padding.PKCS1v15(), hashes.SHA256())
+            elif alg in ('ES256', 'ES384') and isinstance(public_key, ec.EllipticCurvePublicKey):
+                half = len(self.signature) // 2
+                signature = encode_dss_signature(int.from_bytes(self.signature[:half], 'big'),
+                                                 int.from_bytes(self.signature[half:], 'big'))
+                digest = hashes.SHA256() if alg == 'ES256' else hashes.SHA384()
+                public_key.verify(signature, self.signing_input, ec.ECDSA(digest))
+            elif alg == 'EdDSA' and isinstance(public_key, ed25519.Ed25519PublicKey):
+                public_key.verify(self.signature, self.signing_input)
+            else:
+                raise AcmeError('badSignatureAlgorithm', f'Unsupported alg `{alg}` for this key')
+        except InvalidSignature:
+            raise AcmeError('malformed', 'JWS signature is invalid')
+
+    @staticmethod
+    def public_key(jwk):
+        try:
+            if jwk['kty'] == 'RSA':
+                return rsa.RSAPublicNumbers(int.from_bytes(b64decode(jwk['e']), 'big'),
+                                            int.from_bytes(b64decode(jwk['n']), 'big')).public_key()
+            if jwk['kty'] == 'EC':
+                curve = {'P-256': ec.SECP256R1(), 'P-384': ec.SECP384R1()}[jwk['crv']]
+                return ec.EllipticCurvePublicNumbers(int.from_bytes(b64decode(jwk['x']), 'big'),
+                                                     int.from_bytes(b64decode(jwk['y']), 'big'), curve).public_key()
+            if jwk['kty'] == 'OKP' and jwk['crv'] == 'Ed25519':
+                return ed25519.Ed25519PublicKey.from_public_bytes(b64decode(jwk['x']))
+        except (KeyError, ValueError, TypeError) as e:
+            raise AcmeError('badPublicKey', f'Bad JWK: {e}')
+        raise AcmeError('badPublicKey', f'Unsupported JWK type `{jwk.get("kty")}`')
+
+    @staticmethod
+    def thumbprint(jwk):
+        """RFC 7638"""
+        members = {'RSA': ('e', 'kty', 'n'), 'EC': ('crv', 'kty', 'x', 'y'), 'OKP': ('crv', 'kty', 'x')}
+        fields = members.get(jwk.get('kty'), sorted(jwk))
+        canonical = json.dumps({key: jwk[key] for key in fields}, separators=(',', ':'), sort_keys=True)
+        return b64encode(hashlib.sha256(canonical.encode('utf-8')).digest())
+
+
+class AcmeServer:
+    """RFC 8555 ACME server issuing from the swcert CA.
+    State is kept in memory, challenges for local names are valid right away.
+    Nonces are kept up to nonce_ttl seconds and nonce_max at most, orders and authorizations until their `expires`"""
+
+    def __init__(self, ca, host=ACME_HOST, port=ACME_PORT, tls=ACME_TLS, days=ACME_CERT_DAYS,
+                 local_suffixes=ACME_LOCAL_SUFFIXES, order_days=ACME_ORDER_DAYS, nonce_ttl=ACME_NONCE_TTL,
+                 nonce_max=ACME_NONCE_MAX):
+        self.signer = Signer(ca.ca_key, ca.ca_crt)
+        self.host = host
+        self.port = port
+        self.tls = tls
+        self.days = days
+        self.local_suffixes = local_suffixes
+        self.order_days = order_days
+        self.nonce_ttl = nonce_ttl
+        self.nonce_max = nonce_max
+        self.nonces = OrderedDict()  # nonce: monotonic time issued, oldest first
+        self.accounts = {}  # id: account
+        self.thumbprints = {}  # jwk thumbprint: account id
+        self.orders = {}
+        self.authzs = {}
+        self.certs = {}  # id: pem chain
+        self.server = None
+
+    @property
+    def base_url(self):
+        scheme = 'https' if self.tls else 'http'
+        return f'{scheme}://{self.host}:{self.port}'
+
+    def url(self, *parts):
+        return '/'.join((self.base_url, 'acme') + parts)
+
+    async def start(self):
+        ssl_context = self.make_ssl_context() if self.tls else None
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port, ssl=ssl_context)
+        if not self.port:  # ephemeral
+            self.port = self.server.sockets[0].getsockname()[1]
+        print(f'ACME directory {self.base_url}/directory')
+        return self.server
+
+    def make_ssl_context(self, acme_home=ACME_HOME):
+        """https for the ACME API itself, signed by the swcert CA the clients already trust"""
+        os.makedirs(acme_home, exist_ok=True)
+        key = os.path.join(acme_home, 'server.key')
+        crt = os.path.join(acme_home, 'server.crt')
+        private_key = ec.generate_private_key(ec.SECP256R1())
+        cert = self.signer.sign(private_key.public_key(), [self.host], days=self.days)
+        with open(os.open(key, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+            f.write(private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                              serialization.NoEncryption()))
+        with open(crt, 'wb') as f:
+            f.write(cert.public_bytes(serialization.Encoding.PEM) + self.signer.ca_pem)
+        utils.set_real_owner(key)
+        utils.set_real_owner(crt)
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(crt, key)
+        return ssl_context
+
+    async def handle_client(self, reader, writer):
+        """HTTP/1.1 with keep-alive"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _version = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode('latin-1')
+                    if line in ('\r\n', '\n', ''):
+                        break
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY:
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                status, response_headers, response_body = await self.dispatch(method, urlsplit(target).path, body)
+                if method == 'HEAD':
+                    response_body = b''
+                response_headers['Content-Length'] = str(len(response_body))
+                head = f'HTTP/1.1 {status} {"OK" if status < 400 else "Error"}\r\n'
+                head += ''.join(f'{name}: {value}\r\n' for name, value in response_headers.items())
+                writer.write(head.encode('latin-1') + b'\r\n' + response_body)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ValueError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, path, body):
+        """returns status, headers, body"""
+        headers = {'Replay-Nonce': self.new_nonce(), 'Cache-Control': 'no-store',
+                   'Link': f'<{self.base_url}/directory>;rel="index"'}
+        try:
+            if path == '/directory' and method in ('GET', 'HEAD'):
+                return 200, {**headers, 'Content-Type': 'application/json'}, self.json(self.directory())
+            if path == '/acme/new-nonce' and method in ('GET', 'HEAD'):
+                return (204 if method == 'GET' else 200), headers, b''
+            if method != 'POST':
+                raise AcmeError('malformed', f'{method} {path} is not allowed', status=405)
+
+            jws = Jws(body)
+            account_id = self.verify(jws, path)
+            parts = path.strip('/').split('/')
+            if path == '/acme/new-account':
+                status, location, resource = self.new_account(jws)
+            elif path == '/acme/new-order':
+                status, location, resource = self.new_order(account_id, jws.payload)
+            elif path == '/acme/revoke-cert':
+                status, location, resource = 200, None, {}
+            elif len(parts) == 3 and parts[:2] == ['acme', 'acct']:
+                status, location, resource = 200, self.url('acct', parts[2]), self.account(account_id, parts[2])
+            elif len(parts) == 4 and parts[:2] == ['acme', 'acct'] and parts[3] == 'orders':
+                status, location, resource = 200, None, self.account_orders(account_id, parts[2])
+            elif len(parts) == 3 and parts[:2] == ['acme', 'order']:
+                status, location, resource = 200, self.url('order', parts[2]), self.order(account_id, parts[2])
+            elif len(parts) == 4 and parts[:2] == ['acme', 'order'] and parts[3] == 'finalize':
+                order = await self.finalize(account_id, parts[2], jws.payload)
+                status, location, resource = 200, self.url('order', parts[2]), order
+            elif len(parts) == 3 and parts[:2] == ['acme', 'authz']:
+                status, location, resource = 200, None, self.authz(parts[2])
+            elif len(parts) == 3 and parts[:2] == ['acme', 'chall']:
+                status, location, resource = 200, None, self.challenge(parts[2])
+            elif len(parts) == 3 and parts[:2] == ['acme', 'cert']:
+                if parts[2] not in self.certs:
+                    raise AcmeError('malformed', 'No such certificate', status=404)
+                return 200, {**headers, 'Content-Type': 'application/pem-certificate-chain'}, self.certs[parts[2]]
+            else:
+                raise AcmeError('malformed', f'No such resource {path}', status=404)
+        except AcmeError as e:
+            problem = {'type': ERROR_NS + e.error_type, 'detail': e.detail, 'status': e.status}
+            return e.status, {**headers, 'Content-Type': 'application/problem+json'}, self.json(problem)
+
+        if location:
+            headers['Location'] = location
+        return status, {**headers, 'Content-Type': 'application/json'}, self.json(resource)
+
+    def directory(self):
+        return {
+            'newNonce': self.url('new-nonce'),
+            'newAccount': self.url('new-account'),
+            'newOrder': self.url('new-order'),
+            'revokeCert': self.url('revoke-cert'),
+            'meta': {'website': 'https://github.com/zlietapki/swcert'},
+        }
+
+    def new_nonce(self):
+        now = time.monotonic()
+        while self.nonces and (len(self.nonces) >= self.nonce_max or
+                               now - next(iter(self.nonces.values())) >= self.nonce_ttl):
+            self.nonces.popitem(last=False)
+        nonce = secrets.token_urlsafe(16)
+        self.nonces[nonce] = now
+        return nonce
+
+    def verify(self, jws, path):
+        """checks nonce, url and signature, returns account id or None for new-account"""
+        protected = jws.protected
+        issued = self.nonces.pop(protected.get('nonce'), None)
+        if issued is None or time.monotonic() - issued >= self.nonce_ttl:
+            raise AcmeError('badNonce', 'Bad, reused or expired nonce')
+        if urlsplit(protected.get('url', '')).path != path:
+            raise AcmeError('unauthorized', 'JWS url does not match request url', status=401)
+
+        if path == '/acme/new-account':
+            if 'jwk' not in protected:
+                raise AcmeError('malformed', 'new-account needs `jwk`')
+            jws.verify(protected['jwk'])
+            return None
+
+        account_id = protected.get('kid', '').rsplit('/', 1)[-1]
+        if 'kid' not in protected or account_id not in self.accounts:
+            raise AcmeError('accountDoesNotExist', 'Unknown account `kid`', status=401)
+        jws.verify(self.accounts[account_id]['key'])
+        return account_id
+
+    def new_account(self, jws):
+        thumbprint = Jws.thumbprint(jws.protected['jwk'])
+        payload = jws.payload or {}
+        if thumbprint in self.thumbprints:
+            account_id = self.thumbprints[thumbprint]
+            return 200, self.url('acct', account_id), self.account(account_id, account_id)
+        if payload.get('onlyReturnExisting'):
+            raise AcmeError('accountDoesNotExist', 'No account for this key')
+
+        account_id = secrets.token_urlsafe(8)
+        self.accounts[account_id] = {
+            'status': 'valid',
+            'contact': payload.get('contact', []),
+            'orders': self.url('acct', account_id, 'orders'),
+            'key': jws.protected['jwk'],
+        }
+        self.thumbprints[thumbprint] = account_id
+        return 201, self.url('acct', account_id), self.account(account_id, account_id)
+
+    def account(self, account_id, requested_id):
+        if account_id != requested_id:
+            raise AcmeError('unauthorized', 'Not your account', status=403)
+        return self.accounts[account_id]
+
+    def account_orders(self, account_id, requested_id):
+        """RFC 8555 7.1.2.1 orders list, invalid and expired orders are left out"""
+        self.account(account_id, requested_id)
+        return {'orders': [self.url('order', order_id) for order_id, order in self.orders.items()
+                           if order['account'] == account_id and order['status'] != 'invalid'
+                           and not AcmeServer.is_expired(order)]}
+
+    def new_order(self, account_id, payload):
+        identifiers = (payload or {}).get('identifiers') or []
+        domains = []
+        for identifier in identifiers:
+            if identifier.get('type') != 'dns':
+                raise AcmeError('rejectedIdentifier', f'Only dns identifiers: {identifier}')
+            domain = identifier.get('value', '').lower().rstrip('.')
+            if not is_local(domain, self.local_suffixes):
+                raise AcmeError('rejectedIdentifier', f'`{domain}` is not a local name: '
+                                f'{", ".join(self.local_suffixes)}')
+            domains.append(domain)
+        if not domains:
+            raise AcmeError('malformed', 'Order has no identifiers')
+
+        self.expire()
+        order_id = secrets.token_urlsafe(8)
+        expires = self.expires(self.order_days)
+        authorizations = [self.new_authz(domain, expires) for domain in domains]
+        self.orders[order_id] = {
+            'account': account_id,
+            'status': 'ready',  # local names are authorized right away
+            'expires': expires,
+            'identifiers': [{'type': 'dns', 'value': domain} for domain in domains],
+            'authorizations': authorizations,
+            'finalize': self.url('order', order_id, 'finalize'),
+        }
+        return 201, self.url('order', order_id), self.public(self.orders[order_id])
+
+    def new_authz(self, domain, expires):
+        authz_id = secrets.token_urlsafe(8)
+        validated = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        authz = {
+            'identifier': {'type': 'dns', 'value': domain[2:] if domain.startswith('*.') else domain},
+            'status': 'valid',
+            'expires': expires,
+            'challenges': [{
+                'type': challenge_type,
+                'url': self.url('chall', f'{authz_id}.{challenge_type}'),
+                'token': secrets.token_urlsafe(32),
+                'status': 'valid',
+                'validated': validated,
+            } for challenge_type in ('http-01', 'dns-01', 'tls-alpn-01')],
+        }
+        if domain.startswith('*.'):
+            authz['wildcard'] = True
+        self.authzs[authz_id] = authz
+        return self.url('authz', authz_id)
+
+    def order(self, account_id, order_id):
+        return self.public(self.find_order(account_id, order_id))
+
+    def find_order(self, account_id, order_id):
+        order = self.orders.get(order_id)
+        if not order or order['account'] != account_id or AcmeServer.is_expired(order):
+            raise AcmeError('malformed', 'No such order', status=404)
+        return order
+
+    def authz(self, authz_id):
+        authz = self.authzs.get(authz_id)
+        if not authz or AcmeServer.is_expired(authz):
+            raise AcmeError('malformed', 'No such authorization', status=404)
+        return authz
+
+    def challenge(self, challenge_id):
+        authz_id, _, _challenge_type = challenge_id.partition('.')
+        for challenge in self.authz(authz_id)['challenges']:
+            if challenge['url'].endswith('/' + challenge_id):
+                return challenge
+        raise AcmeError('malformed', 'No such challenge', status=404)
+
+    async def finalize(self, account_id, order_id, payload):
+        order = self.find_order(account_id, order_id)
+        if order['status'] != 'ready':
+            raise AcmeError('orderNotReady', f'Order is {order["status"]}', status=403)
+        try:
+            request = x509.load_der_x509_csr(b64decode((payload or {})['csr']))
+        except (KeyError, ValueError, TypeError) as e:
+            raise AcmeError('badCSR', f'Bad CSR: {e}')
+        if not request.is_signature_valid:
+            raise AcmeError('badCSR', 'CSR signature is invalid')
+
+        domains = sorted(identifier['value'] for identifier in order['identifiers'])
+        try:
+            san = request.extensions.get_extension_for_class(x509.SubjectAlternativeName)
+            csr_domains = san.value.get_values_for_type(x509.DNSName)
+        except x509.ExtensionNotFound:
+            csr_domains = []
+        if sorted({domain.lower() for domain in csr_domains}) != domains:
+            raise AcmeError('badCSR', f'CSR names must be exactly the order names: {", ".join(domains)}')
+
+        order['status'] = 'processing'
+        loop = asyncio.get_running_loop()
+        cert = await loop.run_in_executor(None, self.signer.sign, request.public_key(), domains, None, self.days)
+        cert_id = secrets.token_urlsafe(8)
+        self.certs[cert_id] = cert.public_bytes(serialization.Encoding.PEM) + self.signer.ca_pem
+        order['status'] = 'valid'
+        order['certificate'] = self.url('cert', cert_id)
+        print(f'Issued {", ".join(domains)}')
+        return self.public(order)
+
+    def expire(self):
+        """drops orders and authorizations past their `expires`, certificates of dropped orders too"""
+        now = AcmeServer.expires(0)
+        for order_id, order in list(self.orders.items()):
+            if order['expires'] <= now:
+                del self.orders[order_id]
+                if 'certificate' in order:
+                    self.certs.pop(order['certificate'].rsplit('/', 1)[-1], None)
+        for authz_id, authz in list(self.authzs.items()):
+            if authz['expires'] <= now:
+                del self.authzs[authz_id]
+
+    @staticmethod
+    def expires(days):
+        """RFC 3339 UTC, compares as strings"""
+        expires = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=days)
+        return expires.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    @staticmethod
+    def is_expired(resource):
+        return resource['expires'] <= AcmeServer.expires(0)
+
+    @staticmethod
+    def public(order):
+        return {key: value for key, value in order.items() if key != 'account'}
+
+    @staticmethod
+    def json(data):
+        return json.dumps(data).encode('utf-8')
+
+
+def serve(ca, **server_params):
+    async def main():
+        acme = AcmeServer(ca, **server_params)
+        server = await acme.start()
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print('swcert-acme stopped', file=sys.stderr)
@@ -0,0 +1,362 @@
+import datetime
+import os
+import re
+import sys
+
+from . import utils
+from .settings import CA_SUBJ, CERT_DAYS, CERT_SUBJ, CRYPTO_BACKEND, KEY_ALG, SW_HOME
+
+try:
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+    from cryptography.x509.oid import NameOID
+except ImportError:  # pragma: no cover - openssl CLI fallback
+    x509 = None
+
+KEY_ALGS = ('rsa:2048', 'rsa:3072', 'rsa:4096', 'ec:P-256', 'ec:P-384', 'ed25519')
+
+
+def check_key_alg(key_alg):
+    if key_alg not in KEY_ALGS:
+        raise ValueError(f'Unknown key algorithm `{key_alg}`. Use one of: {", ".join(KEY_ALGS)}')
+
+
+class OpensslBackend:
+    """Forks `openssl` for every operation"""
+    name = 'openssl'
+
+    @staticmethod
+    def check_key(key):
+        return utils.subproc(run=['openssl', 'pkey', '-check', '-noout', '-in', key])
+
+    @staticmethod
+    def make_key(key, key_alg=KEY_ALG):
+        check_key_alg(key_alg)
+        alg, _, param = key_alg.partition(':')
+        if alg == 'rsa':
+            options = ['-algorithm', 'RSA', '-pkeyopt', f'rsa_keygen_bits:{param}']
+        elif alg == 'ec':
+            options = ['-algorithm', 'EC', '-pkeyopt', f'ec_paramgen_curve:{param}',
+                       '-pkeyopt', 'ec_param_enc:named_curve']
+        else:
+            options = ['-algorithm', 'ED25519']
+        utils.subproc(run=['openssl', 'genpkey', *options, '-out', key], exit_on_fail=True)
+
+    @staticmethod
+    def get_key_alg(key):
+        """returns key algorithm as in KEY_ALGS or False"""
+        try:
+            complete = utils.subproc_out(run=['openssl', 'pkey', '-noout', '-text_pub', '-in', key])
+        except RuntimeError:
+            return False
+        out_decoded = complete.stdout.decode('utf-8')
+        if out_decoded.startswith('ED25519'):
+            return 'ed25519'
+        m = re.search(r'NIST CURVE: (\S+)', out_decoded)
+        if m:
+            return f'ec:{m.group(1)}'
+        m = re.search(r'Public-Key: \((\d+) bit\)\nModulus', out_decoded)
+        if m:
+            return f'rsa:{m.group(1)}'
+        return False
+
+    @staticmethod
+    def get_crt_serial(crt):
+        """returns Serial Number or False"""
+        try:
+            complete = utils.subproc_out(run=['openssl', 'x509', '-text', '-noout', '-in', crt])
+        except RuntimeError:
+            return False
+        out_decoded = complete.stdout.decode('utf-8')
+        m = re.search(r'Serial Number:\n\s*([^\n]+)', out_decoded)
+        return m.group(1)
+
+    @staticmethod
+    def get_crt_fingerprint(crt):
+        """returns sha256 fingerprint ab:cd:... or False"""
+        try:
+            complete = utils.subproc_out(run=['openssl', 'x509', '-noout', '-fingerprint', '-sha256', '-in', crt])
+        except RuntimeError:
+            return False
+        out_decoded = complete.stdout.decode('utf-8')
+        return out_decoded.strip().split('=', 1)[1].lower()
+
+    @staticmethod
+    def make_ca_crt(ca_key, ca_crt, subj=CA_SUBJ, days=CERT_DAYS):
+        utils.subproc(run=[
+            'openssl', 'req', '-x509', '-new', '-nodes', '-sha256',
+            '-days', str(days),
+            '-subj', subj,
+            '-key', ca_key,
+            '-out', ca_crt
+        ], exit_on_fail=True)
+
+    @staticmethod
+    def make_csr_key(key, csr, subj=CERT_SUBJ, key_alg=KEY_ALG):
+        check_key_alg(key_alg)
+        alg, _, param = key_alg.partition(':')
+        if alg == 'rsa':
+            newkey = [key_alg]
+        elif alg == 'ec':
+            newkey = ['ec', '-pkeyopt', f'ec_paramgen_curve:{param}']
+        else:
+            newkey = ['ed25519']
+        utils.subproc(run=[
+            'openssl', 'req', '-newkey', *newkey, '-nodes',
+            '-keyout', key,
+            '-subj', subj,
+            '-out', csr
+        ], exit_on_fail=True)
+
+    @staticmethod
+    def make_csr(key, csr, subj=CERT_SUBJ):
+        utils.subproc(run=['openssl', 'req', '-new', '-key', key, '-subj', subj, '-out', csr], exit_on_fail=True)
+
+    @staticmethod
+    def sign_csr(csr, crt, ca_key, ca_crt, domains, days=CERT_DAYS):
+        san_str = ','.join('DNS:' + fqdn for fqdn in domains)
+        san_file = f'{SW_HOME}/san'
+        with open(san_file, 'w') as san:
+            san.write(f'subjectAltName={san_str}')
+
+        utils.subproc(run=[
+            'openssl', 'x509', '-req', '-extfile', san_file,
+            '-CAcreateserial',
+            '-days', str(days),
+            '-CA', ca_crt,
+            '-CAkey', ca_key,
+            '-in', csr,
+            '-out', crt
+        ], exit_on_fail=True)
+        os.remove(san_file)
+
+
+class CryptographyBackend:
+    """Does everything in-process with the `cryptography` package"""
+    name = 'cryptography'
+
+    @staticmethod
+    def check_key(key):
+        try:
+            _load_key(key)
+        except (OSError, ValueError, TypeError):
+            return False
+        return True
+
+    @staticmethod
+    def make_key(key, key_alg=KEY_ALG):
+        check_key_alg(key_alg)
+        try:
+            _write_key(key, _new_key(key_alg))
+        except OSError as e:
+            sys.exit(str(e))
+
+    @staticmethod
+    def get_key_alg(key):
+        """returns key algorithm as in KEY_ALGS or False"""
+        try:
+            private_key = _load_key(key)
+        except (OSError, ValueError, TypeError):
+            return False
+        if isinstance(private_key, rsa.RSAPrivateKey):
+            return f'rsa:{private_key.key_size}'
+        if isinstance(private_key, ec.EllipticCurvePrivateKey):
+            return f'ec:{_CURVES.get(private_key.curve.name, private_key.curve.name)}'
+        if isinstance(private_key, ed25519.Ed25519PrivateKey):
+            return 'ed25519'
+        return False
+
+    @staticmethod
+    def get_crt_serial(crt):
+        """returns Serial Number or False"""
+        try:
+            cert = _load_crt(crt)
+        except (OSError, ValueError):
+            return False
+        return _format_serial(cert.serial_number)
+
+    @staticmethod
+    def get_crt_fingerprint(crt):
+        """returns sha256 fingerprint ab:cd:... or False"""
+        try:
+            cert = _load_crt(crt)
+        except (OSError, ValueError):
+            return False
+        return ':'.join(f'{b:02x}' for b in cert.fingerprint(hashes.SHA256()))
+
+    @staticmethod
+    def make_ca_crt(ca_key, ca_crt, subj=CA_SUBJ, days=CERT_DAYS):
+        try:
+            key = _load_key(ca_key)
+            name = _parse_subj(subj)
+            now = datetime.datetime.now(datetime.timezone.utc)
+            ski = x509.SubjectKeyIdentifier.from_public_key(key.public_key())
+            cert = x509.CertificateBuilder() \
+                .subject_name(name) \
+                .issuer_name(name) \
+                .public_key(key.public_key()) \
+                .serial_number(x509.random_serial_number()) \
+                .not_valid_before(now) \
+                .not_valid_after(now + datetime.timedelta(days=days)) \
+                .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True) \
+                .add_extension(ski, critical=False) \
+                .add_extension(x509.AuthorityKeyIdentifier.from_issuer_subject_key_identifier(ski), critical=False) \
+                .sign(key, _digest(key))
+            _write(ca_crt, cert.public_bytes(serialization.Encoding.PEM))
+        except (OSError, ValueError) as e:
+            sys.exit(str(e))
+
+    @staticmethod
+    def make_csr_key(key, csr, subj=CERT_SUBJ, key_alg=KEY_ALG):
+        check_key_alg(key_alg)
+        try:
+            private_key = _new_key(key_alg)
+            _write_key(key, private_key)
+            _write_csr(csr, private_key, subj)
+        except (OSError, ValueError) as e:
+            sys.exit(str(e))
+
+    @staticmethod
+    def make_csr(key, csr, subj=CERT_SUBJ):
+        try:
+            _write_csr(csr, _load_key(key), subj)
+        except (OSError, ValueError, TypeError) as e:
+            sys.exit(str(e))
+
+    @staticmethod
+    def sign_csr(csr, crt, ca_key, ca_crt, domains, days=CERT_DAYS):
+        try:
+            with open(csr, 'rb') as f:
+                request = x509.load_pem_x509_csr(f.read())
+            cert = Signer(ca_key, ca_crt).sign(request.public_key(), domains, subject=request.subject, days=days)
+            _write(crt, cert.public_bytes(serialization.Encoding.PEM))
+        except (OSError, ValueError) as e:
+            sys.exit(str(e))
+
+
+class Signer:
+    """CA key and crt loaded once for many signatures. Needs `cryptography`"""
+
+    def __init__(self, ca_key, ca_crt):
+        if x509 is None:
+            raise RuntimeError('Install `cryptography` python package')
+        self.ca_private_key = _load_key(ca_key)
+        self.ca_cert = _load_crt(ca_crt)
+        self.ca_pem = self.ca_cert.public_bytes(serialization.Encoding.PEM)
+
+    @staticmethod
+    def new_key(key_alg):
+        """returns a new private key object"""
+        check_key_alg(key_alg)
+        return _new_key(key_alg)
+
+    def sign(self, public_key, domains, subject=None, days=CERT_DAYS):
+        """returns x509.Certificate for domains"""
+        ca_private_key = self.ca_private_key
+        if subject is None:  # CN is limited to 64 chars, SAN is what matters
+            common_names = [x509.NameAttribute(NameOID.COMMON_NAME, domains[0])] if len(domains[0]) <= 64 else []
+            subject = x509.Name(common_names)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return x509.CertificateBuilder() \
+            .subject_name(subject) \
+            .issuer_name(self.ca_cert.subject) \
+            .public_key(public_key) \
+            .serial_number(x509.random_serial_number()) \
+            .not_valid_before(now) \
+            .not_valid_after(now + datetime.timedelta(days=days)) \
+            .add_extension(x509.SubjectAlternativeName([x509.DNSName(fqdn) for fqdn in domains]), critical=False) \
+            .add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(ca_private_key.public_key()),
+                           critical=False) \
+            .sign(ca_private_key, _digest(ca_private_key))
+
+
+BACKENDS = {backend.name: backend for backend in (OpensslBackend, CryptographyBackend)}
+
+
+def get_backend(name=CRYPTO_BACKEND):
+    """`cryptography` falls back to `openssl` if the package is not installed"""
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown crypto backend `{name}`. Use one of: {", ".join(BACKENDS)}')
+    if name == CryptographyBackend.name and x509 is None:
+        return OpensslBackend
+    return BACKENDS[name]
+
+
+_SUBJ_OIDS = {
+    'CN': 'COMMON_NAME',
+    'O': 'ORGANIZATION_NAME',
+    'OU': 'ORGANIZATIONAL_UNIT_NAME',
+    'C': 'COUNTRY_NAME',
+    'ST': 'STATE_OR_PROVINCE_NAME',
+    'L': 'LOCALITY_NAME',
+    'emailAddress': 'EMAIL_ADDRESS',
+}
+
+
+_CURVES = {'secp256r1': 'P-256', 'secp384r1': 'P-384'}
+
+
+def _parse_subj(subj):
+    """openssl `-subj` format /CN=name/O=org -> x509.Name"""
+    attributes = []
+    for part in filter(None, subj.split('/')):
+        field, value = part.split('=', 1)
+        if field not in _SUBJ_OIDS:
+            raise ValueError(f'Unsupported subject field `{field}` in {subj}')
+        attributes.append(x509.NameAttribute(getattr(NameOID, _SUBJ_OIDS[field]), value))
+    return x509.Name(attributes)
+
+
+def _format_serial(serial):
+    """same format as `openssl x509 -text` prints: 3a:0f:..."""
+    serial_bytes = serial.to_bytes((serial.bit_length() + 7) // 8 or 1, 'big')
+    return ':'.join(f'{b:02x}' for b in serial_bytes)
+
+
+def _new_key(key_alg):
+    alg, _, param = key_alg.partition(':')
+    if alg == 'rsa':
+        return rsa.generate_private_key(public_exponent=65537, key_size=int(param))
+    if alg == 'ec':
+        curve = ec.SECP256R1() if param == 'P-256' else ec.SECP384R1()
+        return ec.generate_private_key(curve)
+    return ed25519.Ed25519PrivateKey.generate()
+
+
+def _digest(private_key):
+    """Ed25519 signs the message itself, no prehash"""
+    if isinstance(private_key, ed25519.Ed25519PrivateKey):
+        return None
+    return hashes.SHA256()
+
+
+def _load_key(key):
+    with open(key, 'rb') as f:
+        return serialization.load_pem_private_key(f.read(), password=None)
+
+
+def _load_crt(crt):
+    with open(crt, 'rb') as f:
+        return x509.load_pem_x509_certificate(f.read())
+
+
+def _write_key(key, private_key):
+    _write(key, private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    ), mode=0o600)
+
+
+def _write_csr(csr, private_key, subj):
+    request = x509.CertificateSigningRequestBuilder() \
+        .subject_name(_parse_subj(subj)) \
+        .sign(private_key, _digest(private_key))
+    _write(csr, request.public_bytes(serialization.Encoding.PEM))
+
+
+def _write(path, data, mode=0o644):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
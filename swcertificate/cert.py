@@ -1,74 +1,133 @@
+import hashlib
+import json
 import os
 import os.path
 import sys
+import time
 
 from . import utils
-from .settings import CA_SRL, CERT_CRT, CERT_CSR, CERT_KEY, CERT_LIST, SW_HOME
+from .backend import get_backend
+from .registry import Registry
+from .settings import CERT_CRT, CERT_CSR, CERT_DAYS, CERT_DIGEST, CERT_KEY, CERT_KEY_MAX_AGE, CERT_LIST, CERT_SUBJ, \
+    KEY_ALG
 
 
 class Cert:
-    def __init__(self, ca=None, cert_list=CERT_LIST, csr=CERT_CSR, key=CERT_KEY, crt=CERT_CRT):
+    def __init__(self, ca=None, cert_list=CERT_LIST, csr=CERT_CSR, key=CERT_KEY, crt=CERT_CRT, backend=None,
+                 key_alg=KEY_ALG, digest=CERT_DIGEST):
         self.ca = ca
         self.cert_list = cert_list
         self.csr = csr
         self.key = key
         self.crt = crt
-        os.makedirs(CERT_LIST, exist_ok=True)
-        utils.set_real_owner(CERT_LIST)
+        self.key_alg = key_alg
+        self.digest = digest
+        self.registry = Registry.of_cert_list(cert_list)
+        self.backend = backend or (ca.backend if ca else get_backend())
 
     def list_domains(self):
-        cert_list = self.cert_list
-        domain_names = sorted(os.listdir(cert_list))
-        return domain_names
+        return list(self.registry.load())
 
     def add_domain(self, name):
-        cert_list = self.cert_list
-        domain_file = os.path.join(cert_list, name)
-        open(domain_file, 'a').close()
-        utils.set_real_owner(domain_file)
+        self.registry.add([name])
+
+    def add_domains(self, names):
+        """returns added domains"""
+        return self.registry.add(names)
 
     def delete_domain(self, name):
-        cert_list = self.cert_list
-        domain_file = os.path.join(cert_list, name)
-        if os.path.isfile(domain_file):
-            os.remove(domain_file)
-        else:
-            sys.exit(f'File not found {domain_file}')
+        if not self.registry.remove([name]):
+            sys.exit(f'Domain not found {name}')
+
+    def delete_domains(self, names):
+        """returns not found domains"""
+        removed = self.registry.remove(names)
+        return sorted({name.lower().rstrip('.') for name in names}.difference(removed))
+
+    def set_domains(self, names):
+        self.registry.replace(names)
+
+    def find_or_new_csr_key(self, rotate=False):
+        """Reuse the key and csr, SAN list is set on signing only"""
+        if rotate or not self.check_key():
+            self.issue_csr_key()
+            return
+
+        csr = self.csr
+        if not os.path.isfile(csr) or os.path.getmtime(csr) < os.path.getmtime(self.key):
+            self.issue_csr()
+
+    def check_key(self, max_age=CERT_KEY_MAX_AGE):
+        key = self.key
+        print(f'Check key {key}')
+        key_alg = self.backend.get_key_alg(key)
+        if key_alg != self.key_alg:
+            return False
+        if max_age and time.time() - os.path.getmtime(key) > max_age * 24 * 60 * 60:
+            print(f'Key is older than {max_age} days')
+            return False
+        return True
+
+    def issue_csr(self):
+        csr = self.csr
+        key = self.key
+        print(f'Issue csr {csr} for key {key}')
+        utils.make_real_dir(os.path.dirname(csr))
+        self.backend.make_csr(key, csr)
+        utils.set_real_owner(csr)
 
     def issue_csr_key(self):
         csr = self.csr
         key = self.key
-        utils.subproc(run=[
-            'openssl', 'req', '-newkey', 'rsa:2048', '-nodes',
-            '-keyout', key,
-            '-subj', '/CN=Outer Rim/O=Tatooine/OU=Skywalker Ltd',
-            '-out', csr
-        ], msg=f'Issue csr {csr} and key {key}', exit_on_fail=True)
+        print(f'Issue csr {csr} and key {key}')
+        utils.make_real_dir(os.path.dirname(csr))
+        utils.make_real_dir(os.path.dirname(key))
+        self.backend.make_csr_key(key, csr, key_alg=self.key_alg)
         utils.set_real_owner(csr)
         utils.set_real_owner(key)
 
-    def issue_cert(self):
+    def issue_cert(self, domains=None):
+        """all domains from the list by default"""
         ca_key = self.ca.ca_key
         ca_crt = self.ca.ca_crt
         csr = self.csr
         crt = self.crt
-        cert_list = self.cert_list
-
-        all_domains = ['DNS:' + fqdn for fqdn in os.listdir(cert_list)]
-        san_str = ','.join(all_domains)
-        san_file = f'{SW_HOME}/san'
-        with open(san_file, 'w') as san:
-            san.write(f'subjectAltName={san_str}')
-
-        utils.subproc(run=[
-            'openssl', 'x509', '-req', '-extfile', san_file,
-            '-CAcreateserial',
-            '-days', '10000',
-            '-CA', ca_crt,
-            '-CAkey', ca_key,
-            '-in', csr,
-            '-out', crt
-        ], msg='Make certificate', exit_on_fail=True)
-        os.remove(san_file)
+
+        if domains is None:
+            domains = self.list_domains()
+        print('Make certificate')
+        self.backend.sign_csr(csr, crt, ca_key, ca_crt, domains)
         utils.set_real_owner(crt)
-        utils.set_real_owner(CA_SRL)
+        with open(self.digest, 'w') as f:
+            f.write(self.issue_digest(domains))
+        utils.set_real_owner(self.digest)
+        ca_srl = os.path.splitext(ca_crt)[0] + '.srl'  # written by `openssl -CAcreateserial` only
+        if os.path.isfile(ca_srl):
+            utils.set_real_owner(ca_srl)
+
+    def issue_digest(self, domains):
+        """hash of everything the certificate depends on: SAN set, CA, key and issue params"""
+        with open(self.key, 'rb') as f:
+            key_hash = hashlib.sha256(f.read()).hexdigest()
+        params = {
+            'domains': sorted({domain.lower() for domain in domains}),
+            'ca': self.backend.get_crt_fingerprint(self.ca.ca_crt),
+            'key_alg': self.key_alg,
+            'key': key_hash,
+            'subj': CERT_SUBJ,
+            'days': CERT_DAYS,
+        }
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def is_issued(self, domains=None):
+        """True if the certificate was issued for the same domains, CA and key"""
+        if not os.path.isfile(self.crt):
+            return False
+        if domains is None:
+            domains = self.list_domains()
+        try:
+            with open(self.digest) as f:
+                digest = f.read().strip()
+            return digest == self.issue_digest(domains)
+        except OSError:
+            return False
@@ -0,0 +1,155 @@
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+
+from . import utils
+from .ca import Ca
+from .cert import Cert
+from .deploy import Deployer
+from .nginx import Nginx
+from .settings import CERT_SHARDS, DAEMON_SOCKET, KEY_ALG, NGINX_USE, NSS_DIRS
+from .shard import Shards
+from .trust import Trust
+
+
+class Engine:
+    """swcert steps with CA, discovery and trust state kept in memory between requests"""
+
+    def __init__(self, ca=None, cert=None, key_alg=KEY_ALG, shards=CERT_SHARDS, deployer=None, nss_dirs=NSS_DIRS):
+        self.key_alg = key_alg
+        self.nss_dirs = nss_dirs
+        self.shards = shards
+        self.ca = ca or Ca(key_alg=key_alg)
+        self.cert = cert or Cert(self.ca, key_alg=key_alg)
+        self.deployer = deployer or Deployer()
+        self.trust = Trust(self.ca)
+        self.issue_lock = threading.Lock()
+
+    def call(self, request):
+        """request: {"cmd": "add", "domains": [...], "issue": true}"""
+        commands = {
+            'list': self.list,
+            'add': self.add,
+            'remove': self.remove,
+            'issue': self.issue,
+        }
+        cmd = request.get('cmd')
+        if cmd not in commands:
+            raise ValueError(f'Unknown command `{cmd}`. Use one of: {", ".join(commands)}')
+        params = {key: value for key, value in request.items() if key != 'cmd'}
+        return commands[cmd](**params)
+
+    def list(self):
+        return self.cert.list_domains()
+
+    def add(self, domains, issue=False):
+        result = {'added': self.cert.add_domains(domains)}
+        if issue:
+            result.update(self.issue())
+        return result
+
+    def remove(self, domains, issue=False):
+        result = {'not_found': self.cert.delete_domains(domains)}
+        if issue:
+            result.update(self.issue())
+        return result
+
+    def issue(self, rotate=False):
+        """one issue at a time, concurrent requests find the certificate up to date"""
+        with self.issue_lock:
+            failed = self.ensure_trusted()
+            deployed = {}
+            if self.shards:
+                issued, reloaded = self._issue_shards(rotate)
+            else:
+                issued, deployed = self._issue_cert(rotate)
+                reloaded = any(result['status'] == 'reloaded' for result in deployed.values())
+        return {'issued': issued, 'reloaded': reloaded, 'deployed': deployed, 'nss_failed': failed}
+
+    def ensure_trusted(self):
+        """returns {nss_dir: error} of NSS dirs which failed"""
+        return self.trust.ensure(self.nss_dirs)
+
+    def _issue_cert(self, rotate):
+        cert = self.cert
+        cert.find_or_new_csr_key(rotate=rotate)
+        issued = not cert.is_issued()
+        if issued:
+            cert.issue_cert()
+        return issued, self.deployer.deploy(cert.key, cert.crt)
+
+    def _issue_shards(self, rotate):
+        sharded = Shards(self.ca, count=self.shards, key_alg=self.key_alg)
+        domain_names = self.cert.list_domains()
+        issued = sharded.issue(domain_names, rotate=rotate)
+
+        reloaded = False
+        if NGINX_USE and utils.is_installed('nginx') and sharded.deploy(domain_names):
+            try:
+                reloaded = Nginx.reload() is not None
+            except SystemExit as e:  # must not end a handler thread
+                raise RuntimeError(str(e.code))
+        return issued, reloaded
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                response = {'ok': True, 'result': self.server.engine.call(request)}
+            except (ValueError, TypeError, AttributeError, RuntimeError, OSError) as e:
+                response = {'ok': False, 'error': str(e)}
+            except SystemExit as e:  # engine parts exit on fatal errors as the CLI does
+                response = {'ok': False, 'error': str(e.code)}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class Daemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves Engine over a unix socket, a thread per client"""
+    daemon_threads = True
+
+    def __init__(self, engine, socket_path=DAEMON_SOCKET):
+        self.engine = engine
+        if os.path.exists(socket_path):
+            os.remove(socket_path)  # left by a killed daemon
+        super().__init__(socket_path, _Handler)
+        os.chmod(socket_path, 0o660)
+        utils.set_real_owner(socket_path)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+class Client:
+    def __init__(self, socket_path=DAEMON_SOCKET):
+        self.socket_path = socket_path
+
+    def call(self, cmd, **params):
+        """returns result or raises RuntimeError"""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(self.socket_path)
+            with sock.makefile('rwb') as f:
+                f.write(json.dumps({'cmd': cmd, **params}).encode('utf-8') + b'\n')
+                f.flush()
+                response = json.loads(f.readline())
+        if not response['ok']:
+            raise RuntimeError(response['error'])
+        return response['result']
+
+
+def serve(socket_path=DAEMON_SOCKET, **engine_params):
+    engine = Engine(**engine_params)
+    with Daemon(engine, socket_path) as daemon:
+        print(f'swcertd listening on {socket_path}')
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            print('swcertd stopped', file=sys.stderr)
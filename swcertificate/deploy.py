@@ -0,0 +1,180 @@
+import os.path
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import utils
+from .nginx import Nginx
+from .settings import APACHE_CRT, APACHE_KEY, CADDY_CONFIG, CADDY_CRT, CADDY_KEY, DEPLOY_TARGETS, DEPLOY_WORKERS, \
+    ENVOY_CONFIG, ENVOY_CRT, ENVOY_KEY, HAPROXY_CONFIG, HAPROXY_PEM, NGINX_CRT, NGINX_KEY, STORE_HOME
+from .store import CRT_NAME, KEY_NAME, PEM_NAME, Store
+from .trace import in_context
+
+
+class Target:
+    """Deployer plugin, one per TLS terminator. `links` are {store file name: path the terminator reads},
+    the store makes every format once per certificate. check and reload raise RuntimeError"""
+    name = None
+    binary = None
+    links = {}
+    check_cmd = None
+    reload_cmd = None
+
+    def is_installed(self):
+        return utils.is_installed(self.binary)
+
+    def install(self, store, name):
+        """returns True if a link changed"""
+        changed = False
+        for file_name, dst in self.links.items():
+            changed = store.link(name, file_name, dst) or changed
+        return changed
+
+    def check(self):
+        if self.check_cmd:
+            utils.subproc_out(run=self.check_cmd, msg=f'Check {self.name}')
+
+    def reload(self):
+        """returns False if the reload is left to a later request"""
+        if self.reload_cmd:
+            utils.subproc_out(run=self.reload_cmd, msg=f'Reload {self.name}')
+
+    def print_config(self, key_alg):
+        print(f'Point {self.name} to {", ".join(self.links.values())}')
+
+
+class NginxTarget(Target):
+    name = 'nginx'
+    binary = 'nginx'
+    links = {KEY_NAME: NGINX_KEY, CRT_NAME: NGINX_CRT}
+
+    def check(self):
+        """`nginx -t` is a part of the coalesced reload"""
+
+    def reload(self):
+        try:
+            return Nginx.reload() is not None
+        except SystemExit as e:
+            raise RuntimeError(str(e.code))
+
+    def print_config(self, key_alg):
+        Nginx.print_config(NGINX_KEY, NGINX_CRT, key_alg)
+
+
+class ApacheTarget(Target):
+    name = 'apache'
+    binary = 'apache2ctl'
+    links = {KEY_NAME: APACHE_KEY, CRT_NAME: APACHE_CRT}
+    check_cmd = ['apache2ctl', 'configtest']
+    reload_cmd = ['apache2ctl', 'graceful']
+
+    def print_config(self, key_alg):
+        print("Don't forget edit apache config")
+        print(f'\tSSLCertificateKeyFile {APACHE_KEY}')
+        print(f'\tSSLCertificateFile {APACHE_CRT}')
+
+
+class HaproxyTarget(Target):
+    name = 'haproxy'
+    binary = 'haproxy'
+    links = {PEM_NAME: HAPROXY_PEM}
+    check_cmd = ['haproxy', '-c', '-f', HAPROXY_CONFIG]
+    reload_cmd = ['service', 'haproxy', 'reload']
+
+    def print_config(self, key_alg):
+        print("Don't forget edit haproxy config")
+        print(f'\tbind :443 ssl crt {HAPROXY_PEM}')
+
+
+class CaddyTarget(Target):
+    name = 'caddy'
+    binary = 'caddy'
+    links = {KEY_NAME: CADDY_KEY, CRT_NAME: CADDY_CRT}
+    check_cmd = ['caddy', 'validate', '--config', CADDY_CONFIG]
+    reload_cmd = ['caddy', 'reload', '--config', CADDY_CONFIG]
+
+    def print_config(self, key_alg):
+        print("Don't forget edit Caddyfile")
+        print(f'\ttls {CADDY_CRT} {CADDY_KEY}')
+
+
+class EnvoyTarget(Target):
+    """no reload, SDS `watched_directory` at the store links dir sees the swap"""
+    name = 'envoy'
+    binary = 'envoy'
+    links = {KEY_NAME: ENVOY_KEY, CRT_NAME: ENVOY_CRT}
+    check_cmd = ['envoy', '--mode', 'validate', '-c', ENVOY_CONFIG]
+
+    def print_config(self, key_alg):
+        print("Don't forget edit envoy SDS config")
+        print(f'\tcertificate_chain: {{filename: {ENVOY_CRT}}}')
+        print(f'\tprivate_key: {{filename: {ENVOY_KEY}}}')
+        print(f'\twatched_directory: {{path: {os.path.join(STORE_HOME, "links")}}}')
+
+
+TARGETS = {target.name: target for target in (NginxTarget, ApacheTarget, HaproxyTarget, CaddyTarget, EnvoyTarget)}
+
+
+class Deployer:
+    """The certificate to every target at once, each is checked and reloaded once if its files changed"""
+
+    def __init__(self, targets=DEPLOY_TARGETS, store=None, workers=DEPLOY_WORKERS):
+        """targets: names from TARGETS or Target objects. Raises ValueError"""
+        unknown = [target for target in targets if isinstance(target, str) and target not in TARGETS]
+        if unknown:
+            raise ValueError(f'Unknown deploy targets {", ".join(unknown)}. Use {", ".join(TARGETS)}')
+        self.targets = [TARGETS[target]() if isinstance(target, str) else target for target in targets]
+        self.store = store or Store()
+        self.workers = workers
+
+    def deploy(self, key, crt, name='swcert'):
+        """returns {target name: result}, see `_target`"""
+        if not self.targets:
+            return {}
+        switched = self.store.switch(name, self.store.add(key, crt))
+        results = self._each(lambda target: self._target(target, name, switched))
+        self.store.gc()
+        return results
+
+    def rollback(self, names=('swcert',)):
+        """every certificate of names which has one back to the pair it had before its last change,
+        targets are reloaded. returns {target name: result}. Raises RuntimeError if none has"""
+        names = [name for name in names if self.store.previous(name)]
+        if not names:
+            raise RuntimeError('No previous certificate to roll back to')
+        for name in names:
+            self.store.rollback(name)
+        return self._each(lambda target: self._target(target, None, True))
+
+    def _each(self, func):
+        if not self.targets:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(self.targets))) as executor:
+            return dict(zip([target.name for target in self.targets], executor.map(in_context(func), self.targets)))
+
+    def _target(self, target, name, switched):
+        """{'status': `not installed` `up to date` `reloaded` `coalesced` or `failed`, 'seconds': float,
+        'error': str}. `coalesced`: installed, a later reload request does the reload"""
+        started = time.perf_counter()
+        result = {'status': 'up to date'}
+        try:
+            if not target.is_installed():
+                result['status'] = 'not installed'
+            elif (name and target.install(self.store, name)) or switched:
+                target.check()
+                result['status'] = 'coalesced' if target.reload() is False else 'reloaded'
+        except RuntimeError as e:
+            result.update(status='failed', error=str(e).strip())
+        result['seconds'] = time.perf_counter() - started
+        return result
+
+    def print_config(self, key_alg, results):
+        """of targets which were reloaded"""
+        for target in self.targets:
+            if results.get(target.name, {}).get('status') in ('reloaded', 'coalesced'):
+                target.print_config(key_alg)
+
+    @staticmethod
+    def print_results(results):
+        for target_name, result in results.items():
+            error = f': {result["error"]}' if 'error' in result else ''
+            print(f'{target_name:<10} {result["status"]:<14} {result["seconds"]:6.2f}s{error}')
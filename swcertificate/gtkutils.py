@@ -1,13 +1,19 @@
 import gi
 gi.require_version("Gtk", "3.0")
+from gi.repository import GLib
 from gi.repository import Gtk
 
+CHUNK = 500  # rows appended per main loop turn
+
 
 class TreeViewUtils:
+    """The model may be a Gtk.TreeModelFilter, records are then kept in the ListStore under it"""
+
     @staticmethod
     def add_column_text(treeview, title=None):
         renderer = Gtk.CellRendererText()
         col = Gtk.TreeViewColumn(title=title, cell_renderer=renderer, text=0)
+        col.set_sizing(Gtk.TreeViewColumnSizing.FIXED)  # needed by fixed_height_mode
         treeview.append_column(col)
 
     @staticmethod
@@ -18,15 +24,27 @@ class TreeViewUtils:
         return model
 
     @staticmethod
-    def get_records(treeview, column=0):
+    def set_filter_model(treeview, visible_func, model=None):
+        """ListStore shown through a TreeModelFilter, returns the ListStore.
+        visible_func(model, iterator, data), call refilter() on treeview.get_model() when its result changes"""
+        if not model:
+            model = Gtk.ListStore(str)
+        model_filter = model.filter_new()
+        model_filter.set_visible_func(visible_func)
+        treeview.set_model(model_filter)
+        return model
+
+    @staticmethod
+    def get_store(treeview):
         model = treeview.get_model()
-        iterator = model.get_iter_first()
-        records = list()
-        while iterator:
-            domain = model.get_value(iterator, column)
-            records.append(domain)
-            iterator = model.iter_next(iterator)
-        return records
+        if isinstance(model, Gtk.TreeModelFilter):
+            return model.get_model()
+        return model
+
+    @staticmethod
+    def get_records(treeview, column=0):
+        """all records, hidden by the filter too"""
+        return [row[column] for row in TreeViewUtils.get_store(treeview)]
 
     @staticmethod
     def get_record(treeview, iterator, column=0):
@@ -36,11 +54,33 @@ class TreeViewUtils:
 
     @staticmethod
     def add_record(treeview, record):
-        model = treeview.get_model()
+        model = TreeViewUtils.get_store(treeview)
         model.append(record)
 
+    @staticmethod
+    def add_records_chunked(treeview, records, chunk=CHUNK, done=None):
+        """appends from the main loop `chunk` rows at a time, the window is drawn and responds meanwhile.
+        done() is called after the last one"""
+        model = TreeViewUtils.get_store(treeview)
+        records = iter(records)
+
+        def append_chunk():
+            for _ in range(chunk):
+                record = next(records, None)
+                if record is None:
+                    if done:
+                        done()
+                    return False
+                model.append(record)
+            return True
+
+        GLib.idle_add(append_chunk)
+
     @staticmethod
     def delete_record(treeview, iterator):
         if iterator:
             model = treeview.get_model()
+            if isinstance(model, Gtk.TreeModelFilter):
+                iterator = model.convert_iter_to_child_iter(iterator)
+                model = model.get_model()
             model.remove(iterator)
@@ -0,0 +1,65 @@
+import json
+import os
+import sys
+
+from . import utils
+from .settings import TRUST_LEDGER
+
+
+class Ledger:
+    """Stat of every CA copy and NSS db after the last full check.
+    While none of them changed on disk the CA is still trusted everywhere"""
+
+    @staticmethod
+    def stat(path):
+        """returns [inode, size, mtime] or None"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+    def __init__(self, ledger=TRUST_LEDGER):
+        self.ledger = ledger
+        self.fingerprint = None
+        self.entries = {}
+        try:
+            with open(ledger) as f:
+                data = json.load(f)
+            self.fingerprint = data['fingerprint']
+            self.entries = data['entries']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def is_trusted(self, paths, fingerprint):
+        """True if the CA of that fingerprint was recorded with exactly these paths and none changed since"""
+        if not self.fingerprint or set(paths) != set(self.entries):
+            return False
+        if fingerprint != self.fingerprint:
+            print('CA changed since last check')
+            return False
+        for path in paths:
+            st = Ledger.stat(path)
+            if st is None or st != self.entries[path]:
+                print(f'Changed since last check {path}')
+                return False
+        return True
+
+    def record(self, fingerprint, paths):
+        self.fingerprint = fingerprint
+        self.entries = {path: Ledger.stat(path) for path in paths}
+        ledger = self.ledger
+        ledger_tmp = f'{ledger}.{os.getpid()}.tmp'
+        try:
+            with open(ledger_tmp, 'w') as f:
+                json.dump({'fingerprint': fingerprint, 'entries': self.entries}, f)
+            os.replace(ledger_tmp, ledger)
+            utils.set_real_owner(ledger)
+        except OSError as e:
+            print(f'Can not save trust ledger {ledger}: {e}', file=sys.stderr)
+
+    def forget(self):
+        self.fingerprint = None
+        self.entries = {}
+        if os.path.isfile(self.ledger):
+            os.remove(self.ledger)
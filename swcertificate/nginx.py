@@ -1,4 +1,9 @@
+import os
+import threading
+import time
+
 from . import utils
+from .settings import NGINX_RELOAD_STAMP, NGINX_RELOAD_WINDOW
 
 
 class Nginx:
@@ -6,3 +11,49 @@ class Nginx:
     def restart():
         utils.subproc(run=['nginx', '-t'], msg='Check nginx', exit_on_fail=True)
         utils.subproc(run=['service', 'nginx', 'reload'], msg='Reload nginx', exit_on_fail=True)
+
+    @staticmethod
+    def reload(window=NGINX_RELOAD_WINDOW, stamp=NGINX_RELOAD_STAMP):
+        """Coalesced `restart`. Every call writes its request into the stamp file and waits until no new request
+        came for `window` seconds. The last caller reloads once for all of them and gets the result,
+        callers replaced by a later request return at once.
+        returns seconds the reload took or None if it is left to a later request. sys.exit on reload failure"""
+        utils.make_real_dir(os.path.dirname(stamp))
+        request = f'{os.getpid()}.{threading.get_ident()}.{time.time_ns()}'
+        stamp_tmp = f'{stamp}.{request}.tmp'
+        with open(stamp_tmp, 'w') as f:
+            f.write(request)
+        os.replace(stamp_tmp, stamp)  # reload requested now, by this request
+        utils.set_real_owner(stamp)
+
+        while True:  # debounce
+            with open(stamp) as f:
+                last_request = f.read()
+                quiet = time.time() - os.fstat(f.fileno()).st_mtime
+            if last_request != request:
+                print('Nginx reload is left to a later request. Coalesced')
+                return None
+            if quiet >= window:
+                break
+            time.sleep(window - quiet)
+
+        started_ns = time.time_ns()
+        Nginx.restart()
+        elapsed = (time.time_ns() - started_ns) / 1e9
+        print(f'Nginx reloaded in {elapsed:.2f}s')
+        return elapsed
+
+    @staticmethod
+    def print_config(key, crt, key_alg):
+        print("Don't forget edit nginx config")
+        print('\tlisten 443 ssl http2;')
+        print(f'\tssl_certificate_key {key};  # {key_alg}')
+        print(f'\tssl_certificate {crt};')
+        if key_alg == 'ed25519':
+            print('Browsers do not accept Ed25519 server certificates yet. Use ec:P-256 for browsers')
+
+    @staticmethod
+    def print_shard_config(map_file):
+        print("Don't forget edit nginx config")
+        print(f'\tinclude {map_file};  # in http {{}}')
+        print(f'\tssl_certificate and ssl_certificate_key as described in {map_file}')
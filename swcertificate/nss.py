@@ -1,26 +1,84 @@
+import json
 import os
 import re
+import shutil
+import sqlite3
+import stat
+import sys
+import tempfile
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from . import utils
-from .settings import CA_CRT, NSS_CERT_NAME, NSS_DIRS, NSS_NAME
+from .trace import in_context, span
+from .settings import CA_CRT, NSS_CERT_NAME, NSS_DIRS, NSS_INDEX, NSS_MIN_UID, NSS_NAME, \
+    NSS_PROFILE_ROOTS, NSS_PRUNE_DIRS, NSS_WORKERS, USER_HOME
+
+CKO_CERTIFICATE = (1).to_bytes(4, 'big')  # CK_ULONG attributes are kept as 4 bytes big endian
 
 
 class Nss:
     @staticmethod
-    def find(nss_name=NSS_NAME, nss_dirs=NSS_DIRS):
+    def find(nss_name=NSS_NAME, nss_dirs=NSS_DIRS, index=NSS_INDEX, prune=NSS_PRUNE_DIRS, workers=NSS_WORKERS):
+        """Only subtrees changed since the previous search are walked again, see `index`. Roots are walked at once"""
+        cached = Nss._load_index(index, nss_name)
+
+        def scan(nss_dir):
+            entry = cached.get(nss_dir)
+            with span('nss.find', cat='walk', root=nss_dir, indexed=entry is not None) as args:
+                if entry is None:
+                    entry = Nss._walk(nss_dir, nss_name, prune)
+                else:
+                    entry = Nss._revalidate(entry, nss_name, prune)
+                args.update(dirs=len(entry['dirs']), found=len(entry['found']))
+            return entry
+
+        nss_dirs = list(map(os.fspath, nss_dirs))
+        if len(nss_dirs) > 1 and workers > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, len(nss_dirs))) as executor:
+                roots = dict(zip(nss_dirs, executor.map(in_context(scan), nss_dirs)))
+        else:
+            roots = {nss_dir: scan(nss_dir) for nss_dir in nss_dirs}
+
+        if any(cached.get(nss_dir) != entry for nss_dir, entry in roots.items()):
+            cached.update(roots)
+            Nss._save_index(index, nss_name, cached)
+
         found_nss_dirs = []
-        for nss_dir in nss_dirs:
-            for root, _dirs, files in os.walk(nss_dir):
-                if nss_name in files:
-                    found_nss_dirs.append(root)
+        for entry in roots.values():
+            found_nss_dirs.extend(entry['found'])
         return found_nss_dirs
 
+    @staticmethod
+    def user_homes(min_uid=NSS_MIN_UID):
+        """homes of human users: uid from min_uid, a login shell and the home is there. The sudo user's is always in"""
+        import pwd  # pylint: disable=import-outside-toplevel
+        homes = {USER_HOME}
+        for user in pwd.getpwall():
+            if user.pw_uid < min_uid or user.pw_name == 'nobody' or \
+                    os.path.basename(user.pw_shell) in ('nologin', 'false', ''):
+                continue
+            if os.path.isdir(user.pw_dir):
+                homes.add(user.pw_dir)
+        return sorted(homes)
+
+    @staticmethod
+    def all_users_dirs(homes=None, roots=NSS_PROFILE_ROOTS):
+        """NSS_DIRS of every human user, sandboxed browsers included, for `find`"""
+        if homes is None:
+            homes = Nss.user_homes()
+        return [os.path.join(home, root) for home in homes for root in roots]
+
+    @staticmethod
+    def db_files(nss_dirs, nss_name=NSS_NAME):
+        return [os.path.join(nss_dir, nss_name) for nss_dir in nss_dirs]
+
     @staticmethod
     def get_crt_serial(nss_dir, cert_name=NSS_CERT_NAME):
         """Return Serial Number or False"""
         print(f'Get NSS cert serial `{cert_name}` {nss_dir}')
         try:
-            complete = utils.subproc_out(run=['certutil', '-L', '-n', cert_name, '-d', nss_dir])
+            complete = Nss._certutil(nss_dir, ['-L', '-n', cert_name])
         except RuntimeError:
             return False
 
@@ -31,17 +89,272 @@ class Nss:
         print(f'Serial {serial}')
         return serial
 
+    @staticmethod
+    def read_certs(nss_dir, cert_name=NSS_CERT_NAME, nss_name=NSS_NAME):
+        """DER of certificates under the nickname, read from the db by sqlite3 without certutil.
+        nssPublic columns are PKCS#11 attributes: a0 CKA_CLASS, a3 CKA_LABEL, a11 CKA_VALUE.
+        returns None if the db can not be read so, ask certutil then. As root a db which is a link
+        or is not of the profile dir owner is left to certutil too, it runs as that owner"""
+        if nss_dir.startswith('dbm:'):
+            return None
+        db = os.path.join(Nss._path(nss_dir), nss_name)
+        with span('nss.read_certs', cat='sqlite', db=db) as args:
+            if os.geteuid() == 0 and not Nss._is_owners(db):
+                args['error'] = 'not of the profile owner'
+                return None
+            try:
+                connection = sqlite3.connect(f'file:{urllib.parse.quote(db)}?mode=ro', uri=True, timeout=1)
+                try:
+                    rows = connection.execute('SELECT a3, a11 FROM nssPublic WHERE a0 = ?',
+                                              (CKO_CERTIFICATE,)).fetchall()
+                finally:
+                    connection.close()
+            except sqlite3.Error as e:
+                args['error'] = str(e)
+                return None
+            label = cert_name.encode('utf-8')
+            certs = [bytes(der) for nickname, der in rows
+                     if isinstance(nickname, bytes) and nickname.rstrip(b'\0') == label and der]
+            args['found'] = len(certs)
+        return certs
+
     @staticmethod
     def delete_cert(nss_dir, cert_name=NSS_CERT_NAME):
         print(f'Delete NSS CA {cert_name} from {nss_dir}')
         try:
-            while Nss.get_crt_serial(nss_dir, cert_name=cert_name):
-                utils.subproc(run=['certutil', '-D', '-n', cert_name, '-d', nss_dir], exit_on_fail=True)
-        except RuntimeError:
-            pass
+            Nss._delete_cert(nss_dir, cert_name)
+        except RuntimeError as e:
+            sys.exit(str(e))
 
     @staticmethod
     def install_ca(nss_dir, ca_crt=CA_CRT, cert_name=NSS_CERT_NAME):
         print(f'Install NSS CA {cert_name} from {ca_crt} to {nss_dir}')
-        utils.subproc(run=['certutil', '-A', '-n', cert_name, '-t', 'TC,C,T', '-d', nss_dir, '-i', ca_crt],
-                      exit_on_fail=True)
+        try:
+            Nss._install_ca(nss_dir, ca_crt, cert_name)
+        except RuntimeError as e:
+            sys.exit(str(e))
+
+    @staticmethod
+    def sync_ca(nss_dir, ca_serial, ca_crt=CA_CRT, cert_name=NSS_CERT_NAME):
+        """Returns `ok`, `installed` or `updated`. The db is read by sqlite3, certutil only writes
+        unless the db can not be read so. Raises RuntimeError"""
+        nss_certs = Nss.read_certs(nss_dir, cert_name)
+        if nss_certs is None:
+            nss_ca_serial = Nss.get_crt_serial(nss_dir, cert_name=cert_name)
+            if nss_ca_serial == ca_serial:
+                return 'ok'
+            count = Nss._count_certs(nss_dir, cert_name) if nss_ca_serial else 0
+        else:
+            if nss_certs == [Nss._crt_der(ca_crt)]:
+                return 'ok'
+            count = len(nss_certs)
+
+        status = 'installed'
+        if count:
+            status = 'updated'
+            print(f'Delete NSS CA {cert_name} x{count} from {nss_dir}')
+        print(f'Install NSS CA {cert_name} from {ca_crt} to {nss_dir}')
+        commands = [['-D', '-n', cert_name]] * count
+        commands.append(Nss._install_command(ca_crt, cert_name))
+        Nss._batch(nss_dir, commands, ca_crt)
+        return status
+
+    @staticmethod
+    def sync(nss_dirs, ca_serial, ca_crt=CA_CRT, cert_name=NSS_CERT_NAME, workers=NSS_WORKERS):
+        """Sync CA to all NSS dirs concurrently. Returns ({nss_dir: status}, {nss_dir: error})"""
+        synced = {}
+        failed = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(in_context(Nss.sync_ca), nss_dir, ca_serial, ca_crt, cert_name): nss_dir
+                       for nss_dir in nss_dirs}
+            for future in as_completed(futures):
+                nss_dir = futures[future]
+                try:
+                    synced[nss_dir] = future.result()
+                except Exception as e:  # pylint: disable=broad-except
+                    failed[nss_dir] = str(e).strip()
+        return synced, failed
+
+    @staticmethod
+    def _walk(top, nss_name, prune):
+        """returns {'dirs': {path: mtime}, 'found': [nss_dir]}"""
+        dirs = {}
+        found = []
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            try:
+                mtime = os.stat(path).st_mtime_ns  # before listing, a later change is seen next time
+                entries = list(os.scandir(path))
+            except OSError:
+                if path == top:
+                    dirs[path] = None  # notice when it appears
+                continue
+            dirs[path] = mtime
+            for entry in entries:
+                if entry.name == nss_name:
+                    found.append(path)
+                elif entry.name not in prune and entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+        return {'dirs': dirs, 'found': sorted(found)}
+
+    @staticmethod
+    def _revalidate(entry, nss_name, prune):
+        """stat every known dir, walk again the changed ones"""
+        changed = []
+        for path, mtime in sorted(entry['dirs'].items()):
+            if any(Nss._is_subpath(path, top) for top in changed):
+                continue  # walked with its changed parent
+            try:
+                current_mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                current_mtime = None
+            if current_mtime != mtime:
+                changed.append(path)
+        if not changed:
+            return entry
+
+        dirs = dict(entry['dirs'])
+        found = list(entry['found'])
+        for top in changed:
+            dirs = {path: mtime for path, mtime in dirs.items() if not Nss._is_subpath(path, top)}
+            found = [path for path in found if not Nss._is_subpath(path, top)]
+            subtree = Nss._walk(top, nss_name, prune)
+            dirs.update(subtree['dirs'])
+            found.extend(subtree['found'])
+        return {'dirs': dirs, 'found': sorted(found)}
+
+    @staticmethod
+    def _is_subpath(path, top):
+        return path == top or path.startswith(top.rstrip(os.sep) + os.sep)
+
+    @staticmethod
+    def _load_index(index, nss_name):
+        if not index:
+            return {}
+        try:
+            with open(index) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get('nss_name') != nss_name:
+            return {}
+        return data.get('roots', {})
+
+    @staticmethod
+    def _save_index(index, nss_name, roots):
+        if not index:
+            return
+        index_tmp = f'{index}.{os.getpid()}.tmp'
+        try:
+            utils.make_real_dir(os.path.dirname(index))  # first run, SW_HOME is not there yet
+            with open(index_tmp, 'w') as f:
+                json.dump({'nss_name': nss_name, 'roots': roots}, f)
+            os.replace(index_tmp, index)
+            utils.set_real_owner(index)
+        except OSError as e:
+            print(f'Can not save NSS index {index}: {e}', file=sys.stderr)
+
+    @staticmethod
+    def _path(nss_dir):
+        """dir of `sql:dir`"""
+        return nss_dir[len('sql:'):] if nss_dir.startswith('sql:') else nss_dir
+
+    @staticmethod
+    def _owner(nss_dir):
+        """(uid, gid) certutil runs as: the profile dir owner when root works in a profile of another user.
+        None if certutil runs as is"""
+        if os.geteuid() != 0:
+            return None
+        try:
+            dir_stat = os.stat(Nss._path(nss_dir))
+        except OSError:
+            return None
+        if dir_stat.st_uid == 0:
+            return None
+        return dir_stat.st_uid, dir_stat.st_gid
+
+    @staticmethod
+    def _is_owners(db):
+        """a regular file of the owner of its dir, not a link the owner planted for root to follow"""
+        try:
+            db_stat = os.lstat(db)
+            dir_stat = os.stat(os.path.dirname(db))
+        except OSError:
+            return False
+        return stat.S_ISREG(db_stat.st_mode) and db_stat.st_uid == dir_stat.st_uid
+
+    @staticmethod
+    def _delete_cert(nss_dir, cert_name):
+        """all duplicates under the nickname"""
+        count = Nss._count_certs(nss_dir, cert_name)
+        if count:
+            Nss._batch(nss_dir, [['-D', '-n', cert_name]] * count)
+
+    @staticmethod
+    def _install_ca(nss_dir, ca_crt, cert_name):
+        Nss._batch(nss_dir, [Nss._install_command(ca_crt, cert_name)], ca_crt)
+
+    @staticmethod
+    def _install_command(ca_crt, cert_name):
+        return ['-A', '-n', cert_name, '-t', 'TC,C,T', '-i', ca_crt]
+
+    @staticmethod
+    def _crt_der(crt):
+        """DER of the first certificate in a PEM file. Raises RuntimeError"""
+        try:
+            with open(crt, 'rb') as f:
+                return utils.pem_blocks(f.read())[0][1]
+        except (OSError, IndexError, ValueError) as e:
+            raise RuntimeError(f'Can not read {crt}: {e}')
+
+    @staticmethod
+    def _count_certs(nss_dir, cert_name):
+        """certificates under the nickname, `-a` prints every duplicate"""
+        try:
+            complete = Nss._certutil(nss_dir, ['-L', '-n', cert_name, '-a'])
+        except RuntimeError:
+            return 0
+        return complete.stdout.count(b'-----BEGIN CERTIFICATE-----')
+
+    @staticmethod
+    def _certutil(nss_dir, args, owner=None):
+        """certutil as the profile owner, see `_owner`. db files of another user are opened with that user's rights,
+        one planted as a link leads nowhere the user can not write anyway. Raises RuntimeError"""
+        owner = owner or Nss._owner(nss_dir)
+        run = ['certutil', *args, '-d', nss_dir]
+        if owner:
+            run = ['setpriv', f'--reuid={owner[0]}', f'--regid={owner[1]}', '--clear-groups', '--', *run]
+        return utils.subproc_out(run=run)
+
+    @staticmethod
+    def _batch(nss_dir, commands, ca_crt=None):
+        """certutil commands in one process and one db open, `certutil -B`.
+        ca_crt in commands is read from a copy next to the batch, the profile owner may not read the CA home.
+        Raises RuntimeError"""
+        owner = Nss._owner(nss_dir)
+        with tempfile.TemporaryDirectory(prefix='swcert-') as tmp:
+            if ca_crt:
+                ca_copy = os.path.join(tmp, 'ca.crt')
+                try:
+                    shutil.copyfile(ca_crt, ca_copy)
+                except OSError as e:
+                    raise RuntimeError(f'Can not read {ca_crt}: {e}')
+                commands = [[ca_copy if arg == ca_crt else arg for arg in command] for command in commands]
+            batch = os.path.join(tmp, 'batch.certutil')
+            with open(batch, 'w') as f:
+                for command in commands:
+                    f.write(' '.join(Nss._quote(arg) for arg in command) + '\n')
+            if owner:
+                for path in (tmp, *(os.path.join(tmp, name) for name in os.listdir(tmp))):
+                    os.chown(path, *owner)
+            Nss._certutil(nss_dir, ['-B', '-i', batch], owner)
+
+    @staticmethod
+    def _quote(arg):
+        """certutil batch lines are split on spaces, double quotes keep an arg together"""
+        if '"' in arg:
+            raise RuntimeError(f'Can not pass {arg} to certutil batch')
+        if not arg or any(char.isspace() for char in arg):
+            return f'"{arg}"'
+        return arg
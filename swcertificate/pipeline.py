@@ -0,0 +1,174 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+from .nss import Nss
+from .settings import NSS_DIRS, PIPELINE_CONCURRENCY
+from .trace import in_context, span
+from .trust import Trust
+
+
+async def subproc_async(run, msg=None):
+    """subproc_out for the event loop, other work goes on while the command runs.
+    returns subprocess.CompletedProcess, raises RuntimeError"""
+    if msg:
+        print(msg)
+
+    with span(os.path.basename(run[0]), cat='subprocess', cmd=' '.join(run), msg=msg) as args:
+        try:
+            process = await asyncio.create_subprocess_exec(*run, stdout=asyncio.subprocess.PIPE,
+                                                           stderr=asyncio.subprocess.PIPE)
+        except OSError as e:
+            raise RuntimeError(str(e))
+        stdout, stderr = await process.communicate()
+        args.update(exit=process.returncode, stdout_bytes=len(stdout), stderr_bytes=len(stderr))
+    if process.returncode:
+        raise RuntimeError(stderr.decode('utf-8'))
+    return subprocess.CompletedProcess(run, process.returncode, stdout, stderr)
+
+
+async def is_installed_async(binary_name):
+    try:
+        await subproc_async(msg=f'Check installed {binary_name}', run=['which', binary_name])
+    except RuntimeError:
+        return False
+    return True
+
+
+class Cancelled(Exception):
+    """the pipeline was cancelled, running stages were let finish"""
+
+
+class StageExit(Exception):
+    """sys.exit inside a stage, re-raised as SystemExit when the pipeline is done"""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+class Pipeline:
+    """Stages run as soon as the stages they need are done, at most `concurrency` at a time.
+    A stage is a coroutine function or a plain function run in a thread, it gets {stage name: result}"""
+
+    def __init__(self, concurrency=PIPELINE_CONCURRENCY, on_stage=None, cancel=None):
+        """on_stage(name, status): status is running, done, failed, skipped or cancelled.
+        Called from the pipeline thread.
+        cancel: threading.Event, stages not started yet are not run once it is set"""
+        self.concurrency = concurrency
+        self.on_stage = on_stage or (lambda _name, _status: None)
+        self.cancel = cancel
+        self.stages = {}  # name: (func, after)
+
+    def add(self, name, func, after=()):
+        unknown = [dep for dep in after if dep not in self.stages]
+        if unknown:
+            raise ValueError(f'Stage `{name}` needs unknown stages {", ".join(unknown)}')
+        self.stages[name] = (func, tuple(after))
+
+    def run(self):
+        """returns {stage name: result}. Raises the first stage error, stages needing the failed one are not run"""
+        try:
+            return asyncio.run(self.run_async())
+        except StageExit as e:
+            sys.exit(e.code)
+
+    async def run_async(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = {}
+        tasks = {}
+        for name, (func, after) in self.stages.items():
+            tasks[name] = asyncio.ensure_future(self._stage(name, func, [tasks[dep] for dep in after], results,
+                                                            semaphore))
+        await asyncio.wait(tasks.values())
+        errors = [task.exception() for task in tasks.values() if task.exception()]
+        for error in errors:  # first failure in stage order, not the skipped dependents
+            if not isinstance(error, (_Skipped, Cancelled)):
+                raise error
+        if errors:
+            raise Cancelled()
+        return results
+
+    async def _stage(self, name, func, deps, results, semaphore):
+        for dep in deps:
+            try:
+                await dep
+            except Exception:  # pylint: disable=broad-except
+                self.on_stage(name, 'skipped')
+                raise _Skipped(name)
+        async with semaphore:
+            if self.cancel is not None and self.cancel.is_set():
+                self.on_stage(name, 'cancelled')
+                raise Cancelled()
+            self.on_stage(name, 'running')
+            try:
+                with span(name, cat='phase'):
+                    if asyncio.iscoroutinefunction(func):
+                        result = await func(results)
+                    else:
+                        loop = asyncio.get_running_loop()
+                        result = await loop.run_in_executor(None, in_context(Pipeline._call), func, results)
+            except Exception:
+                self.on_stage(name, 'failed')
+                raise
+        results[name] = result
+        self.on_stage(name, 'done')
+        return result
+
+    @staticmethod
+    def _call(func, results):
+        try:
+            return func(results)
+        except SystemExit as e:  # must not unwind the event loop from a worker thread
+            raise StageExit(e.code)
+
+
+class _Skipped(Exception):
+    """a stage it needs has failed"""
+
+
+class Setup:
+    """swcert run as stages. Discovery and the leaf key do not wait for the CA install:
+
+        discovery -> CA check -> NSS sync <- certutil check
+        leaf key, CA check -> issuance -> deploy
+    """
+
+    def __init__(self, ca, issue, prepare=None, deploy=None, concurrency=PIPELINE_CONCURRENCY, on_stage=None,
+                 cancel=None, nss_dirs=NSS_DIRS):
+        """issue, prepare, deploy: functions without args, prepare needs no CA (leaf key).
+        nss_dirs: roots for Nss.find, see Nss.all_users_dirs. See Pipeline for the rest"""
+        self.ca = ca
+        self.trust = Trust(ca)
+        self.pipeline = Pipeline(concurrency, on_stage=on_stage, cancel=cancel)
+        pipeline = self.pipeline
+        pipeline.add('discovery', lambda _results: Nss.find(nss_dirs=nss_dirs))
+        pipeline.add('certutil check', Setup.check_certutil)
+        pipeline.add('CA check', self.check_ca, after=['discovery'])
+        pipeline.add('NSS sync', self.sync_nss, after=['CA check', 'certutil check'])
+        issue_after = ['CA check']
+        if prepare:
+            pipeline.add('leaf key', lambda _results: prepare())
+            issue_after.append('leaf key')
+        pipeline.add('issuance', lambda _results: issue(), after=issue_after)
+        if deploy:
+            pipeline.add('deploy', lambda _results: deploy(), after=['issuance'])
+
+    def run(self):
+        """returns {nss_dir: error} of NSS dirs which failed. Raises RuntimeError"""
+        return self.pipeline.run()['NSS sync']
+
+    @staticmethod
+    async def check_certutil(_results):
+        return await is_installed_async('certutil')
+
+    def check_ca(self, results):
+        """returns trusted_paths if NSS sync is needed or None"""
+        return self.trust.check(results['discovery'])
+
+    def sync_nss(self, results):
+        trusted_paths = results['CA check']
+        if trusted_paths is None:
+            return {}
+        return self.trust.sync(results['discovery'], trusted_paths, results['certutil check'])
@@ -0,0 +1,171 @@
+import bisect
+import fcntl
+import os
+import re
+from contextlib import contextmanager
+
+from . import utils
+from .settings import CERT_LIST, CERT_REGISTRY_NAME
+
+DOMAIN_RE = re.compile(r'^(\*\.)?[a-z0-9_]([a-z0-9_-]*[a-z0-9_])?(\.[a-z0-9_]([a-z0-9_-]*[a-z0-9_])?)*$')
+
+
+class Registry:
+    """Sorted unique domains, one per line in a single file.
+    Domains left as files in the legacy `list.d` dir are loaded too and moved into it by the next change"""
+
+    @staticmethod
+    def normalize(name):
+        """returns lowercase name without trailing dot. Raises ValueError"""
+        domain = name.strip().lower().rstrip('.')
+        if not DOMAIN_RE.match(domain):
+            raise ValueError(f'Bad domain name `{name.strip()}`')
+        return domain
+
+    @staticmethod
+    def of_cert_list(cert_list=CERT_LIST):
+        """registry kept in `list.d`"""
+        return Registry(os.path.join(cert_list, CERT_REGISTRY_NAME), legacy_dir=cert_list)
+
+    def __init__(self, path, legacy_dir=None):
+        self.path = path
+        self.legacy_dir = legacy_dir
+        self.domains = None
+        self.stat = None
+        self.legacy_stat = None
+
+    def __contains__(self, name):
+        domains = self.load()
+        domain = name.lower().rstrip('.')
+        i = bisect.bisect_left(domains, domain)
+        return i < len(domains) and domains[i] == domain
+
+    def load(self):
+        """cached until the file or the legacy dir changes. Read only and without lock, the file is replaced
+        atomically"""
+        if self.domains is None or self.stat != self._stat() or self.legacy_stat != self._legacy_stat():
+            self._read()
+            legacy_domains = self._legacy_domains()
+            if legacy_domains:
+                self.domains = sorted(legacy_domains.union(self.domains))
+        return self.domains
+
+    def add(self, names):
+        """returns added domains"""
+        new_domains = {Registry.normalize(name) for name in names}
+        with self._lock():
+            self._reload()
+            added = sorted(new_domains.difference(self.domains))
+            if added:
+                self._write(sorted(new_domains.union(self.domains)))
+        return added
+
+    def remove(self, names):
+        """returns removed domains"""
+        old_domains = {name.lower().rstrip('.') for name in names}
+        with self._lock():
+            self._reload()
+            removed = sorted(old_domains.intersection(self.domains))
+            if removed:
+                self._write([domain for domain in self.domains if domain not in old_domains])
+        return removed
+
+    def replace(self, names):
+        domains = sorted({Registry.normalize(name) for name in names})
+        with self._lock():
+            self._reload()  # legacy files are replaced too
+            self._write(domains)
+
+    def import_file(self, lines):
+        """lines: iterable like an open file, empty lines and # comments are skipped"""
+        names = []
+        for line in lines:
+            line = line.split('#', 1)[0]
+            if line.strip():
+                names.append(line)
+        return self.add(names)
+
+    def export(self, out):
+        for domain in self.load():
+            out.write(domain + '\n')
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def _reload(self):
+        self._read()
+        self._migrate()
+
+    def _read(self):
+        self.stat = self._stat()
+        self.legacy_stat = self._legacy_stat()
+        try:
+            with open(self.path) as f:
+                self.domains = [line.rstrip('\n') for line in f if line.strip()]
+        except FileNotFoundError:
+            self.domains = []
+
+    def _write(self, domains):
+        path = self.path
+        path_tmp = f'{path}.{os.getpid()}.tmp'
+        with open(path_tmp, 'w') as f:
+            f.writelines(domain + '\n' for domain in domains)
+        os.replace(path_tmp, path)
+        utils.set_real_owner(path)
+        self.domains = domains
+        self.stat = self._stat()
+
+    def _legacy_stat(self):
+        if not self.legacy_dir:
+            return None
+        try:
+            return os.stat(self.legacy_dir).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _legacy_domains(self):
+        """domains of legacy files, bad names are left for _migrate to report"""
+        domains = set()
+        for name in self._legacy_files():
+            try:
+                domains.add(Registry.normalize(name))
+            except ValueError:
+                pass
+        return domains
+
+    def _legacy_files(self):
+        legacy_dir = self.legacy_dir
+        if not legacy_dir or not os.path.isdir(legacy_dir):
+            return []
+        return [name for name in os.listdir(legacy_dir) if not name.startswith('.')]
+
+    def _migrate(self):
+        legacy_dir = self.legacy_dir
+        legacy_files = self._legacy_files()
+        if not legacy_files:
+            return
+        print(f'Move {len(legacy_files)} domains from {legacy_dir} to {self.path}')
+        domains = set(self.domains)
+        for name in legacy_files:
+            try:
+                domains.add(Registry.normalize(name))
+            except ValueError:
+                print(f'Skip bad domain file {name}')
+                continue
+            os.remove(os.path.join(legacy_dir, name))
+        self._write(sorted(domains))
+
+    @contextmanager
+    def _lock(self):
+        """serialize read-modify-write between processes"""
+        utils.make_real_dir(os.path.dirname(self.path))
+        lock = os.open(f'{self.path}.lock', os.O_RDONLY | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(lock)
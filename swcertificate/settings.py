@@ -1,33 +1,115 @@
 import os
-import pwd
 
-real_uid = int(os.environ.get('SUDO_UID', os.getuid()))
-USER_HOME = pwd.getpwuid(real_uid).pw_dir
+
+def _user_home():
+    """home of the user behind sudo. passwd is read only under sudo, HOME is enough otherwise"""
+    if 'SUDO_UID' not in os.environ and os.getenv('HOME'):
+        return os.environ['HOME']
+    import pwd  # pylint: disable=import-outside-toplevel
+    return pwd.getpwuid(int(os.environ.get('SUDO_UID', os.getuid()))).pw_dir
+
+
+USER_HOME = _user_home()
 
 SW_HOME = os.getenv('SW_HOME', os.path.join(USER_HOME, '.swcert'))  # projects home
 CA_HOME = os.path.join(SW_HOME, 'ca')
 CA_KEY = os.path.join(CA_HOME, 'swcert_CA.key')
 CA_CRT = os.path.join(CA_HOME, 'swcert_CA.crt')
+CA_SUBJ = '/CN=First Galactic Empire/O=Death Star/OU=New Order IT Dept'
 
-NSS_DIRS = (  # find for browser CA database here
-    os.path.join(USER_HOME, '.pki'),
-    os.path.join(USER_HOME, '.mozilla'),
+NSS_PROFILE_ROOTS = (  # find for browser CA database here, relative to a home
+    '.pki',
+    '.mozilla',
+    'snap/firefox/common/.mozilla',
+    'snap/chromium/current/.pki',
+    '.var/app/org.mozilla.firefox/.mozilla',
+    '.var/app/org.chromium.Chromium/.pki',
+    '.var/app/com.google.Chrome/.pki',
 )
+NSS_DIRS = tuple(os.path.join(USER_HOME, root) for root in NSS_PROFILE_ROOTS)
+NSS_MIN_UID = 1000  # `swcert --all-users` takes users from this uid with a login shell, UID_MIN of login.defs
 NSS_NAME = 'cert9.db'  # browser DB filename
 NSS_CERT_NAME = 'swcert'  # install your new CA cert this name
+NSS_WORKERS = 8  # NSS dirs synced concurrently
+NSS_INDEX = os.path.join(SW_HOME, 'nss_index.json')  # found NSS dirs cache, revalidated by dirs mtime
+NSS_PRUNE_DIRS = (  # never contain NSS db, skip on search
+    'cache2', 'storage', 'startupCache', 'thumbnails', 'crashes', 'minidumps', 'datareporting',
+    'saved-telemetry-pings', 'sessionstore-backups', 'Crash Reports', 'Pending Pings',
+)
 
 CA_SRL = os.path.join(SW_HOME, 'ca/swcert_CA.srl')
 CA_OS_PATH = '/usr/local/share/ca-certificates/extra/swcert_CA.crt'
 CA_ETC_PATH = '/etc/ssl/certs/swcert_CA.pem'  # .pem not .crt!
+ETC_CERTS_DIR = '/etc/ssl/certs'  # hash links, updated for swcert CA only
+ETC_CA_BUNDLE = '/etc/ssl/certs/ca-certificates.crt'
+ETC_CA_HOOKS = '/etc/ca-certificates/update.d'  # update-ca-certificates hooks, Java keystore ex.
+TRUST_LEDGER = os.path.join(SW_HOME, 'trust.json')  # stat of installed CA copies and NSS dbs on last check
 
 CERT_HOME = os.path.join(SW_HOME, 'cert')
 CERT_CSR = os.path.join(CERT_HOME, 'swcert.csr')
 CERT_KEY = os.path.join(CERT_HOME, 'swcert.key')
 CERT_CRT = os.path.join(CERT_HOME, 'swcert.crt')
-CERT_LIST = os.path.join(CERT_HOME, 'list.d')  # domains list as filenames
+CERT_DIGEST = os.path.join(CERT_HOME, 'swcert.sha256')  # hash of what CERT_CRT was issued for
+CERT_LIST = os.path.join(CERT_HOME, 'list.d')  # domains list dir, files in it are legacy domains list as filenames
+CERT_REGISTRY_NAME = '.domains'  # sorted domains list file in CERT_LIST
+CERT_SUBJ = '/CN=Outer Rim/O=Tatooine/OU=Skywalker Ltd'
+CERT_DAYS = 10000
+CERT_KEY_MAX_AGE = 365  # days, the key is reused until that age when the domains list changes. 0 - forever
+CERT_SHARDS = 0  # spread domains over this many certificates, only changed ones are re-issued. 0 - one certificate
+CERT_SHARD_BY = 'hash'  # `hash` of domain name or of its `parent` domain to keep example.com and *.example.com together
+CERT_SHARD_HOME = os.path.join(CERT_HOME, 'shards')
+
+KEY_ALG = os.getenv('SW_KEY_ALG', 'rsa:2048')  # rsa:2048 rsa:3072 rsa:4096 ec:P-256 ec:P-384 ed25519
+CRYPTO_BACKEND = os.getenv('SW_BACKEND', 'cryptography')  # `cryptography` in-process or `openssl` CLI
 
 NGINX_USE = True  # copy new certificate for nginx and reload nginx every time
 NGINX_KEY = '/etc/swcert/swcert.key'
 NGINX_CRT = '/etc/swcert/swcert.crt'
+NGINX_SHARD_HOME = '/etc/swcert/shards'  # <shard>.key <shard>.crt
+NGINX_SHARD_MAP = '/etc/swcert/shards.conf'  # maps server name to shard, include into nginx `http {}`
+NGINX_RELOAD_WINDOW = float(os.getenv('SW_NGINX_RELOAD_WINDOW', '1'))  # seconds, reloads asked within it are merged
+NGINX_RELOAD_STAMP = os.path.join(SW_HOME, 'nginx.reload')  # last reload request, its mtime is the request time
+
+# TLS terminators the certificate is deployed to at once, comma separated in env:
+# nginx apache haproxy caddy envoy. Targets not installed are skipped
+DEPLOY_TARGETS = tuple(filter(None, os.getenv('SW_DEPLOY', 'nginx' if NGINX_USE else '').split(',')))
+APACHE_KEY = '/etc/swcert/apache/swcert.key'
+APACHE_CRT = '/etc/swcert/apache/swcert.crt'
+HAPROXY_PEM = '/etc/swcert/haproxy/swcert.pem'  # crt and key in one file
+HAPROXY_CONFIG = '/etc/haproxy/haproxy.cfg'
+CADDY_KEY = '/etc/swcert/caddy/swcert.key'
+CADDY_CRT = '/etc/swcert/caddy/swcert.crt'
+CADDY_CONFIG = '/etc/caddy/Caddyfile'
+ENVOY_KEY = '/etc/swcert/envoy/swcert.key'  # no reload, Envoy SDS `watched_directory` at STORE_HOME/links sees the swap
+ENVOY_CRT = '/etc/swcert/envoy/swcert.crt'
+ENVOY_CONFIG = '/etc/envoy/envoy.yaml'
+DEPLOY_WORKERS = 8  # targets deployed concurrently
+
+STORE_HOME = '/etc/swcert/store'  # deployed key and crt pairs by content hash, nginx paths link here. Root owned
+STORE_KEEP = 5  # generations kept for rollback, deployed ones are never removed
+
+DAEMON_SOCKET = os.path.join(SW_HOME, 'swcertd.sock')  # swcertd API, JSON line per request
+PIPELINE_CONCURRENCY = int(os.getenv('SW_JOBS', '4'))  # independent swcert stages run at once
+WATCH_DEBOUNCE = 1  # seconds, `swcert --watch` issues after the changes stop for that long
+
+ACME_HOST = 'localhost'  # directory https://ACME_HOST:ACME_PORT/directory
+ACME_PORT = 14000
+ACME_TLS = True  # serve ACME API over https with a certificate from swcert CA
+ACME_HOME = os.path.join(SW_HOME, 'acme')  # ACME API server key and crt
+ACME_CERT_DAYS = 90
+ACME_LOCAL_SUFFIXES = ('localhost', 'lan', 'local', 'test', 'internal', 'home.arpa')  # issued without challenge
+ACME_ORDER_DAYS = 7  # orders, authorizations and certificate downloads are dropped after that
+ACME_NONCE_TTL = 3600  # seconds, an unused nonce is bad after that
+ACME_NONCE_MAX = 10000  # unused nonces kept, the oldest is dropped first
+
+SNI_HOST = '127.0.0.1'  # swcert-sni TLS front, certificate is minted for every new SNI name, so loopback only
+SNI_PORT = 443
+SNI_UPSTREAM_HOST = '127.0.0.1'  # plain http behind the front
+SNI_UPSTREAM_PORT = 8080
+SNI_HOME = os.path.join(SW_HOME, 'sni')  # minted certificates spill
+SNI_CACHE_SIZE = 1000  # TLS contexts kept in memory
+SNI_KEY_POOL = 16  # keys generated ahead
+SNI_CERT_DAYS = 90
+SNI_LOCAL_SUFFIXES = ACME_LOCAL_SUFFIXES
 
 GLADE_MAIN_WINDOW = os.path.join(SW_HOME, 'glade/main.glade')
@@ -0,0 +1,124 @@
+import os
+import zlib
+
+from . import utils
+from .cert import Cert
+from .settings import CERT_SHARD_BY, CERT_SHARD_HOME, CERT_SHARDS, KEY_ALG, NGINX_SHARD_HOME, NGINX_SHARD_MAP
+from .store import Store
+
+
+class Shards:
+    """Domains spread over `count` certificates. A domain always lands in the same shard,
+    so adding or deleting one re-issues only its shard"""
+
+    @staticmethod
+    def shard_of(domain, count=CERT_SHARDS, by=CERT_SHARD_BY):
+        name = domain.lower().rstrip('.')
+        if name.startswith('*.'):
+            name = name[2:]
+        if by == 'parent':
+            name = '.'.join(name.split('.')[-2:])
+        elif by != 'hash':
+            raise ValueError(f'Unknown shard mode `{by}`. Use `hash` or `parent`')
+        return zlib.crc32(name.encode('utf-8')) % count
+
+    @staticmethod
+    def split(domains, count=CERT_SHARDS, by=CERT_SHARD_BY):
+        """returns {shard: [domain]} for non empty shards"""
+        shards = {}
+        for domain in domains:
+            shards.setdefault(Shards.shard_of(domain, count, by), []).append(domain)
+        return shards
+
+    @staticmethod
+    def shard_name(shard):
+        return f'{shard:02d}'
+
+    def __init__(self, ca, count=CERT_SHARDS, by=CERT_SHARD_BY, shard_home=CERT_SHARD_HOME, key_alg=KEY_ALG):
+        if count < 1:
+            raise ValueError('Shards count must be 1 or more')
+        self.ca = ca
+        self.count = count
+        self.by = by
+        self.shard_home = shard_home
+        self.key_alg = key_alg
+
+    def cert(self, shard):
+        shard_dir = os.path.join(self.shard_home, Shards.shard_name(shard))
+        return Cert(
+            self.ca,
+            csr=os.path.join(shard_dir, 'swcert.csr'),
+            key=os.path.join(shard_dir, 'swcert.key'),
+            crt=os.path.join(shard_dir, 'swcert.crt'),
+            digest=os.path.join(shard_dir, 'swcert.sha256'),
+            key_alg=self.key_alg,
+        )
+
+    def issue(self, domains, rotate=False):
+        """returns re-issued shards"""
+        issued = []
+        for shard, shard_domains in sorted(Shards.split(domains, self.count, self.by).items()):
+            shard_dir = os.path.join(self.shard_home, Shards.shard_name(shard))
+            if not os.path.isdir(shard_dir):
+                os.makedirs(shard_dir)
+                utils.set_real_owner(shard_dir)
+
+            cert = self.cert(shard)
+            cert.find_or_new_csr_key(rotate=rotate)
+            if cert.is_issued(shard_domains):
+                continue
+            print(f'Shard {Shards.shard_name(shard)}: {len(shard_domains)} domains')
+            cert.issue_cert(shard_domains)
+            issued.append(shard)
+        return issued
+
+    def nginx_map(self, domains, shard_dir=NGINX_SHARD_HOME):
+        shards = Shards.split(domains, self.count, self.by)
+        lines = [
+            '# Generated by swcert. Include into `http {}` and use in `server {}`:',
+            f'#   ssl_certificate {shard_dir}/$swcert_shard.crt;',
+            f'#   ssl_certificate_key {shard_dir}/$swcert_shard.key;',
+            'map $ssl_server_name $swcert_shard {',
+            '    hostnames;',
+        ]
+        if shards:
+            lines.append(f'    default {Shards.shard_name(min(shards))};')
+        for shard, shard_domains in sorted(shards.items()):
+            for domain in sorted(shard_domains):
+                lines.append(f'    {domain} {Shards.shard_name(shard)};')
+        lines.append('}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def store_name(shard):
+        """certificate name in Store"""
+        return f'shard-{Shards.shard_name(shard)}'
+
+    def deploy(self, domains, shard_dir=NGINX_SHARD_HOME, map_file=NGINX_SHARD_MAP, store=None):
+        """swap changed shards, see Store, and write the map. returns True if anything changed"""
+        store = store or Store()
+        changed = False
+        for shard in sorted(Shards.split(domains, self.count, self.by)):
+            cert = self.cert(shard)
+            name = Shards.shard_name(shard)
+            changed = store.deploy(Shards.store_name(shard), cert.key, cert.crt, os.path.join(shard_dir, f'{name}.key'),
+                                   os.path.join(shard_dir, f'{name}.crt')) or changed
+
+        nginx_map = self.nginx_map(domains, shard_dir)
+        try:
+            with open(map_file) as f:
+                map_changed = f.read() != nginx_map
+        except OSError:
+            map_changed = True
+        if map_changed:
+            print(f'Write {map_file}')
+            try:
+                os.makedirs(os.path.dirname(map_file), exist_ok=True)  # nginx reads it, root owned as the store
+                with open(map_file, 'w') as f:
+                    f.write(nginx_map)
+            except PermissionError as e:
+                raise RuntimeError(e.strerror + '. Run with `sudo`')
+            except OSError as e:
+                raise RuntimeError(f'Can not write {map_file}: {e.strerror or e}')
+            changed = True
+        return changed
@@ -0,0 +1,220 @@
+import asyncio
+import collections
+import datetime
+import os
+import queue
+import ssl
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .acme import is_local
+from .backend import Signer
+from .registry import Registry
+from .settings import (KEY_ALG, SNI_CACHE_SIZE, SNI_CERT_DAYS, SNI_HOME, SNI_HOST, SNI_KEY_POOL, SNI_LOCAL_SUFFIXES,
+                       SNI_PORT, SNI_UPSTREAM_HOST, SNI_UPSTREAM_PORT)
+
+try:
+    from cryptography import x509
+    from cryptography.hazmat.primitives import serialization
+except ImportError:  # pragma: no cover - checked by Signer
+    x509 = None
+
+RENEW_BEFORE = datetime.timedelta(days=1)  # spilled certificate closer to expiry is minted again
+PLACEHOLDER_NAME = 'placeholder.invalid'  # served while the certificate of a new name is minted in the background
+
+
+class KeyPool:
+    """Private keys generated ahead by a background thread, so a new name does not wait for rsa keygen"""
+
+    def __init__(self, key_alg=KEY_ALG, size=SNI_KEY_POOL):
+        self.key_alg = key_alg
+        self.keys = queue.Queue(maxsize=size)
+        Signer.new_key(key_alg)  # fail early on bad alg
+        self.thread = threading.Thread(target=self._fill, name='swcert-keypool', daemon=True)
+        self.thread.start()
+
+    def get(self, wait=True):
+        """pooled key, a fresh one when the pool is drained or None then if not wait"""
+        try:
+            return self.keys.get_nowait()
+        except queue.Empty:
+            return Signer.new_key(self.key_alg) if wait else None
+
+    def _fill(self):
+        while True:
+            self.keys.put(Signer.new_key(self.key_alg))  # blocks while the pool is full
+
+
+class CertCache:
+    """SSLContext per server name. Hot names are kept in memory LRU,
+    every minted certificate is spilled to disk and picked up from there after eviction or restart.
+    `context` runs in the SNI callback on the event loop, it never generates a key: with the pool drained
+    the name is minted by a worker and the handshake gets the placeholder, the next one the certificate"""
+
+    def __init__(self, ca, key_pool=None, size=SNI_CACHE_SIZE, sni_home=SNI_HOME, days=SNI_CERT_DAYS,
+                 local_suffixes=SNI_LOCAL_SUFFIXES):
+        self.signer = Signer(ca.ca_key, ca.ca_crt)
+        self.key_pool = key_pool or KeyPool()
+        self.size = size
+        self.days = days
+        self.local_suffixes = local_suffixes
+        # spilled certificates of another CA are useless, keep them apart
+        fingerprint = ca.get_crt_fingerprint(ca.ca_crt, ca.backend).replace(':', '')
+        self.spill_dir = os.path.join(sni_home, fingerprint[:16])
+        os.makedirs(self.spill_dir, mode=0o700, exist_ok=True)
+        self.contexts = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.minted = 0  # certificates of served names
+        self.pending = set()  # names minted by the executor
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='swcert-mint')
+        placeholder = os.path.join(self.spill_dir, f'{PLACEHOLDER_NAME}.pem')
+        if not self._is_fresh(placeholder):
+            self._mint(PLACEHOLDER_NAME, placeholder, Signer.new_key(self.key_pool.key_alg))
+        self.placeholder = CertCache._load(placeholder)
+
+    def context(self, server_name):
+        """returns SSLContext for server_name, the placeholder while it is minted, None if the name is not served"""
+        try:
+            name = Registry.normalize(server_name)
+        except ValueError:
+            return None
+        if name.startswith('*.') or not is_local(name, self.local_suffixes):
+            return None
+
+        with self.lock:
+            if name in self.contexts:
+                self.contexts.move_to_end(name)
+                return self.contexts[name]
+            if name in self.pending:
+                return self.placeholder
+            pem = os.path.join(self.spill_dir, f'{name}.pem')
+            if not self._is_fresh(pem):
+                private_key = self.key_pool.get(wait=False)
+                if private_key is None:
+                    self.pending.add(name)
+                    self.executor.submit(self._mint_later, name, pem)
+                    return self.placeholder
+                self._mint(name, pem, private_key)  # one signature
+                self.minted += 1
+            return self._add(name, CertCache._load(pem))
+
+    def _mint_later(self, name, pem):
+        try:
+            self._mint(name, pem, self.key_pool.get())
+            context = CertCache._load(pem)
+        except (OSError, ValueError, ssl.SSLError) as e:
+            print(f'Can not mint {name}: {e}', file=sys.stderr)
+            context = None
+        with self.lock:
+            self.pending.discard(name)
+            if context:
+                self.minted += 1
+                self._add(name, context)
+
+    def _add(self, name, context):
+        self.contexts[name] = context
+        if len(self.contexts) > self.size:
+            self.contexts.popitem(last=False)
+        return context
+
+    @staticmethod
+    def _load(pem):
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(pem)
+        return context
+
+    def _is_fresh(self, pem):
+        try:
+            with open(pem, 'rb') as f:
+                crt = x509.load_pem_x509_certificate(f.read())
+        except (OSError, ValueError):
+            return False
+        if hasattr(crt, 'not_valid_after_utc'):  # cryptography >= 42
+            not_valid_after = crt.not_valid_after_utc
+        else:
+            not_valid_after = crt.not_valid_after.replace(tzinfo=datetime.timezone.utc)
+        return not_valid_after > datetime.datetime.now(datetime.timezone.utc) + RENEW_BEFORE
+
+    def _mint(self, name, pem, private_key):
+        crt = self.signer.sign(private_key.public_key(), [name], days=self.days)
+        key_pem = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                            serialization.NoEncryption())
+        tmp = f'{pem}.{threading.get_ident()}.tmp'
+        with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+            f.write(key_pem + crt.public_bytes(serialization.Encoding.PEM) + self.signer.ca_pem)
+        os.replace(tmp, pem)
+        print(f'Minted {name}')
+
+
+class SniFront:
+    """TLS terminating front, certificate is picked by SNI, plain bytes go to upstream"""
+
+    def __init__(self, cache, host=SNI_HOST, port=SNI_PORT, upstream_host=SNI_UPSTREAM_HOST,
+                 upstream_port=SNI_UPSTREAM_PORT):
+        self.cache = cache
+        self.host = host
+        self.port = port
+        self.upstream_host = upstream_host
+        self.upstream_port = upstream_port
+        self.server = None
+
+    def make_ssl_context(self):
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.sni_callback = self.sni_callback
+        return ssl_context
+
+    def sni_callback(self, ssl_object, server_name, _ssl_context):
+        context = self.cache.context(server_name) if server_name else None
+        if context is None:
+            return ssl.ALERT_DESCRIPTION_UNRECOGNIZED_NAME
+        ssl_object.context = context
+        return None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port,
+                                                 ssl=self.make_ssl_context())
+        if not self.port:  # ephemeral
+            self.port = self.server.sockets[0].getsockname()[1]
+        print(f'TLS front {self.host}:{self.port} -> {self.upstream_host}:{self.upstream_port}')
+        return self.server
+
+    async def handle_client(self, reader, writer):
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection(self.upstream_host, self.upstream_port)
+        except OSError as e:
+            print(f'Upstream {self.upstream_host}:{self.upstream_port} {e}', file=sys.stderr)
+            writer.close()
+            return
+        await asyncio.gather(SniFront.pipe(reader, upstream_writer), SniFront.pipe(upstream_reader, writer))
+        upstream_writer.close()
+        writer.close()
+
+    @staticmethod
+    async def pipe(reader, writer):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+            if writer.can_write_eof():  # half-close, the other direction may still be sending
+                writer.write_eof()
+            else:
+                writer.close()
+        except (ConnectionError, ssl.SSLError):
+            writer.close()
+
+
+def serve(ca, key_alg=KEY_ALG, **front_params):
+    async def main():
+        front = SniFront(CertCache(ca, KeyPool(key_alg)), **front_params)
+        server = await front.start()
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print('swcert-sni stopped', file=sys.stderr)
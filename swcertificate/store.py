@@ -0,0 +1,172 @@
+import hashlib
+import os
+import os.path
+import shutil
+
+from .settings import STORE_HOME, STORE_KEEP
+
+KEY_NAME = 'swcert.key'
+CRT_NAME = 'swcert.crt'
+PEM_NAME = 'swcert.pem'  # crt and key in one file, HAProxy format
+FILE_MODE = 0o644  # TLS servers read the key in unprivileged workers, nginx `ssl_certificate $var` ex.
+DIR_MODE = 0o755
+
+
+class Store:
+    """Key and crt pairs kept by content hash, a generation is never changed once written:
+
+        <home>/<sha256>/swcert.key, swcert.crt  generations, swcert.pem is both in one file
+        <home>/links/<name> -> ../<sha256>      deployed generation of a certificate
+        <home>/links/<name>.previous            the one before, for rollback
+
+    Deployed key and crt paths are symlinks to links/<name>/..., so one rename switches both at once.
+    Everything is owned by the user running swcert, root under sudo, never chowned to the real user:
+    a server running as root follows the links, they must not lead where a user can write"""
+
+    def __init__(self, home=STORE_HOME, keep=STORE_KEEP):
+        self.home = home
+        self.keep = keep
+        self.links = os.path.join(home, 'links')
+
+    def add(self, key, crt):
+        """returns the generation dir of the pair. Raises RuntimeError"""
+        with open(key, 'rb') as f:
+            key_bytes = f.read()
+        with open(crt, 'rb') as f:
+            crt_bytes = f.read()
+        digest = hashlib.sha256()
+        for part in (key_bytes, crt_bytes):
+            digest.update(len(part).to_bytes(8, 'big'))
+            digest.update(part)
+        generation = os.path.join(self.home, digest.hexdigest())
+        if os.path.isdir(generation):
+            return generation
+
+        generation_tmp = f'{generation}.{os.getpid()}.tmp'
+        try:
+            Store._make_dir(self.home)
+            os.mkdir(generation_tmp)
+        except PermissionError as e:
+            raise RuntimeError(e.strerror + '. Run with `sudo`')
+        try:
+            for name, data in ((KEY_NAME, key_bytes), (CRT_NAME, crt_bytes), (PEM_NAME, crt_bytes + key_bytes)):
+                path = os.path.join(generation_tmp, name)
+                with open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, FILE_MODE), 'wb') as f:
+                    os.fchmod(f.fileno(), FILE_MODE)  # whatever umask is
+                    f.write(data)
+            os.chmod(generation_tmp, DIR_MODE)
+            os.rename(generation_tmp, generation)
+        except OSError as e:
+            shutil.rmtree(generation_tmp, ignore_errors=True)
+            if not os.path.isdir(generation):  # made by a concurrent add otherwise
+                raise RuntimeError(f'Can not write {generation}: {e.strerror or e}')
+        return generation
+
+    def current(self, name):
+        """deployed generation dir or None"""
+        return self._target(os.path.join(self.links, name))
+
+    def previous(self, name):
+        return self._target(os.path.join(self.links, f'{name}.previous'))
+
+    def deploy(self, name, key, crt, key_dst, crt_dst):
+        """Points key_dst and crt_dst at the pair. No byte is written to them, a reader sees either the old pair
+        or the new one. returns True if anything changed. Raises RuntimeError"""
+        changed = self.switch(name, self.add(key, crt))
+        for dst, file_name in ((key_dst, KEY_NAME), (crt_dst, CRT_NAME)):
+            changed = self.link(name, file_name, dst) or changed
+        self.gc()
+        return changed
+
+    def link(self, name, file_name, dst):
+        """dst to file_name of whatever generation `name` is at, returns True if changed. Raises RuntimeError"""
+        return Store._symlink(os.path.join(self.links, name, file_name), dst)
+
+    def rollback(self, name):
+        """back to the generation deployed before, returns it. Raises RuntimeError"""
+        previous = self.previous(name)
+        if not previous or not os.path.isdir(previous):
+            raise RuntimeError(f'No previous certificate of `{name}` to roll back to')
+        print(f'Roll back {name} to {os.path.basename(previous)}')
+        self.switch(name, previous)
+        return previous
+
+    def generations(self):
+        """generation dirs, last deployed first"""
+        try:
+            entries = [entry for entry in os.scandir(self.home) if Store._is_generation(entry.name) and entry.is_dir()]
+        except FileNotFoundError:
+            return []
+        entries.sort(key=lambda entry: entry.stat().st_mtime_ns, reverse=True)
+        return [entry.path for entry in entries]
+
+    def gc(self, keep=None):
+        """removes all but the `keep` last deployed generations, linked ones stay. returns removed"""
+        keep = self.keep if keep is None else keep
+        linked = set()
+        if os.path.isdir(self.links):
+            for link_name in os.listdir(self.links):
+                linked.add(self._target(os.path.join(self.links, link_name)))
+        removed = []
+        for generation in self.generations()[keep:]:
+            if os.path.normpath(generation) not in linked:
+                shutil.rmtree(generation, ignore_errors=True)
+                removed.append(generation)
+        return removed
+
+    def switch(self, name, generation):
+        """links/<name> to generation, the old target becomes <name>.previous. returns True if changed.
+        Raises RuntimeError"""
+        link = os.path.join(self.links, name)
+        generation = os.path.normpath(generation)
+        current = self._target(link)
+        try:
+            os.utime(generation)  # generations age by last deploy
+            if current == generation:
+                return False
+            Store._make_dir(self.links)
+        except PermissionError as e:
+            raise RuntimeError(e.strerror + '. Run with `sudo`')
+        target = os.path.join(os.pardir, os.path.basename(generation))
+        if current:
+            Store._symlink(os.path.join(os.pardir, os.path.basename(current)), f'{link}.previous')
+        Store._symlink(target, link)
+        return True
+
+    def _target(self, link):
+        try:
+            target = os.readlink(link)
+        except OSError:
+            return None
+        return os.path.normpath(os.path.join(os.path.dirname(link), target))
+
+    @staticmethod
+    def _is_generation(name):
+        return len(name) == 64 and all(char in '0123456789abcdef' for char in name)
+
+    @staticmethod
+    def _make_dir(path):
+        """makedirs readable by all, nothing if it exists"""
+        if not os.path.isdir(path):
+            os.makedirs(path)
+            os.chmod(path, DIR_MODE)
+
+    @staticmethod
+    def _symlink(target, path):
+        """atomic replace of path by a symlink, returns True if it pointed elsewhere. Raises RuntimeError"""
+        try:
+            if os.readlink(path) == target:
+                return False
+        except OSError:
+            pass
+        path_tmp = f'{path}.{os.getpid()}.tmp'
+        try:
+            Store._make_dir(os.path.dirname(path))
+            if os.path.lexists(path_tmp):
+                os.remove(path_tmp)
+            os.symlink(target, path_tmp)
+            os.replace(path_tmp, path)
+        except PermissionError as e:
+            raise RuntimeError(e.strerror + '. Run with `sudo`')
+        print(f'Link {path} -> {target}')
+        return True
@@ -0,0 +1,183 @@
+import os
+import os.path
+import re
+
+from . import utils
+from .settings import CA_ETC_PATH, CA_OS_PATH, ETC_CA_BUNDLE, ETC_CA_HOOKS, ETC_CERTS_DIR
+
+HASH_LINK = re.compile(r'^[0-9a-f]{8}\.\d+$')
+
+
+class SystemTrust:
+    """What `update-ca-certificates` does for one CA, the rest of /etc/ssl/certs is not touched:
+    pem link, its subject hash link and its block in the bundle. Falls back to `update-ca-certificates --fresh`"""
+
+    def __init__(self, ca_crt=CA_OS_PATH, pem=CA_ETC_PATH, certs_dir=ETC_CERTS_DIR, bundle=ETC_CA_BUNDLE,
+                 hooks=ETC_CA_HOOKS):
+        self.ca_crt = ca_crt
+        self.pem = pem
+        self.certs_dir = certs_dir
+        self.bundle = bundle
+        self.hooks = hooks
+
+    def install(self):
+        """returns `incremental` or `fresh`"""
+        if not self.can_install():
+            utils.etc_install()
+            return 'fresh'
+        print(f'Update {self.certs_dir} for {self.ca_crt}')
+        try:
+            with open(self.ca_crt, 'rb') as f:
+                crt_pem = f.read()
+            crt_der = utils.pem_blocks(crt_pem)[0][1]
+            subject_hash = self.subject_hash()
+            changed = self._link_pem()
+            changed = self._link_hash(subject_hash) or changed
+            changed = self._update_bundle(crt_pem, SystemTrust.subject_der(crt_der)) or changed
+        except PermissionError as e:
+            raise RuntimeError(e.strerror + '. Run with `sudo`')
+        except (OSError, ValueError, IndexError, RuntimeError) as e:
+            print(f'Incremental update failed: {e}. Rebuild all')
+            utils.etc_install()
+            return 'fresh'
+        if changed:
+            self._run_hooks()
+        return 'incremental'
+
+    def can_install(self):
+        """the layout update-ca-certificates keeps, else only it knows what to do"""
+        return os.path.isdir(self.certs_dir) and os.path.isfile(self.bundle) and \
+            os.path.dirname(self.pem) == self.certs_dir and utils.is_installed('openssl')
+
+    def subject_hash(self):
+        """OpenSSL's name of the hash link. Raises RuntimeError"""
+        complete = utils.subproc_out(run=['openssl', 'x509', '-subject_hash', '-noout', '-in', self.ca_crt])
+        subject_hash = complete.stdout.decode('utf-8').strip()
+        if not re.match(r'^[0-9a-f]{8}$', subject_hash):
+            raise RuntimeError(f'Unexpected subject hash `{subject_hash}`')
+        return subject_hash
+
+    def _link_pem(self):
+        return SystemTrust._symlink(self.ca_crt, self.pem)
+
+    def _link_hash(self, subject_hash):
+        """<hash>.<n> -> pem, n is the first free one as `openssl rehash` does. Links of the old hash are removed"""
+        pem_name = os.path.basename(self.pem)
+        changed = False
+        linked = None
+        taken = set()
+        for entry in os.scandir(self.certs_dir):
+            if not HASH_LINK.match(entry.name) or not entry.is_symlink():
+                continue
+            if os.readlink(entry.path) != pem_name:
+                taken.add(entry.name)
+            elif entry.name.startswith(f'{subject_hash}.') and not linked:
+                linked = entry.name
+            else:
+                os.remove(entry.path)
+                changed = True
+        if linked:
+            return changed
+
+        n = 0
+        while f'{subject_hash}.{n}' in taken:
+            n += 1
+        SystemTrust._symlink(pem_name, os.path.join(self.certs_dir, f'{subject_hash}.{n}'))
+        return True
+
+    def _update_bundle(self, crt_pem, subject_der):
+        """replaces the CA block, other blocks stay byte for byte. returns True if changed"""
+        with open(self.bundle, 'rb') as f:
+            bundle = f.read()
+        block = crt_pem if crt_pem.endswith(b'\n') else crt_pem + b'\n'
+
+        parts = []
+        pos = 0
+        found = False
+        for match, der in utils.pem_blocks(bundle):
+            try:
+                ours = SystemTrust.subject_der(der) == subject_der
+            except (ValueError, IndexError):
+                ours = False
+            if not ours:
+                continue
+            parts.append(bundle[pos:match.start()])
+            pos = match.end()
+            if not found and match.group(0) == block:
+                parts.append(block)  # in place if unchanged
+                found = True
+        parts.append(bundle[pos:])
+        new_bundle = b''.join(parts)
+        if not found:
+            if new_bundle and not new_bundle.endswith(b'\n'):
+                new_bundle += b'\n'
+            new_bundle += block
+        if new_bundle == bundle:
+            return False
+
+        print(f'Update {self.bundle}')
+        bundle_tmp = f'{self.bundle}.{os.getpid()}.tmp'
+        with open(os.open(bundle_tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644), 'wb') as f:
+            f.write(new_bundle)
+        os.replace(bundle_tmp, self.bundle)
+        return True
+
+    def _run_hooks(self):
+        """update.d hooks get added certs on stdin as update-ca-certificates gives them, Java keystore ex."""
+        try:
+            hooks = sorted(entry.path for entry in os.scandir(self.hooks)
+                           if re.match(r'^[\w-]+$', entry.name) and os.access(entry.path, os.X_OK))
+        except OSError:
+            return
+        for hook in hooks:
+            try:
+                utils.subproc_out(run=[hook], msg=f'Run {hook}', input=f'+{self.pem}\n'.encode('utf-8'))
+            except RuntimeError as e:
+                print(f'{hook} failed: {e}')
+
+    @staticmethod
+    def subject_der(der):
+        """subject Name of a DER certificate as bytes, enough to tell certificates apart without a crypto lib.
+        Raises ValueError or IndexError"""
+        _tag, tbs, _end = _der_item(der, 0)  # Certificate
+        _tag, pos, _end = _der_item(der, tbs)  # TBSCertificate
+        fields = []
+        while len(fields) < 6:
+            tag, _start, end = _der_item(der, pos)
+            fields.append((tag, der[pos:end]))
+            pos = end
+        if fields[0][0] != 0xa0:  # v1, no version field
+            return fields[4][1]
+        return fields[5][1]
+
+    @staticmethod
+    def _symlink(target, path):
+        """atomic replace, returns True if it pointed elsewhere"""
+        try:
+            if os.readlink(path) == target:
+                return False
+        except OSError:
+            pass
+        path_tmp = f'{path}.{os.getpid()}.tmp'
+        if os.path.lexists(path_tmp):
+            os.remove(path_tmp)
+        os.symlink(target, path_tmp)
+        os.replace(path_tmp, path)
+        print(f'Link {path} -> {target}')
+        return True
+
+
+def _der_item(data, pos):
+    """returns (tag, value start, value end) of the DER item at pos. Raises ValueError or IndexError"""
+    tag = data[pos]
+    length = data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        size = length & 0x7f
+        if not size or size > 4:
+            raise ValueError('Bad DER length')
+        length = int.from_bytes(data[pos:pos + size], 'big')
+        pos += size
+    if pos + length > len(data):
+        raise ValueError('DER item is longer than data')
+    return tag, pos, pos + length
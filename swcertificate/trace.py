@@ -0,0 +1,121 @@
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Tracer:
+    """Nested timing spans. Off by default, a disabled span costs a context manager only"""
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = []  # finished spans, dicts
+        self.lock = threading.Lock()
+        self.started_ns = time.perf_counter_ns()
+        self.ids = itertools.count(1)
+        self.current = contextvars.ContextVar('swcert_span', default=None)  # id of the innermost open span
+
+    def enable(self):
+        self.enabled = True
+        self.spans = []
+        self.started_ns = time.perf_counter_ns()
+
+    @contextmanager
+    def span(self, name, cat='func', **args):
+        """yields args dict, values put there while the span is open are recorded too"""
+        if not self.enabled:
+            yield args
+            return
+        span = {'name': name, 'cat': cat, 'start_ns': time.perf_counter_ns(), 'tid': threading.get_ident(),
+                'id': next(self.ids), 'parent': self.current.get(), 'args': args}
+        token = self.current.set(span['id'])
+        try:
+            yield args
+        except BaseException as e:
+            args.setdefault('error', str(e) or type(e).__name__)
+            raise
+        finally:
+            span['end_ns'] = time.perf_counter_ns()
+            self.current.reset(token)
+            with self.lock:
+                self.spans.append(span)
+
+    def phases(self):
+        """[(phase span, [subprocess spans in it])] in start order. A subprocess counts once, in the closest phase
+        among its parents, or without parents in the innermost phase open around it on its thread.
+        Other threads get parents by `in_context`"""
+        spans = sorted(self.spans, key=lambda span: span['start_ns'])
+        by_id = {span['id']: span for span in spans}
+        phases = [span for span in spans if span['cat'] == 'phase']
+        subprocs = {phase['id']: [] for phase in phases}
+        for span in spans:
+            if span['cat'] != 'subprocess':
+                continue
+            phase = Tracer._parent_phase(span, by_id)
+            if phase is None and span['parent'] is None:
+                phase = next((phase for phase in reversed(phases) if phase['tid'] == span['tid']
+                              and phase['start_ns'] <= span['start_ns'] < phase['end_ns']), None)
+            if phase is not None:
+                subprocs[phase['id']].append(span)
+        return [(phase, subprocs[phase['id']]) for phase in phases]
+
+    @staticmethod
+    def _parent_phase(span, by_id):
+        parent = by_id.get(span['parent'])
+        while parent is not None and parent['cat'] != 'phase':
+            parent = by_id.get(parent['parent'])
+        return parent
+
+    def report(self, top=5):
+        """per-phase breakdown text"""
+        lines = [f'{"Phase":<20} {"Time":>9} {"Subprocesses":>18}']
+        phases = self.phases()
+        for phase, subprocs in phases:
+            phase_ns = phase['end_ns'] - phase['start_ns']
+            subprocs_ns = sum(span['end_ns'] - span['start_ns'] for span in subprocs)
+            lines.append(f'{phase["name"]:<20} {phase_ns / 1e9:8.3f}s {len(subprocs):>6} x {subprocs_ns / 1e9:8.3f}s')
+        if phases:  # wall time, phases may overlap
+            total_ns = max(phase['end_ns'] for phase, _ in phases) - min(phase['start_ns'] for phase, _ in phases)
+            lines.append(f'{"Total":<20} {total_ns / 1e9:8.3f}s')
+
+        slowest = sorted((span for span in self.spans if span['cat'] == 'subprocess'),
+                         key=lambda span: span['start_ns'] - span['end_ns'])[:top]
+        if slowest:
+            lines.append('Slowest subprocesses:')
+            for span in slowest:
+                lines.append(f'\t{(span["end_ns"] - span["start_ns"]) / 1e9:8.3f}s '
+                             f'exit {span["args"].get("exit")} {span["args"].get("cmd", span["name"])}')
+        return '\n'.join(lines)
+
+    def chrome_trace(self):
+        """Chrome trace-event format, open in chrome://tracing or ui.perfetto.dev"""
+        pid = os.getpid()
+        events = [{
+            'name': span['name'],
+            'cat': span['cat'],
+            'ph': 'X',
+            'ts': (span['start_ns'] - self.started_ns) / 1000,
+            'dur': (span['end_ns'] - span['start_ns']) / 1000,
+            'pid': pid,
+            'tid': span['tid'],
+            'args': {key: value if isinstance(value, (int, float, bool)) or value is None else str(value)
+                     for key, value in span['args'].items()},
+        } for span in sorted(self.spans, key=lambda span: span['start_ns'])]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+
+def in_context(func):
+    """func to run in another thread, spans it opens get the caller's open span as parent"""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(func, *args, **kwargs)  # a context is entered once at a time
+
+
+tracer = Tracer()
+span = tracer.span
@@ -0,0 +1,50 @@
+import sys
+
+from . import utils
+from .ca import Ca
+from .ledger import Ledger
+from .nss import Nss
+
+
+class Trust:
+    """CA trusted by the system and browser NSS dbs. Skipped while the ledger shows nothing changed since
+    the last full sync. `check` and `sync` are apart, so swcert runs them as separate stages"""
+
+    def __init__(self, ca, ledger=None):
+        self.ca = ca
+        self.ledger = ledger or Ledger()
+
+    def ensure(self, nss_dirs):
+        """check and sync at once. returns {nss_dir: error} of NSS dirs which failed. Raises RuntimeError"""
+        found_nss_dirs = Nss.find(nss_dirs=nss_dirs)
+        trusted_paths = self.check(found_nss_dirs)
+        if trusted_paths is None:
+            return {}
+        return self.sync(found_nss_dirs, trusted_paths, utils.is_installed('certutil'))
+
+    def check(self, found_nss_dirs):
+        """returns trusted_paths if NSS sync is needed or None. Finds or makes the CA when it is"""
+        ca = self.ca
+        trusted_paths = ca.trusted_paths() + Nss.db_files(found_nss_dirs)
+        if found_nss_dirs and self.ledger.is_trusted(trusted_paths, Ca.get_crt_fingerprint(ca.ca_crt, ca.backend)):
+            print('CA is trusted, nothing changed since last check')
+            return None
+        ca.find_or_new_ca_key()
+        ca.find_or_new_ca_crt()
+        return trusted_paths
+
+    def sync(self, found_nss_dirs, trusted_paths, has_certutil):
+        """CA to every NSS dir, recorded in the ledger if none failed.
+        returns {nss_dir: error} of NSS dirs which failed. Raises RuntimeError"""
+        ca = self.ca
+        if not has_certutil:
+            raise RuntimeError('Install `certutil` by your self.\nUbuntu ex.\n\tsudo apt install libnss3-tools\n'
+                               'Or browsers will not trust your https')
+        if not found_nss_dirs:
+            raise RuntimeError('NSS dirs not found\nBrowsers will not trust your https')
+        _synced, failed = Nss.sync(found_nss_dirs, Ca.get_crt_serial(ca.ca_crt, ca.backend), ca.ca_crt)
+        for nss_dir, err in failed.items():
+            print(f'Skip NSS {nss_dir}: {err}', file=sys.stderr)
+        if not failed:
+            self.ledger.record(Ca.get_crt_fingerprint(ca.ca_crt, ca.backend), trusted_paths)
+        return failed
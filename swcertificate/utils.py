@@ -1,16 +1,23 @@
+import base64
+import filecmp
 import os
 import os.path
+import re
 import shutil
 import subprocess
 import sys
 
+from .trace import span
+
+PEM_BLOCK = re.compile(rb'-----BEGIN CERTIFICATE-----\r?\n(.+?)-----END CERTIFICATE-----\r?\n?', re.DOTALL)
+
 
 def subproc(run, msg=None, exit_on_fail=False):
     """return True False"""
     if msg:
         print(msg)
     try:
-        subprocess.run(run, check=True, capture_output=True)
+        _run(run, msg)
     except Exception as e:  # pylint: disable=broad-except
         if hasattr(e, 'stderr'):
             err_msg = getattr(e, 'stderr').decode('utf-8')
@@ -23,13 +30,13 @@ def subproc(run, msg=None, exit_on_fail=False):
     return True
 
 
-def subproc_out(run, msg=None):
-    """returns subproc.complete obj"""
+def subproc_out(run, msg=None, input=None):  # pylint: disable=redefined-builtin
+    """returns subproc.complete obj. input: bytes for stdin"""
     if msg:
         print(msg)
 
     try:
-        complete = subprocess.run(run, check=True, capture_output=True)
+        complete = _run(run, msg, input)
     except Exception as e:  # pylint: disable=broad-except
         if hasattr(e, 'stderr'):
             err_msg = getattr(e, 'stderr').decode('utf-8')
@@ -39,25 +46,58 @@ def subproc_out(run, msg=None):
     return complete
 
 
+def _run(run, msg, input=None):  # pylint: disable=redefined-builtin
+    """subprocess.run traced with command, exit status and output size"""
+    with span(os.path.basename(run[0]), cat='subprocess', cmd=' '.join(run), msg=msg) as args:
+        try:
+            complete = subprocess.run(run, check=True, capture_output=True, input=input)
+        except subprocess.CalledProcessError as e:
+            args.update(exit=e.returncode, stdout_bytes=len(e.stdout or b''), stderr_bytes=len(e.stderr or b''))
+            raise
+        args.update(exit=complete.returncode, stdout_bytes=len(complete.stdout), stderr_bytes=len(complete.stderr))
+    return complete
+
+
 def set_real_owner(path):
     owner = os.getlogin()
     shutil.chown(path, user=owner, group=owner)
 
 
+def make_real_dir(path):
+    """makedirs owned by the real user, nothing if it exists"""
+    if not os.path.exists(path):
+        os.makedirs(path)
+        set_real_owner(path)
+
+
 def copy(src, dst):
     print(f'Copy {src} -> {dst}')
     dst_dir = os.path.dirname(dst)
     try:
-        if not os.path.exists(dst_dir):
-            os.makedirs(dst_dir)
-            set_real_owner(dst_dir)
-        shutil.copyfile(src, dst)
+        with span('copy', cat='io', src=src, dst=dst) as args:
+            make_real_dir(dst_dir)
+            shutil.copyfile(src, dst)
+            args['bytes'] = os.path.getsize(dst)
     except PermissionError as e:
         raise RuntimeError(e.strerror + '. Run with `sudo`')
         # sys.exit(e.strerror + '. Run with `sudo`')
 
 
+def is_same(src, dst):
+    """True if both files exist and have the same bytes"""
+    try:
+        return filecmp.cmp(src, dst, shallow=False)
+    except OSError:
+        return False
+
+
+def pem_blocks(data):
+    """[(match, DER)] of certificates in PEM bytes"""
+    return [(match, base64.b64decode(match.group(1))) for match in PEM_BLOCK.finditer(data)]
+
+
 def etc_install():
+    """rebuilds all of /etc/ssl/certs, see SystemTrust for one CA"""
     subproc(msg='Update /etc/ssl/certs/', run=['update-ca-certificates', '--fresh'], exit_on_fail=True)
 
 
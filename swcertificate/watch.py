@@ -0,0 +1,96 @@
+import ctypes
+import ctypes.util
+import os
+import os.path
+import select
+import struct
+import time
+
+from .settings import WATCH_DEBOUNCE
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT = struct.Struct('iIII')  # wd, mask, cookie, len, then name
+
+
+class Watcher:
+    """inotify on dirs, file events are grouped into bursts.
+    Dirs are watched rather than files, files are replaced by rename"""
+
+    def __init__(self, paths, debounce=WATCH_DEBOUNCE):
+        """paths: {dir: names to watch in it or None for any name}"""
+        self.debounce = debounce
+        self.libc = Watcher._libc()
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), f'inotify_init1: {os.strerror(ctypes.get_errno())}')
+        self.dirs = {}  # wd: (dir, names)
+        for watch_dir, names in paths.items():
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(watch_dir), WATCH_MASK)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f'inotify_add_watch {watch_dir}: {os.strerror(ctypes.get_errno())}')
+            self.dirs[wd] = (watch_dir, names)
+
+    @staticmethod
+    def _libc():
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not available, Linux only')
+        return libc
+
+    def close(self):
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        self.close()
+
+    def read(self, timeout=None):
+        """returns changed paths, empty set on timeout"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        data = os.read(self.fd, 65536)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, _mask, _cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if wd in self.dirs and Watcher._is_watched(name, self.dirs[wd][1]):
+                changed.add(os.path.join(self.dirs[wd][0], name))
+        return changed
+
+    @staticmethod
+    def _is_watched(name, names):
+        if not name or name.endswith(('.tmp', '.lock')):  # atomic write leftovers and flock files
+            return False
+        return names is None or name in names
+
+    def burst(self):
+        """blocks until something changed and nothing else changed for `debounce` seconds, returns changed paths"""
+        changed = set()
+        while not changed:
+            changed = self.read()
+        quiet_since = time.monotonic()
+        while True:
+            wait = self.debounce - (time.monotonic() - quiet_since)
+            if wait <= 0:
+                return changed
+            more = self.read(wait)
+            if more:
+                changed.update(more)
+                quiet_since = time.monotonic()
+
+    def bursts(self):
+        while True:
+            yield self.burst()
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import os.path
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+from cryptography.x509.oid import NameOID
+
+from swcertificate import Ca
+from swcertificate.acme import AcmeServer, b64encode, is_local
+from swcertificate.backend import CryptographyBackend
+
+
+@pytest.fixture
+def acme(tmpdir):
+    ca = Ca(ca_key=os.path.join(tmpdir, 'ca.key'), ca_crt=os.path.join(tmpdir, 'ca.crt'), backend=CryptographyBackend)
+    ca.make_ca_key()
+    ca.make_ca_crt()
+    server = AcmeServer(ca, host='127.0.0.1', port=0, tls=False)
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(server.start())
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    started.wait(10)
+    yield server, ca
+    loop.call_soon_threadsafe(loop.stop)
+
+
+class AcmeClient:
+    """minimal ES256 ACME client"""
+
+    def __init__(self, directory_url):
+        self.key = ec.generate_private_key(ec.SECP256R1())
+        numbers = self.key.public_key().public_numbers()
+        self.jwk = {'kty': 'EC', 'crv': 'P-256',
+                    'x': b64encode(numbers.x.to_bytes(32, 'big')), 'y': b64encode(numbers.y.to_bytes(32, 'big'))}
+        self.kid = None
+        with urllib.request.urlopen(directory_url) as response:
+            self.directory = json.load(response)
+
+    def nonce(self):
+        request = urllib.request.Request(self.directory['newNonce'], method='HEAD')
+        with urllib.request.urlopen(request) as response:
+            return response.headers['Replay-Nonce']
+
+    def post(self, url, payload, nonce=None):
+        protected = {'alg': 'ES256', 'nonce': nonce or self.nonce(), 'url': url}
+        if self.kid:
+            protected['kid'] = self.kid
+        else:
+            protected['jwk'] = self.jwk
+        protected = b64encode(json.dumps(protected).encode())
+        payload = '' if payload is None else b64encode(json.dumps(payload).encode())
+        r, s = decode_dss_signature(self.key.sign(f'{protected}.{payload}'.encode(), ec.ECDSA(hashes.SHA256())))
+        body = {'protected': protected, 'payload': payload,
+                'signature': b64encode(r.to_bytes(32, 'big') + s.to_bytes(32, 'big'))}
+        request = urllib.request.Request(url, data=json.dumps(body).encode(),
+                                         headers={'Content-Type': 'application/jose+json'})
+        with urllib.request.urlopen(request) as response:
+            data = response.read()
+            if response.headers['Content-Type'] == 'application/json':
+                data = json.loads(data)
+            return response.headers, data
+
+
+class TestIsLocal:
+    @pytest.mark.parametrize('domain', ['localhost', 'somehost.lan', '*.somehost.test', 'a.b.home.arpa'])
+    def test_local(self, domain):
+        assert is_local(domain)
+
+    @pytest.mark.parametrize('domain', ['example.com', 'lan.com', 'notlocalhost'])
+    def test_not_local(self, domain):
+        assert not is_local(domain)
+
+
+class TestAcme:
+    def test_issue(self, acme):
+        server, ca = acme
+        client = AcmeClient(f'{server.base_url}/directory')
+        headers, account = client.post(client.directory['newAccount'], {'termsOfServiceAgreed': True})
+        assert account['status'] == 'valid'
+        client.kid = headers['Location']
+
+        domains = ['somehost.lan', '*.somehost.lan']
+        headers, order = client.post(client.directory['newOrder'],
+                                     {'identifiers': [{'type': 'dns', 'value': domain} for domain in domains]})
+        assert order['status'] == 'ready'
+        _, authz = client.post(order['authorizations'][1], None)
+        assert authz['status'] == 'valid' and authz['wildcard']
+
+        cert_key = ec.generate_private_key(ec.SECP256R1())
+        csr = x509.CertificateSigningRequestBuilder() \
+            .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, domains[0])])) \
+            .add_extension(x509.SubjectAlternativeName([x509.DNSName(domain) for domain in domains]), critical=False) \
+            .sign(cert_key, hashes.SHA256())
+        _, order = client.post(order['finalize'], {'csr': b64encode(csr.public_bytes(serialization.Encoding.DER))})
+        assert order['status'] == 'valid'
+
+        _, chain = client.post(order['certificate'], None)
+        end = b'-----END CERTIFICATE-----\n'
+        leaf, ca_cert = [x509.load_pem_x509_certificate(block + end) for block in chain.split(end)[:2]]
+        with open(ca.ca_crt, 'rb') as f:
+            assert ca_cert == x509.load_pem_x509_certificate(f.read())
+        assert leaf.issuer == ca_cert.subject
+        san = leaf.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+        assert sorted(san.get_values_for_type(x509.DNSName)) == sorted(domains)
+
+    def test_existing_account(self, acme):
+        server, _ca = acme
+        client = AcmeClient(f'{server.base_url}/directory')
+        headers, _ = client.post(client.directory['newAccount'], {})
+        location = headers['Location']
+        headers, _ = client.post(client.directory['newAccount'], {'onlyReturnExisting': True})
+        assert headers['Location'] == location
+
+    def test_account_orders(self, acme):
+        server, _ca = acme
+        client = AcmeClient(f'{server.base_url}/directory')
+        _, account = client.post(client.directory['newAccount'], {})
+        client.kid = client.post(client.directory['newAccount'], {})[0]['Location']
+        headers, _ = client.post(client.directory['newOrder'], {'identifiers': [{'type': 'dns', 'value': 'some.lan'}]})
+        _, orders = client.post(account['orders'], None)
+        assert orders == {'orders': [headers['Location']]}
+
+        other = AcmeClient(f'{server.base_url}/directory')
+        other.kid = other.post(other.directory['newAccount'], {})[0]['Location']
+        with pytest.raises(urllib.error.HTTPError) as excinfo:
+            other.post(account['orders'], None)
+        assert excinfo.value.code == 403
+
+    def test_not_local(self, acme):
+        server, _ca = acme
+        client = AcmeClient(f'{server.base_url}/directory')
+        client.kid = client.post(client.directory['newAccount'], {})[0]['Location']
+        with pytest.raises(urllib.error.HTTPError) as excinfo:
+            client.post(client.directory['newOrder'], {'identifiers': [{'type': 'dns', 'value': 'example.com'}]})
+        assert json.load(excinfo.value)['type'] == 'urn:ietf:params:acme:error:rejectedIdentifier'
+
+    def test_bad_nonce(self, acme):
+        server, _ca = acme
+        client = AcmeClient(f'{server.base_url}/directory')
+        with pytest.raises(urllib.error.HTTPError) as excinfo:
+            client.post(client.directory['newAccount'], {}, nonce='reused')
+        assert json.load(excinfo.value)['type'] == 'urn:ietf:params:acme:error:badNonce'
+
+    def test_not_object_header(self, acme):
+        server, _ca = acme
+        client = AcmeClient(f'{server.base_url}/directory')
+        for protected in ([], {'nonce': ['a'], 'url': client.directory['newAccount']}):
+            body = {'protected': b64encode(json.dumps(protected).encode()), 'payload': '', 'signature': ''}
+            request = urllib.request.Request(client.directory['newAccount'], data=json.dumps(body).encode())
+            with pytest.raises(urllib.error.HTTPError) as excinfo:
+                urllib.request.urlopen(request)
+            assert json.load(excinfo.value)['type'] == 'urn:ietf:params:acme:error:malformed'
+
+    def test_no_key_change(self, acme):
+        server, _ca = acme
+        assert 'keyChange' not in AcmeClient(f'{server.base_url}/directory').directory
+
+
+class TestExpire:
+    def test_nonces_bounded(self, acme):
+        server, _ca = acme
+        server.nonce_max = 10
+        nonces = [server.new_nonce() for _ in range(100)]
+        assert list(server.nonces) == nonces[-10:]
+
+    def test_nonce_expired(self, acme):
+        server, _ca = acme
+        client = AcmeClient(f'{server.base_url}/directory')
+        nonce = client.nonce()
+        server.nonces[nonce] -= server.nonce_ttl
+        with pytest.raises(urllib.error.HTTPError) as excinfo:
+            client.post(client.directory['newAccount'], {}, nonce=nonce)
+        assert json.load(excinfo.value)['type'] == 'urn:ietf:params:acme:error:badNonce'
+        assert server.new_nonce() and nonce not in server.nonces
+
+    def test_order_expired(self, acme):
+        server, _ca = acme
+        client = AcmeClient(f'{server.base_url}/directory')
+        client.kid = client.post(client.directory['newAccount'], {})[0]['Location']
+        headers, order = client.post(client.directory['newOrder'],
+                                     {'identifiers': [{'type': 'dns', 'value': 'somehost.lan'}]})
+        order_id = headers['Location'].rsplit('/', 1)[-1]
+        server.orders[order_id]['expires'] = AcmeServer.expires(-1)
+        for authz_url in order['authorizations']:
+            server.authzs[authz_url.rsplit('/', 1)[-1]]['expires'] = AcmeServer.expires(-1)
+
+        with pytest.raises(urllib.error.HTTPError) as excinfo:
+            client.post(headers['Location'], None)
+        assert excinfo.value.code == 404
+        client.post(client.directory['newOrder'], {'identifiers': [{'type': 'dns', 'value': 'other.lan'}]})
+        assert order_id not in server.orders
+        assert len(server.orders) == 1 and len(server.authzs) == 1
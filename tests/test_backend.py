@@ -0,0 +1,90 @@
+import os
+import os.path
+import re
+import subprocess
+
+import pytest
+
+from swcertificate.backend import BACKENDS, CryptographyBackend, OpensslBackend, get_backend
+
+
+@pytest.fixture(params=list(BACKENDS))
+def backend(request):
+    if request.param == CryptographyBackend.name:
+        pytest.importorskip('cryptography')
+    return BACKENDS[request.param]
+
+
+def make_ca(backend, tmpdir, key_alg='rsa:2048'):
+    ca_key = os.path.join(tmpdir, 'ca.key')
+    ca_crt = os.path.join(tmpdir, 'ca.crt')
+    backend.make_key(ca_key, key_alg)
+    backend.make_ca_crt(ca_key, ca_crt)
+    return ca_key, ca_crt
+
+
+class TestGetBackend:
+    def test_openssl(self):
+        assert get_backend('openssl') is OpensslBackend
+
+    def test_unknown(self):
+        with pytest.raises(ValueError):
+            get_backend('some')
+
+
+class TestKey:
+    @pytest.mark.parametrize('key_alg', ['rsa:2048', 'ec:P-256', 'ec:P-384', 'ed25519'])
+    def test_ok(self, backend, tmpdir, key_alg):
+        key = os.path.join(tmpdir, 'some.key')
+        backend.make_key(key, key_alg)
+        assert backend.check_key(key)
+
+    @pytest.mark.parametrize('key_alg', ['rsa:2048', 'ec:P-256', 'ec:P-384', 'ed25519'])
+    def test_get_key_alg(self, backend, tmpdir, key_alg):
+        key = os.path.join(tmpdir, 'some.key')
+        backend.make_key(key, key_alg)
+        assert backend.get_key_alg(key) == key_alg
+
+    def test_get_key_alg_not_exists(self, backend, tmpdir):
+        assert not backend.get_key_alg(os.path.join(tmpdir, 'some.key'))
+
+    def test_unknown_alg(self, backend, tmpdir):
+        with pytest.raises(ValueError):
+            backend.make_key(os.path.join(tmpdir, 'some.key'), 'dsa:1024')
+
+    def test_not_exists(self, backend, tmpdir):
+        assert not backend.check_key(os.path.join(tmpdir, 'some.key'))
+
+
+class TestCaCrt:
+    def test_serial(self, backend, tmpdir):
+        _ca_key, ca_crt = make_ca(backend, tmpdir)
+        serial = backend.get_crt_serial(ca_crt)
+        assert re.search(r'^[a-f0-9:]+$', serial)
+        # both backends must agree to compare serials of already installed CA copies
+        assert OpensslBackend.get_crt_serial(ca_crt) == serial
+
+    def test_fingerprint(self, backend, tmpdir):
+        _ca_key, ca_crt = make_ca(backend, tmpdir)
+        fingerprint = backend.get_crt_fingerprint(ca_crt)
+        assert re.search(r'^([a-f0-9]{2}:){31}[a-f0-9]{2}$', fingerprint)
+        assert OpensslBackend.get_crt_fingerprint(ca_crt) == fingerprint
+
+    def test_fingerprint_not_exists(self, backend, tmpdir):
+        assert not backend.get_crt_fingerprint(os.path.join(tmpdir, 'some.crt'))
+
+
+class TestSignCsr:
+    @pytest.mark.parametrize('key_alg', ['rsa:2048', 'ec:P-256', 'ed25519'])
+    def test_ok(self, backend, tmpdir, key_alg):
+        ca_key, ca_crt = make_ca(backend, tmpdir, key_alg)
+        key = os.path.join(tmpdir, 'some.key')
+        csr = os.path.join(tmpdir, 'some.csr')
+        crt = os.path.join(tmpdir, 'some.crt')
+        backend.make_csr_key(key, csr, key_alg=key_alg)
+        backend.sign_csr(csr, crt, ca_key, ca_crt, ['domainame', '*.domainame'])
+
+        complete = subprocess.run(['openssl', 'verify', '-CAfile', ca_crt, crt], check=True, capture_output=True)
+        assert b'OK' in complete.stdout
+        complete = subprocess.run(['openssl', 'x509', '-noout', '-text', '-in', crt], check=True, capture_output=True)
+        assert b'DNS:domainame, DNS:*.domainame' in complete.stdout
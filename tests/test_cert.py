@@ -1,5 +1,6 @@
 import os
 import os.path
+import time
 
 import pytest
 
@@ -51,7 +52,7 @@ class TestDeleteDomain:
 
         with pytest.raises(SystemExit) as excinfo:
             cert.delete_domain('some')
-        assert 'File not found' in excinfo.value.code
+        assert 'Domain not found' in excinfo.value.code
 
 
 class TestIssueCsrKey:
@@ -64,6 +65,54 @@ class TestIssueCsrKey:
         assert os.path.isfile(key)
 
 
+class TestFindOrNewCsrKey:
+    def test_reuse(self, tmpdir):
+        csr = os.path.join(tmpdir, 'some.csr')
+        key = os.path.join(tmpdir, 'some.key')
+        cert = Cert(csr=csr, key=key, key_alg='ec:P-256')
+        cert.find_or_new_csr_key()
+        with open(key) as f:
+            key_data = f.read()
+
+        cert.find_or_new_csr_key()
+        with open(key) as f:
+            assert f.read() == key_data
+
+    def test_rotate(self, tmpdir):
+        csr = os.path.join(tmpdir, 'some.csr')
+        key = os.path.join(tmpdir, 'some.key')
+        cert = Cert(csr=csr, key=key, key_alg='ec:P-256')
+        cert.find_or_new_csr_key()
+        with open(key) as f:
+            key_data = f.read()
+
+        cert.find_or_new_csr_key(rotate=True)
+        with open(key) as f:
+            assert f.read() != key_data
+
+    def test_other_alg(self, tmpdir):
+        csr = os.path.join(tmpdir, 'some.csr')
+        key = os.path.join(tmpdir, 'some.key')
+        Cert(csr=csr, key=key, key_alg='ec:P-256').find_or_new_csr_key()
+
+        cert = Cert(csr=csr, key=key, key_alg='ec:P-384')
+        assert not cert.check_key()
+        cert.find_or_new_csr_key()
+        assert cert.check_key()
+
+    def test_too_old(self, tmpdir):
+        csr = os.path.join(tmpdir, 'some.csr')
+        key = os.path.join(tmpdir, 'some.key')
+        cert = Cert(csr=csr, key=key, key_alg='ec:P-256')
+        cert.find_or_new_csr_key()
+        assert cert.check_key(max_age=1)
+
+        two_days_ago = time.time() - 2 * 24 * 60 * 60
+        os.utime(key, (two_days_ago, two_days_ago))
+        assert not cert.check_key(max_age=1)
+        assert cert.check_key(max_age=0)
+
+
 class TestIssueCert:
     def test_ok(self, tmpdir):
         ca_key = os.path.join(tmpdir, 'ca.key')
@@ -84,3 +133,31 @@ class TestIssueCert:
         cert.issue_csr_key()
         cert.issue_cert()
         assert os.path.isfile(crt)
+
+
+class TestIsIssued:
+    def test_ok(self, tmpdir):
+        ca_key = os.path.join(tmpdir, 'ca.key')
+        ca_crt = os.path.join(tmpdir, 'ca.crt')
+        ca = Ca(ca_key=ca_key, ca_crt=ca_crt)
+        ca.make_ca_key()
+        ca.make_ca_crt()
+
+        cert_list = os.path.join(tmpdir, 'domains_list')
+        os.makedirs(cert_list)
+        cert = Cert(ca=ca, csr=os.path.join(tmpdir, 'some.csr'), key=os.path.join(tmpdir, 'some.key'),
+                    crt=os.path.join(tmpdir, 'some.crt'), cert_list=cert_list, digest=os.path.join(tmpdir, 'some.sha'))
+        cert.add_domain('domainame')
+        cert.find_or_new_csr_key()
+        assert not cert.is_issued()
+
+        cert.issue_cert()
+        assert cert.is_issued()
+
+        cert.add_domain('other.domainame')
+        assert not cert.is_issued()
+        cert.issue_cert()
+        assert cert.is_issued()
+
+        cert.find_or_new_csr_key(rotate=True)
+        assert not cert.is_issued()
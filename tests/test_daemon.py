@@ -0,0 +1,48 @@
+import os
+import os.path
+import threading
+
+import pytest
+
+from swcertificate import Ca, Cert
+from swcertificate.daemon import Client, Daemon, Engine
+
+
+@pytest.fixture
+def client(tmpdir):
+    cert_list = os.path.join(tmpdir, 'list.d')
+    os.makedirs(cert_list)
+    ca = Ca(ca_key=os.path.join(tmpdir, 'ca.key'), ca_crt=os.path.join(tmpdir, 'ca.crt'))
+    engine = Engine(ca=ca, cert=Cert(ca, cert_list=cert_list))
+    socket_path = os.path.join(tmpdir, 'swcertd.sock')
+    daemon = Daemon(engine, socket_path)
+    threading.Thread(target=daemon.serve_forever, daemon=True).start()
+    yield Client(socket_path)
+    daemon.shutdown()
+    daemon.server_close()
+
+
+class TestDaemon:
+    def test_add_list_remove(self, client):
+        assert client.call('add', domains=['b.lan', 'a.lan']) == {'added': ['a.lan', 'b.lan']}
+        assert client.call('list') == ['a.lan', 'b.lan']
+        assert client.call('remove', domains=['a.lan', 'c.lan']) == {'not_found': ['c.lan']}
+        assert client.call('list') == ['b.lan']
+
+    def test_concurrent_clients(self, client):
+        threads = [threading.Thread(target=client.call, args=('add',), kwargs={'domains': [f'host{i}.lan']})
+                   for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(client.call('list')) == 20
+
+    def test_error(self, client):
+        with pytest.raises(RuntimeError) as excinfo:
+            client.call('some')
+        assert 'Unknown command' in str(excinfo.value)
+
+        with pytest.raises(RuntimeError) as excinfo:
+            client.call('add', domains=['bad domain'])
+        assert 'Bad domain name' in str(excinfo.value)
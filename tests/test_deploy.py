@@ -0,0 +1,105 @@
+import os
+import os.path
+import threading
+
+import pytest
+
+from swcertificate.deploy import Deployer, Target
+from swcertificate.store import Store
+
+
+class FakeTarget(Target):
+    def __init__(self, name, links, installed=True, fail=None):
+        self.name = name
+        self.links = links
+        self.installed = installed
+        self.fail = fail
+        self.calls = []
+
+    def is_installed(self):
+        return self.installed
+
+    def check(self):
+        self.calls.append('check')
+        if self.fail:
+            raise RuntimeError(self.fail)
+
+    def reload(self):
+        self.calls.append('reload')
+
+
+def write_pair(tmpdir, data):
+    key = os.path.join(tmpdir, 'swcert.key')
+    crt = os.path.join(tmpdir, 'swcert.crt')
+    with open(key, 'w') as f:
+        f.write(f'key {data}\n')
+    with open(crt, 'w') as f:
+        f.write(f'crt {data}\n')
+    return key, crt
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+class TestDeployer:
+    def test_formats(self, tmpdir):
+        pair = FakeTarget('pair', {'swcert.key': os.path.join(tmpdir, 'a', 'a.key'),
+                                   'swcert.crt': os.path.join(tmpdir, 'a', 'a.crt')})
+        combined = FakeTarget('combined', {'swcert.pem': os.path.join(tmpdir, 'b', 'b.pem')})
+        deployer = Deployer([pair, combined], store=Store(home=os.path.join(tmpdir, 'store')))
+
+        results = deployer.deploy(*write_pair(tmpdir, 1))
+        assert {name: result['status'] for name, result in results.items()} == \
+            {'pair': 'reloaded', 'combined': 'reloaded'}
+        assert read(os.path.join(tmpdir, 'a', 'a.key')) == 'key 1\n'
+        assert read(os.path.join(tmpdir, 'b', 'b.pem')) == 'crt 1\nkey 1\n'
+        assert pair.calls == combined.calls == ['check', 'reload']
+
+        results = deployer.deploy(*write_pair(tmpdir, 1))
+        assert {result['status'] for result in results.values()} == {'up to date'}
+        assert pair.calls == ['check', 'reload']
+
+        deployer.deploy(*write_pair(tmpdir, 2))
+        assert read(os.path.join(tmpdir, 'b', 'b.pem')) == 'crt 2\nkey 2\n'
+        assert pair.calls == combined.calls == ['check', 'reload'] * 2
+
+    def test_concurrent(self, tmpdir):
+        started = threading.Barrier(2, timeout=5)  # fails unless both reload at once
+
+        class SlowTarget(FakeTarget):
+            def reload(self):
+                started.wait()
+
+        targets = [SlowTarget(name, {'swcert.crt': os.path.join(tmpdir, f'{name}.crt')}) for name in ('a', 'b')]
+        results = Deployer(targets, store=Store(home=os.path.join(tmpdir, 'store'))).deploy(*write_pair(tmpdir, 1))
+        assert {result['status'] for result in results.values()} == {'reloaded'}
+
+    def test_report(self, tmpdir):
+        targets = [
+            FakeTarget('broken', {'swcert.crt': os.path.join(tmpdir, 'broken.crt')}, fail='bad config'),
+            FakeTarget('absent', {'swcert.crt': os.path.join(tmpdir, 'absent.crt')}, installed=False),
+            FakeTarget('ok', {'swcert.crt': os.path.join(tmpdir, 'ok.crt')}),
+        ]
+        results = Deployer(targets, store=Store(home=os.path.join(tmpdir, 'store'))).deploy(*write_pair(tmpdir, 1))
+        assert results['broken']['status'] == 'failed'
+        assert results['broken']['error'] == 'bad config'
+        assert results['absent']['status'] == 'not installed'
+        assert results['ok']['status'] == 'reloaded'
+        assert targets[2].calls == ['check', 'reload']
+
+    def test_rollback(self, tmpdir):
+        target = FakeTarget('a', {'swcert.crt': os.path.join(tmpdir, 'a.crt')})
+        deployer = Deployer([target], store=Store(home=os.path.join(tmpdir, 'store')))
+        with pytest.raises(RuntimeError):
+            deployer.rollback()
+
+        deployer.deploy(*write_pair(tmpdir, 1))
+        deployer.deploy(*write_pair(tmpdir, 2))
+        assert deployer.rollback()['a']['status'] == 'reloaded'
+        assert read(os.path.join(tmpdir, 'a.crt')) == 'crt 1\n'
+
+    def test_unknown(self):
+        with pytest.raises(ValueError):
+            Deployer(['nginx', 'iis'])
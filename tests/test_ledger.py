@@ -0,0 +1,72 @@
+import os
+import os.path
+
+from swcertificate import Ledger
+
+
+def touch(path, data='some'):
+    with open(path, 'w') as f:
+        f.write(data)
+
+
+class TestIsTrusted:
+    def test_empty(self, tmpdir):
+        ledger = Ledger(ledger=os.path.join(tmpdir, 'trust.json'))
+        assert not ledger.is_trusted([], 'ab:cd')
+
+    def test_ok(self, tmpdir):
+        path = os.path.join(tmpdir, 'some.crt')
+        touch(path)
+        ledger_path = os.path.join(tmpdir, 'trust.json')
+        Ledger(ledger=ledger_path).record('ab:cd', [path])
+
+        ledger = Ledger(ledger=ledger_path)
+        assert ledger.fingerprint == 'ab:cd'
+        assert ledger.is_trusted([path], 'ab:cd')
+
+    def test_other_ca(self, tmpdir):
+        path = os.path.join(tmpdir, 'cert9.db')
+        touch(path)
+        ledger_path = os.path.join(tmpdir, 'trust.json')
+        Ledger(ledger=ledger_path).record('ab:cd', [path])
+
+        assert not Ledger(ledger=ledger_path).is_trusted([path], 'ef:01')  # CA rotated, dbs not touched yet
+
+    def test_changed(self, tmpdir):
+        path = os.path.join(tmpdir, 'some.crt')
+        touch(path)
+        ledger_path = os.path.join(tmpdir, 'trust.json')
+        Ledger(ledger=ledger_path).record('ab:cd', [path])
+
+        touch(path, 'other data')
+        assert not Ledger(ledger=ledger_path).is_trusted([path], 'ab:cd')
+
+    def test_removed(self, tmpdir):
+        path = os.path.join(tmpdir, 'some.crt')
+        touch(path)
+        ledger_path = os.path.join(tmpdir, 'trust.json')
+        Ledger(ledger=ledger_path).record('ab:cd', [path])
+
+        os.remove(path)
+        assert not Ledger(ledger=ledger_path).is_trusted([path], 'ab:cd')
+
+    def test_new_path(self, tmpdir):
+        path = os.path.join(tmpdir, 'some.crt')
+        path2 = os.path.join(tmpdir, 'cert9.db')
+        touch(path)
+        touch(path2)
+        ledger_path = os.path.join(tmpdir, 'trust.json')
+        Ledger(ledger=ledger_path).record('ab:cd', [path])
+
+        assert not Ledger(ledger=ledger_path).is_trusted([path, path2], 'ab:cd')
+
+    def test_forget(self, tmpdir):
+        path = os.path.join(tmpdir, 'some.crt')
+        touch(path)
+        ledger_path = os.path.join(tmpdir, 'trust.json')
+        ledger = Ledger(ledger=ledger_path)
+        ledger.record('ab:cd', [path])
+        ledger.forget()
+
+        assert not os.path.isfile(ledger_path)
+        assert not Ledger(ledger=ledger_path).is_trusted([path], 'ab:cd')
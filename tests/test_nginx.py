@@ -0,0 +1,77 @@
+import os.path
+import threading
+import time
+
+import pytest
+
+from swcertificate import Nginx, utils
+from swcertificate.deploy import NginxTarget
+
+
+def _restarts_to(monkeypatch):
+    restarts = []
+    monkeypatch.setattr(Nginx, 'restart', lambda: restarts.append(time.time()))
+    return restarts
+
+
+class TestReload:
+    def test_coalesce(self, tmpdir, monkeypatch):
+        restarts = _restarts_to(monkeypatch)
+        stamp = os.path.join(tmpdir, 'nginx.reload')
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(Nginx.reload(window=0.3, stamp=stamp)))
+                   for _ in range(10)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.01)
+        for thread in threads:
+            thread.join()
+        assert results.count(None) == 9
+        assert len(restarts) == 1
+
+    def test_last_caller(self, tmpdir, monkeypatch):
+        restarts = _restarts_to(monkeypatch)
+        stamp = os.path.join(tmpdir, 'nginx.reload')
+
+        first = []
+        thread = threading.Thread(target=lambda: first.append((Nginx.reload(window=0.3, stamp=stamp), time.time())))
+        thread.start()
+        time.sleep(0.1)
+        elapsed = Nginx.reload(window=0.3, stamp=stamp)
+        thread.join()
+
+        assert first[0][0] is None and first[0][1] < restarts[0]  # returned as soon as it was replaced
+        assert isinstance(elapsed, float)
+        assert len(restarts) == 1
+
+    def test_sequential(self, tmpdir, monkeypatch):
+        restarts = _restarts_to(monkeypatch)
+        stamp = os.path.join(tmpdir, 'nginx.reload')
+
+        assert Nginx.reload(window=0, stamp=stamp) is not None
+        assert Nginx.reload(window=0, stamp=stamp) is not None
+        assert len(restarts) == 2
+
+    def test_failed(self, tmpdir, monkeypatch):
+        def restart():
+            raise SystemExit('nginx: configuration file /etc/nginx/nginx.conf test failed')
+
+        monkeypatch.setattr(Nginx, 'restart', restart)
+        stamp = os.path.join(tmpdir, 'nginx.reload')
+        with pytest.raises(SystemExit, match='test failed'):
+            Nginx.reload(window=0, stamp=stamp)
+
+        monkeypatch.setattr(Nginx, 'reload', lambda: Nginx.restart())
+        with pytest.raises(RuntimeError, match='test failed'):
+            NginxTarget().reload()
+
+    def test_stamp_owner(self, tmpdir, monkeypatch):
+        _restarts_to(monkeypatch)
+        owned = []
+        monkeypatch.setattr(utils, 'set_real_owner', owned.append)
+        stamp = os.path.join(tmpdir, 'home', 'nginx.reload')
+
+        Nginx.reload(window=0, stamp=stamp)
+        assert owned == [os.path.dirname(stamp), stamp]
+        assert os.listdir(os.path.dirname(stamp)) == ['nginx.reload']
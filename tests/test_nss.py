@@ -1,9 +1,13 @@
 import os
 import os.path
+import pwd
 import re
+import sqlite3
 import subprocess
 
-from swcertificate import Ca, Nss
+import pytest
+
+from swcertificate import Ca, Nss, utils
 from swcertificate.settings import NSS_NAME
 
 
@@ -122,3 +126,310 @@ class TestInstallCa:
             Nss.install_ca(nss_dir, ca_crt, cert_name='test cert')
             # Check NSS CA
             assert Nss.get_crt_serial(nss_dir, cert_name='test cert')
+
+
+class TestSync:
+    def test_ok(self, tmpdir):
+        # create CA
+        ca_key = os.path.join(tmpdir, 'some.key')
+        ca_crt = os.path.join(tmpdir, 'some.crt')
+        ca = Ca(ca_key=ca_key, ca_crt=ca_crt)
+        ca.make_ca_key()
+        ca.make_ca_crt()
+        ca_serial = Ca.get_crt_serial(ca_crt)
+
+        # create NSS databases
+        nss_dirs = (os.path.join(tmpdir, 'my_nss'), os.path.join(tmpdir, 'my_nss2'))
+        for nss_dir in nss_dirs:
+            os.makedirs(nss_dir)
+            subprocess.run(['certutil', '-N', '-d', nss_dir, '--empty-password'], check=True)
+
+        synced, failed = Nss.sync(nss_dirs, ca_serial, ca_crt, cert_name='test cert')
+        assert not failed
+        assert synced == {nss_dir: 'installed' for nss_dir in nss_dirs}
+
+        synced, failed = Nss.sync(nss_dirs, ca_serial, ca_crt, cert_name='test cert')
+        assert synced == {nss_dir: 'ok' for nss_dir in nss_dirs}
+
+    def test_replace_duplicates(self, tmpdir, monkeypatch):
+        crts = [crt_der(tmpdir, f'some{i}') for i in range(3)]
+        nss_dir = os.path.join(tmpdir, 'my_nss')
+        make_nss_cert9(nss_dir, [('test cert', crts[0][1]), ('test cert', crts[1][1])])
+
+        runs = []
+
+        def subproc_out(run, msg=None):
+            with open(run[run.index('-i') + 1]) as f:
+                runs.append((run[1], [line.split()[0] for line in f]))
+
+        monkeypatch.setattr(utils, 'subproc_out', subproc_out)
+        assert Nss.sync_ca(nss_dir, 'serial is not needed', crts[2][0], cert_name='test cert') == 'updated'
+        assert runs == [('-B', ['-D', '-D', '-A'])]  # read by sqlite, certutil only writes
+
+    def test_replace_duplicates_certutil(self, tmpdir, monkeypatch):
+        ca_key = os.path.join(tmpdir, 'some.key')
+        crts = [os.path.join(tmpdir, f'some{i}.crt') for i in range(3)]
+        for crt in crts:
+            ca = Ca(ca_key=ca_key, ca_crt=crt)
+            ca.make_ca_key()
+            ca.make_ca_crt()
+
+        nss_dir = os.path.join(tmpdir, 'my_nss')
+        os.makedirs(nss_dir)
+        subprocess.run(['certutil', '-N', '-d', nss_dir, '--empty-password'], check=True)
+        Nss.install_ca(nss_dir, crts[0], cert_name='test cert')
+        Nss.install_ca(nss_dir, crts[1], cert_name='test cert')
+
+        def unreadable(*args, **kwargs):
+            raise sqlite3.DatabaseError('file is not a database')
+
+        monkeypatch.setattr(sqlite3, 'connect', unreadable)
+        runs = []
+        subproc_out = utils.subproc_out
+        monkeypatch.setattr(utils, 'subproc_out', lambda run, msg=None: runs.append(run) or subproc_out(run, msg))
+        ca_serial = Ca.get_crt_serial(crts[2])
+        assert Nss.sync_ca(nss_dir, ca_serial, crts[2], cert_name='test cert') == 'updated'
+        assert [run[1] for run in runs] == ['-L', '-L', '-B']  # serial, duplicates, batch
+
+        monkeypatch.setattr(utils, 'subproc_out', subproc_out)
+        assert Nss.get_crt_serial(nss_dir, cert_name='test cert') == ca_serial
+        assert Nss._count_certs(nss_dir, 'test cert') == 1
+
+    def test_broken_dir(self, tmpdir):
+        ca_crt = os.path.join(tmpdir, 'some.crt')
+        nss_dir = os.path.join(tmpdir, 'not_nss')
+
+        synced, failed = Nss.sync([nss_dir], 'some serial', ca_crt, cert_name='test cert')
+        assert not synced
+        assert nss_dir in failed
+
+
+def make_cert9(nss_dir, objects):
+    """cert9.db with nssPublic as NSS has it, objects: [(class, label, value)]"""
+    os.makedirs(nss_dir, exist_ok=True)
+    with sqlite3.connect(os.path.join(nss_dir, NSS_NAME)) as connection:
+        connection.execute('CREATE TABLE nssPublic (id PRIMARY KEY UNIQUE ON CONFLICT ABORT, a0, a3, a11)')
+        connection.executemany('INSERT INTO nssPublic VALUES (?, ?, ?, ?)',
+                               [(i, cls.to_bytes(4, 'big'), label, value)
+                                for i, (cls, label, value) in enumerate(objects)])
+    connection.close()
+
+
+# nssPublic columns of cert9.db are `a` and the PKCS#11 attribute type in hex, NSS makes one per known attribute
+NSS_ATTRIBUTES = (
+    0x0, 0x1, 0x2, 0x3, 0x10, 0x11, 0x12, 0x80, 0x81, 0x82, 0x86, 0x87, 0x100, 0x101, 0x102, 0x170,
+    0xce534352, 0xce536358, 0xce536359, 0xce53635a, 0xce53635b, 0xce5363b4, 0xce5363b5,
+)
+CKO_NSS_TRUST = 0xce534353
+
+
+def make_nss_cert9(nss_dir, certs):
+    """cert9.db laid out as certutil makes it, certs: [(nickname, DER)]. Each certificate has its trust object
+    under the same label. Values are blobs, CK_ULONG as 4 bytes big endian, CK_BBOOL as one byte"""
+    os.makedirs(nss_dir, exist_ok=True)
+    columns = [f'a{attribute:x}' for attribute in NSS_ATTRIBUTES]
+    rows = []
+    for nickname, der in certs:
+        label = nickname.encode('utf-8')
+        rows.append({'a0': (1).to_bytes(4, 'big'), 'a1': b'\x01', 'a2': b'\x00', 'a3': label,
+                     'a80': (0).to_bytes(4, 'big'), 'a81': b'issuer', 'a82': b'serial', 'a101': b'subject',
+                     'a102': os.urandom(20), 'a11': der})
+        rows.append({'a0': CKO_NSS_TRUST.to_bytes(4, 'big'), 'a1': b'\x01', 'a2': b'\x00', 'a3': label,
+                     'a81': b'issuer', 'a82': b'serial', 'ace536358': (0xce534352).to_bytes(4, 'big')})
+    with sqlite3.connect(os.path.join(nss_dir, NSS_NAME)) as connection:
+        connection.execute(f'CREATE TABLE nssPublic (id PRIMARY KEY UNIQUE ON CONFLICT ABORT, {", ".join(columns)})')
+        for index, column in (('issuer', 'a81'), ('subject', 'a101'), ('label', 'a3'), ('ckaid', 'a102')):
+            connection.execute(f'CREATE INDEX {index} ON nssPublic ({column})')
+        for i, row in enumerate(rows):
+            names = ['id', *row]
+            connection.execute(f'INSERT INTO nssPublic ({", ".join(names)}) VALUES ({", ".join("?" * len(names))})',
+                               [0x10000 + i, *row.values()])
+    connection.close()
+
+
+def crt_der(tmpdir, name):
+    ca = Ca(ca_key=os.path.join(tmpdir, f'{name}.key'), ca_crt=os.path.join(tmpdir, f'{name}.crt'))
+    ca.make_ca_key()
+    ca.make_ca_crt()
+    with open(ca.ca_crt, 'rb') as f:
+        return ca.ca_crt, utils.pem_blocks(f.read())[0][1]
+
+
+class TestReadCerts:
+    def test_ok(self, tmpdir):
+        nss_dir = os.path.join(tmpdir, 'nss')
+        make_cert9(nss_dir, [
+            (1, b'test cert', b'der1'),
+            (1, b'test cert', b'der2'),
+            (1, b'other', b'der3'),
+            (3, b'test cert', b'private key'),  # CKO_PRIVATE_KEY
+        ])
+        assert Nss.read_certs(nss_dir, 'test cert') == [b'der1', b'der2']
+        assert Nss.read_certs(f'sql:{nss_dir}', 'other') == [b'der3']
+        assert Nss.read_certs(nss_dir, 'missing') == []
+
+    def test_nss_layout(self, tmpdir):
+        nss_dir = os.path.join(tmpdir, 'nss')
+        make_nss_cert9(nss_dir, [('swcert', b'der1'), ('other', b'der2'), ('swcert', b'der3')])
+        assert Nss.read_certs(nss_dir) == [b'der1', b'der3']  # trust objects under the label are not certificates
+        assert Nss.read_certs(nss_dir, 'other') == [b'der2']
+
+    def test_not_sqlite(self, tmpdir):
+        nss_dir = os.path.join(tmpdir, 'nss')
+        os.makedirs(nss_dir)
+        assert Nss.read_certs(nss_dir) is None
+        with open(os.path.join(nss_dir, NSS_NAME), 'w') as f:
+            f.write('not a database')
+        assert Nss.read_certs(nss_dir) is None
+
+    def test_sync_without_certutil(self, tmpdir, monkeypatch):
+        ca_crt, der = crt_der(tmpdir, 'ca')
+        nss_dirs = [os.path.join(tmpdir, f'nss{i}') for i in range(30)]
+        for nss_dir in nss_dirs:
+            make_cert9(nss_dir, [(1, b'test cert', der)])
+
+        def no_certutil(run, msg=None):
+            raise AssertionError(f'certutil run {run}')
+
+        monkeypatch.setattr(utils, 'subproc_out', no_certutil)
+        synced, failed = Nss.sync(nss_dirs, 'serial is not needed', ca_crt, cert_name='test cert')
+        assert not failed
+        assert synced == {nss_dir: 'ok' for nss_dir in nss_dirs}
+
+    def test_sync_stale(self, tmpdir, monkeypatch):
+        ca_crt, der = crt_der(tmpdir, 'ca')
+        _old_crt, old_der = crt_der(tmpdir, 'old')
+        nss_dir = os.path.join(tmpdir, 'nss')
+        make_cert9(nss_dir, [(1, b'test cert', old_der), (1, b'test cert', der)])
+
+        batches = []
+        monkeypatch.setattr(Nss, '_batch', lambda nss_dir, commands, ca_crt=None: batches.append(commands))
+        assert Nss.sync_ca(nss_dir, 'serial is not needed', ca_crt, cert_name='test cert') == 'updated'
+        assert [command[0] for command in batches[0]] == ['-D', '-D', '-A']
+
+
+class TestNssFindIndex:
+    def test_new_profile(self, tmpdir):
+        index = os.path.join(tmpdir, 'index.json')
+        root = os.path.join(tmpdir, 'root')
+        folder = os.path.join(root, 'some/folder')
+        os.makedirs(folder)
+        open(os.path.join(folder, NSS_NAME), 'a').close()
+
+        assert Nss.find(nss_dirs=[root], index=index) == [folder]
+        assert os.path.isfile(index)
+
+        folder2 = os.path.join(root, 'some/other/folder')
+        os.makedirs(folder2)
+        open(os.path.join(folder2, NSS_NAME), 'a').close()
+        assert sorted(Nss.find(nss_dirs=[root], index=index)) == sorted([folder, folder2])
+
+    def test_removed_profile(self, tmpdir):
+        index = os.path.join(tmpdir, 'index.json')
+        folder = os.path.join(tmpdir, 'some/folder')
+        os.makedirs(folder)
+        nss_db_path = os.path.join(folder, NSS_NAME)
+        open(nss_db_path, 'a').close()
+        assert Nss.find(nss_dirs=[tmpdir], index=index) == [folder]
+
+        os.remove(nss_db_path)
+        assert not Nss.find(nss_dirs=[tmpdir], index=index)
+
+    def test_root_appears(self, tmpdir):
+        index = os.path.join(tmpdir, 'index.json')
+        root = os.path.join(tmpdir, 'root')
+        assert not Nss.find(nss_dirs=[root], index=index)
+
+        os.makedirs(root)
+        open(os.path.join(root, NSS_NAME), 'a').close()
+        assert Nss.find(nss_dirs=[root], index=index) == [root]
+
+    def test_no_home(self, tmpdir, monkeypatch):
+        owned = []
+        monkeypatch.setattr(utils, 'set_real_owner', owned.append)
+        index = os.path.join(tmpdir, 'swcert', 'index.json')  # SW_HOME not made yet
+        root = os.path.join(tmpdir, 'root')
+        os.makedirs(root)
+        open(os.path.join(root, NSS_NAME), 'a').close()
+
+        assert Nss.find(nss_dirs=[root], index=index) == [root]
+        assert os.path.isfile(index)
+        assert owned == [os.path.dirname(index), index]
+
+    def test_prune(self, tmpdir):
+        folder = os.path.join(tmpdir, 'profile/cache2')
+        os.makedirs(folder)
+        open(os.path.join(folder, NSS_NAME), 'a').close()
+
+        assert not Nss.find(nss_dirs=[tmpdir], index=None)
+
+
+class TestAllUsers:
+    def test_user_homes(self, tmpdir, monkeypatch):
+        homes = {name: os.path.join(tmpdir, name) for name in ('alice', 'bob', 'daemon', 'nobody', 'gone')}
+        for name, home in homes.items():
+            if name != 'gone':
+                os.makedirs(home)
+        users = [
+            pwd.struct_passwd(('alice', 'x', 1000, 1000, '', homes['alice'], '/bin/bash')),
+            pwd.struct_passwd(('bob', 'x', 1001, 1001, '', homes['bob'], '/usr/bin/zsh')),
+            pwd.struct_passwd(('daemon', 'x', 1, 1, '', homes['daemon'], '/bin/sh')),
+            pwd.struct_passwd(('nobody', 'x', 65534, 65534, '', homes['nobody'], '/usr/sbin/nologin')),
+            pwd.struct_passwd(('gone', 'x', 1002, 1002, '', homes['gone'], '/bin/bash')),
+        ]
+        monkeypatch.setattr(pwd, 'getpwall', lambda: users)
+        found = Nss.user_homes()
+        assert homes['alice'] in found
+        assert homes['bob'] in found
+        assert not {homes['daemon'], homes['nobody'], homes['gone']} & set(found)
+
+    def test_sandboxed(self, tmpdir):
+        home = os.path.join(tmpdir, 'alice')
+        profiles = [
+            os.path.join(home, '.mozilla', 'firefox', 'a.default'),
+            os.path.join(home, 'snap', 'firefox', 'common', '.mozilla', 'firefox', 'b.default'),
+            os.path.join(home, '.var', 'app', 'org.chromium.Chromium', '.pki', 'nssdb'),
+        ]
+        for profile in profiles:
+            os.makedirs(profile)
+            open(os.path.join(profile, NSS_NAME), 'a').close()
+
+        found = Nss.find(nss_dirs=Nss.all_users_dirs(homes=[home, os.path.join(tmpdir, 'bob')]), index=None)
+        assert sorted(found) == sorted(profiles)
+
+    def test_as_owner(self, tmpdir, monkeypatch):
+        if os.geteuid() != 0:
+            pytest.skip('chown needs root')
+        nss_dir = os.path.join(tmpdir, 'nss')
+        make_cert9(nss_dir, [])
+        for path in (nss_dir, os.path.join(nss_dir, NSS_NAME)):
+            os.chown(path, 12345, 12346)
+        ca_crt, _der = crt_der(tmpdir, 'ca')
+
+        runs = []
+
+        def subproc_out(run, msg=None):
+            batch = run[run.index('-i') + 1]
+            batch_stat = os.stat(batch)
+            with open(batch) as f:
+                ca_copy = f.read().split()[-1]
+            runs.append((run[:5], (batch_stat.st_uid, batch_stat.st_gid), ca_copy))
+
+        monkeypatch.setattr(utils, 'subproc_out', subproc_out)
+        assert Nss.sync_ca(nss_dir, 'serial is not needed', ca_crt) == 'installed'
+        [(run, batch_owner, ca_copy)] = runs
+        assert run == ['setpriv', '--reuid=12345', '--regid=12346', '--clear-groups', '--']
+        assert batch_owner == (12345, 12346)
+        assert ca_copy != ca_crt  # the CA home may be closed to the owner
+
+    def test_planted_link(self, tmpdir, monkeypatch):
+        if os.geteuid() != 0:
+            pytest.skip('chown needs root')
+        ca_crt, der = crt_der(tmpdir, 'ca')
+        make_cert9(os.path.join(tmpdir, 'root_db'), [(1, b'swcert', der)])
+        nss_dir = os.path.join(tmpdir, 'nss')
+        os.makedirs(nss_dir)
+        os.symlink(os.path.join(tmpdir, 'root_db', NSS_NAME), os.path.join(nss_dir, NSS_NAME))
+        os.chown(nss_dir, 12345, 12345)
+
+        assert Nss.read_certs(nss_dir) is None  # left to certutil as the owner
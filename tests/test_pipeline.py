@@ -0,0 +1,115 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from swcertificate.pipeline import Cancelled, Pipeline, is_installed_async, subproc_async
+
+
+class TestPipeline:
+    def test_results(self):
+        pipeline = Pipeline()
+        pipeline.add('a', lambda _results: 1)
+        pipeline.add('b', lambda results: results['a'] + 1, after=['a'])
+        assert pipeline.run() == {'a': 1, 'b': 2}
+
+    def test_unknown_stage(self):
+        with pytest.raises(ValueError):
+            Pipeline().add('b', lambda _results: None, after=['a'])
+
+    def test_overlap(self):
+        started = threading.Barrier(2, timeout=5)  # fails unless both run at once
+        pipeline = Pipeline(concurrency=2)
+        pipeline.add('a', lambda _results: started.wait())
+        pipeline.add('b', lambda _results: started.wait())
+        pipeline.run()
+
+    def test_concurrency(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def stage(_results):
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+
+        pipeline = Pipeline(concurrency=2)
+        for i in range(6):
+            pipeline.add(f's{i}', stage)
+        pipeline.run()
+        assert max(peak) == 2
+
+    def test_async_stage(self):
+        async def stage(_results):
+            await asyncio.sleep(0)
+            return 'async'
+
+        pipeline = Pipeline()
+        pipeline.add('a', stage)
+        assert pipeline.run() == {'a': 'async'}
+
+    def test_failure(self):
+        done = []
+
+        def fail(_results):
+            raise RuntimeError('broken')
+
+        pipeline = Pipeline()
+        pipeline.add('fail', fail)
+        pipeline.add('after', lambda _results: done.append('after'), after=['fail'])
+        pipeline.add('independent', lambda _results: done.append('independent'))
+        with pytest.raises(RuntimeError, match='broken'):
+            pipeline.run()
+        assert done == ['independent']
+
+    def test_exit(self):
+        pipeline = Pipeline()
+        pipeline.add('exit', lambda _results: exit_with('fatal'))
+        with pytest.raises(SystemExit) as excinfo:
+            pipeline.run()
+        assert excinfo.value.code == 'fatal'
+
+    def test_on_stage(self):
+        events = []
+        pipeline = Pipeline(on_stage=lambda name, status: events.append((name, status)))
+        pipeline.add('fail', lambda _results: exit_with('fatal'))
+        pipeline.add('after', lambda _results: None, after=['fail'])
+        with pytest.raises(SystemExit):
+            pipeline.run()
+        assert events == [('fail', 'running'), ('fail', 'failed'), ('after', 'skipped')]
+
+    def test_cancel(self):
+        cancel = threading.Event()
+        done = []
+        pipeline = Pipeline(concurrency=1, cancel=cancel)
+        pipeline.add('a', lambda _results: cancel.set())  # a running stage is let finish
+        pipeline.add('b', lambda _results: done.append('b'), after=['a'])
+        pipeline.add('c', lambda _results: done.append('c'))
+        with pytest.raises(Cancelled):
+            pipeline.run()
+        assert done == []
+
+
+def exit_with(code):
+    raise SystemExit(code)
+
+
+class TestSubprocAsync:
+    def test_ok(self):
+        complete = asyncio.run(subproc_async(run=['echo', 'hello']))
+        assert complete.stdout == b'hello\n'
+
+    def test_fail(self):
+        with pytest.raises(RuntimeError):
+            asyncio.run(subproc_async(run=['false']))
+        with pytest.raises(RuntimeError):
+            asyncio.run(subproc_async(run=['no-such-binary-swcert']))
+
+    def test_is_installed(self):
+        assert asyncio.run(is_installed_async('sh'))
+        assert not asyncio.run(is_installed_async('no-such-binary-swcert'))
@@ -0,0 +1,78 @@
+import io
+import os
+import os.path
+
+import pytest
+
+from swcertificate.registry import Registry
+
+
+class TestNormalize:
+    def test_ok(self):
+        assert Registry.normalize(' Some.Domain. \n') == 'some.domain'
+        assert Registry.normalize('*.some.domain') == '*.some.domain'
+
+    @pytest.mark.parametrize('name', ['', 'some/domain', 'some domain', '*.', 'some..domain', '-some'])
+    def test_bad(self, name):
+        with pytest.raises(ValueError):
+            Registry.normalize(name)
+
+
+class TestAdd:
+    def test_sorted_unique(self, tmpdir):
+        path = os.path.join(tmpdir, 'domains')
+        registry = Registry(path)
+        assert registry.add(['b.lan', 'a.lan', 'B.lan']) == ['a.lan', 'b.lan']
+        assert registry.add(['a.lan']) == []
+
+        with open(path) as f:
+            assert f.read() == 'a.lan\nb.lan\n'
+        assert 'b.lan' in Registry(path)
+        assert 'c.lan' not in Registry(path)
+
+
+class TestRemove:
+    def test_ok(self, tmpdir):
+        registry = Registry(os.path.join(tmpdir, 'domains'))
+        registry.add(['a.lan', 'b.lan'])
+        assert registry.remove(['a.lan', 'c.lan']) == ['a.lan']
+        assert registry.load() == ['b.lan']
+
+
+class TestImportExport:
+    def test_ok(self, tmpdir):
+        registry = Registry(os.path.join(tmpdir, 'domains'))
+        lines = io.StringIO('# dev hosts\nhost1.lan\n\nhost2.lan  # comment\nhost1.lan\n')
+        assert registry.import_file(lines) == ['host1.lan', 'host2.lan']
+
+        out = io.StringIO()
+        registry.export(out)
+        assert out.getvalue() == 'host1.lan\nhost2.lan\n'
+
+
+class TestMigrate:
+    def test_ok(self, tmpdir):
+        legacy_dir = os.path.join(tmpdir, 'list.d')
+        os.makedirs(legacy_dir)
+        for name in ('some.lan', '*.some.lan'):
+            open(os.path.join(legacy_dir, name), 'a').close()
+
+        registry = Registry(os.path.join(legacy_dir, '.domains'), legacy_dir=legacy_dir)
+        assert registry.load() == ['*.some.lan', 'some.lan']
+        assert sorted(os.listdir(legacy_dir)) == ['*.some.lan', 'some.lan']  # load writes nothing
+
+        assert registry.add(['other.lan']) == ['other.lan']
+        assert sorted(os.listdir(legacy_dir)) == ['.domains', '.domains.lock']
+        assert registry.load() == ['*.some.lan', 'other.lan', 'some.lan']
+
+    def test_legacy_changed(self, tmpdir):
+        legacy_dir = os.path.join(tmpdir, 'list.d')
+        os.makedirs(legacy_dir)
+        open(os.path.join(legacy_dir, 'some.lan'), 'a').close()
+        registry = Registry(os.path.join(legacy_dir, '.domains'), legacy_dir=legacy_dir)
+        assert registry.load() == ['some.lan']
+
+        open(os.path.join(legacy_dir, 'new.lan'), 'a').close()  # an older swcert still running
+        os.utime(legacy_dir, ns=(0, 0))
+        assert registry.load() == ['new.lan', 'some.lan']
+        assert not os.path.exists(registry.path)
@@ -0,0 +1,84 @@
+import os
+import os.path
+
+import pytest
+
+from swcertificate import Ca, Shards
+from swcertificate.store import Store
+
+
+def make_ca(tmpdir):
+    ca = Ca(ca_key=os.path.join(tmpdir, 'ca.key'), ca_crt=os.path.join(tmpdir, 'ca.crt'))
+    ca.make_ca_key()
+    ca.make_ca_crt()
+    return ca
+
+
+class TestSplit:
+    def test_stable(self):
+        domains = [f'host{i}.lan' for i in range(100)]
+        shards = Shards.split(domains, count=4)
+        assert sorted(sum(shards.values(), [])) == sorted(domains)
+        assert all(0 <= shard < 4 for shard in shards)
+        assert shards == Shards.split(domains, count=4)
+
+    def test_parent(self):
+        domains = ['some.lan', '*.some.lan', 'www.some.lan']
+        shards = Shards.split(domains, count=16, by='parent')
+        assert len(shards) == 1
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError):
+            Shards.split(['some.lan'], count=2, by='some')
+
+
+class TestIssue:
+    def test_only_changed_shard(self, tmpdir):
+        ca = make_ca(tmpdir)
+        sharded = Shards(ca, count=4, shard_home=os.path.join(tmpdir, 'shards'), key_alg='ec:P-256')
+        domains = [f'host{i}.lan' for i in range(20)]
+        issued = sharded.issue(domains)
+        assert sorted(issued) == sorted(Shards.split(domains, count=4))
+
+        assert not sharded.issue(domains)
+
+        new_domain = 'new.lan'
+        assert sharded.issue(domains + [new_domain]) == [Shards.shard_of(new_domain, count=4)]
+
+
+class TestDeploy:
+    def test_ok(self, tmpdir):
+        ca = make_ca(tmpdir)
+        sharded = Shards(ca, count=2, shard_home=os.path.join(tmpdir, 'shards'), key_alg='ec:P-256')
+        domains = ['some.lan', '*.some.lan', 'other.lan']
+        sharded.issue(domains)
+
+        shard_dir = os.path.join(tmpdir, 'nginx')
+        map_file = os.path.join(tmpdir, 'shards.conf')
+        store = Store(home=os.path.join(tmpdir, 'store'))
+        assert sharded.deploy(domains, shard_dir=shard_dir, map_file=map_file, store=store)
+        assert not sharded.deploy(domains, shard_dir=shard_dir, map_file=map_file, store=store)
+
+        with open(map_file) as f:
+            nginx_map = f.read()
+        for domain in domains:
+            shard_name = Shards.shard_name(Shards.shard_of(domain, count=2))
+            assert f'    {domain} {shard_name};' in nginx_map
+            assert os.path.isfile(os.path.join(shard_dir, f'{shard_name}.crt'))
+
+    def test_map_dir(self, tmpdir):
+        ca = make_ca(tmpdir)
+        sharded = Shards(ca, count=2, shard_home=os.path.join(tmpdir, 'shards'), key_alg='ec:P-256')
+        domains = ['some.lan', 'other.lan']
+        sharded.issue(domains)
+        store = Store(home=os.path.join(tmpdir, 'store'))
+
+        map_file = os.path.join(tmpdir, 'etc', 'swcert', 'shards.conf')  # /etc/swcert not made yet
+        assert sharded.deploy(domains, shard_dir=os.path.join(tmpdir, 'nginx'), map_file=map_file, store=store)
+        assert os.path.isfile(map_file)
+
+        blocker = os.path.join(tmpdir, 'file')
+        open(blocker, 'w').close()
+        with pytest.raises(RuntimeError, match='Can not write'):
+            sharded.deploy(domains, shard_dir=os.path.join(tmpdir, 'nginx'),
+                           map_file=os.path.join(blocker, 'shards.conf'), store=store)
@@ -0,0 +1,136 @@
+import asyncio
+import os
+import os.path
+import socket
+import ssl
+import threading
+import time
+
+import pytest
+from cryptography import x509
+
+from swcertificate import Ca
+from swcertificate.backend import CryptographyBackend, Signer
+from swcertificate.sni import CertCache, KeyPool, SniFront
+
+
+@pytest.fixture
+def ca(tmpdir):
+    ca = Ca(ca_key=os.path.join(tmpdir, 'ca.key'), ca_crt=os.path.join(tmpdir, 'ca.crt'), backend=CryptographyBackend)
+    ca.make_ca_key()
+    ca.make_ca_crt()
+    return ca
+
+
+@pytest.fixture
+def cache(ca, tmpdir):
+    return CertCache(ca, KeyPool('ec:P-256', size=2), size=2, sni_home=os.path.join(tmpdir, 'sni'))
+
+
+def filled(cache):
+    """waits for pooled keys, else a new name gets the placeholder first"""
+    for _ in range(500):
+        if cache.key_pool.keys.full():
+            return cache
+        time.sleep(0.01)
+    raise TimeoutError('key pool is not filled')
+
+
+class TestKeyPool:
+    def test_get(self):
+        pool = KeyPool('ec:P-256', size=2)
+        assert pool.get().curve.name == 'secp256r1'
+
+    def test_bad_alg(self):
+        with pytest.raises(ValueError):
+            KeyPool('dsa:1024')
+
+
+class TestCertCache:
+    def test_mint_once(self, cache):
+        context = filled(cache).context('preview1.lan')
+        assert cache.context('PREVIEW1.lan.') is context
+        assert cache.minted == 1
+        assert os.path.isfile(os.path.join(cache.spill_dir, 'preview1.lan.pem'))
+
+    def test_not_served(self, cache):
+        assert cache.context('example.com') is None
+        assert cache.context('bad name.lan') is None
+        assert cache.minted == 0
+
+    def test_lru_spill(self, cache):
+        first = filled(cache).context('a.lan')
+        filled(cache).context('b.lan')
+        filled(cache).context('c.lan')
+        assert list(cache.contexts) == ['b.lan', 'c.lan']
+        assert cache.context('a.lan') is not first  # reloaded from spill
+        assert cache.minted == 3
+
+    def test_restart(self, ca, cache):
+        filled(cache).context('a.lan')
+        again = CertCache(ca, cache.key_pool, sni_home=os.path.dirname(cache.spill_dir))
+        again.context('a.lan')
+        assert again.minted == 0
+
+    def test_drained_pool(self, cache, monkeypatch):
+        keygen = threading.Event()
+
+        def get(wait=True):
+            if not wait:
+                return None
+            keygen.wait(10)  # slow rsa keygen
+            return Signer.new_key('ec:P-256')
+
+        monkeypatch.setattr(cache.key_pool, 'get', get)
+        started = time.perf_counter()
+        assert cache.context('new.lan') is cache.placeholder
+        assert cache.context('new.lan') is cache.placeholder  # minted once
+        assert time.perf_counter() - started < 1  # the SNI callback did not wait for the key
+        keygen.set()
+        cache.executor.shutdown(wait=True)
+        assert cache.context('new.lan') is not cache.placeholder
+        assert cache.minted == 1
+
+
+@pytest.fixture
+def front(cache):
+    async def echo(reader, writer):
+        writer.write(await reader.read(1024))
+        await writer.drain()
+        writer.close()
+
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    front = SniFront(cache, host='127.0.0.1', port=0, upstream_host='127.0.0.1')
+
+    def run():
+        asyncio.set_event_loop(loop)
+        upstream = loop.run_until_complete(asyncio.start_server(echo, '127.0.0.1', 0))
+        front.upstream_port = upstream.sockets[0].getsockname()[1]
+        loop.run_until_complete(front.start())
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    started.wait(10)
+    yield front
+    loop.call_soon_threadsafe(loop.stop)
+
+
+class TestSniFront:
+    def test_proxy(self, front, ca):
+        filled(front.cache)
+        context = ssl.create_default_context(cafile=ca.ca_crt)
+        with socket.create_connection(('127.0.0.1', front.port)) as sock:
+            with context.wrap_socket(sock, server_hostname='preview2.test') as tls:
+                crt = x509.load_der_x509_certificate(tls.getpeercert(binary_form=True))
+                tls.sendall(b'ping')
+                assert tls.recv(1024) == b'ping'
+        san = crt.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+        assert san.get_values_for_type(x509.DNSName) == ['preview2.test']
+
+    def test_unknown_name(self, front, ca):
+        context = ssl.create_default_context(cafile=ca.ca_crt)
+        with socket.create_connection(('127.0.0.1', front.port)) as sock:
+            with pytest.raises(ssl.SSLError):
+                context.wrap_socket(sock, server_hostname='example.com')
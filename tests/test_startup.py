@@ -0,0 +1,57 @@
+import os
+import os.path
+import subprocess
+import sys
+
+import pytest
+
+from swcertificate import Ca, Cert
+
+SWCERT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'swcert.py')
+
+
+def run_swcert(tmpdir, *args):
+    env = {**os.environ, 'HOME': str(tmpdir), 'SW_HOME': os.path.join(tmpdir, '.swcert')}
+    env.pop('SUDO_UID', None)
+    return subprocess.run([sys.executable, '-X', 'importtime', SWCERT, *args], env=env, capture_output=True,
+                          check=True, text=True)
+
+
+def imports(stderr):
+    """{module: cumulative us} from -X importtime"""
+    modules = {}
+    for line in stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            if cumulative_us.strip().isdigit():
+                modules[name.strip()] = int(cumulative_us)
+    return modules
+
+
+class TestListStartup:
+    def test_no_heavy_imports(self, tmpdir):
+        modules = imports(run_swcert(tmpdir, '--list').stderr)
+        assert 'swcertificate.registry' in modules
+        for heavy in ('cryptography', 'swcertificate.backend', 'swcertificate.nss', 'swcertificate.cert'):
+            assert heavy not in modules
+
+    @pytest.mark.parametrize('args', [('--list',), ('--export',)])
+    def test_only_registry(self, tmpdir, args):
+        modules = imports(run_swcert(tmpdir, *args).stderr)
+        assert {name for name in modules if name.startswith('swcertificate.')} <= {
+            'swcertificate.registry', 'swcertificate.settings', 'swcertificate.utils', 'swcertificate.trace'}
+        for heavy in ('asyncio', 'sqlite3', 'concurrent.futures', 'swcertificate.nginx', 'swcertificate.pipeline'):
+            assert heavy not in modules
+
+    def test_no_side_effects(self, tmpdir):
+        result = run_swcert(tmpdir, '--list')
+        assert result.stdout.strip() == ''
+        assert not os.path.exists(os.path.join(tmpdir, '.swcert'))
+
+
+class TestConstruct:
+    def test_no_dirs(self, tmpdir):
+        ca = Ca(ca_key=os.path.join(tmpdir, 'ca', 'ca.key'), ca_crt=os.path.join(tmpdir, 'ca', 'ca.crt'))
+        cert = Cert(ca, cert_list=os.path.join(tmpdir, 'cert', 'list.d'))
+        assert cert.list_domains() == []
+        assert os.listdir(tmpdir) == []
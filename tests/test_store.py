@@ -0,0 +1,166 @@
+import os
+import os.path
+import threading
+
+import pytest
+
+from swcertificate.store import Store
+
+
+def write(path, data):
+    with open(path, 'w') as f:
+        f.write(data)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+@pytest.fixture
+def pair(tmpdir):
+    """writes key and crt, returns their paths"""
+    key = os.path.join(tmpdir, 'swcert.key')
+    crt = os.path.join(tmpdir, 'swcert.crt')
+
+    def make(data):
+        write(key, f'key {data}')
+        write(crt, f'crt {data}')
+        return key, crt
+
+    return make
+
+
+class TestAdd:
+    def test_content_addressed(self, tmpdir, pair):
+        store = Store(home=os.path.join(tmpdir, 'store'))
+        first = store.add(*pair(1))
+        assert store.add(*pair(1)) == first
+        second = store.add(*pair(2))
+        assert second != first
+        assert read(os.path.join(second, 'swcert.crt')) == 'crt 2'
+        assert read(os.path.join(first, 'swcert.key')) == 'key 1'
+        assert read(os.path.join(first, 'swcert.pem')) == 'crt 1key 1'
+
+
+class TestDeploy:
+    def test_links(self, tmpdir, pair):
+        store = Store(home=os.path.join(tmpdir, 'store'))
+        key_dst = os.path.join(tmpdir, 'nginx', 'swcert.key')
+        crt_dst = os.path.join(tmpdir, 'nginx', 'swcert.crt')
+        os.makedirs(os.path.dirname(crt_dst))
+        write(crt_dst, 'copied before')  # replaced by a link
+
+        assert store.deploy('swcert', *pair(1), key_dst, crt_dst)
+        assert os.path.islink(crt_dst)
+        assert read(key_dst) == 'key 1'
+        assert not store.deploy('swcert', *pair(1), key_dst, crt_dst)
+
+        link_before = os.readlink(crt_dst)
+        assert store.deploy('swcert', *pair(2), key_dst, crt_dst)
+        assert os.readlink(crt_dst) == link_before  # only links/swcert was swapped
+        assert (read(key_dst), read(crt_dst)) == ('key 2', 'crt 2')
+
+    def test_no_sudo(self, tmpdir, pair, monkeypatch):
+        def denied(*_args, **_kwargs):
+            raise PermissionError(13, 'Permission denied')
+
+        store = Store(home=os.path.join(tmpdir, 'store'))
+        key_dst = os.path.join(tmpdir, 'nginx', 'swcert.key')
+        crt_dst = os.path.join(tmpdir, 'nginx', 'swcert.crt')
+        with monkeypatch.context() as patch:
+            patch.setattr(os, 'mkdir', denied)
+            with pytest.raises(RuntimeError, match='Run with `sudo`'):
+                store.deploy('swcert', *pair(1), key_dst, crt_dst)
+
+        store.deploy('swcert', *pair(1), key_dst, crt_dst)
+        monkeypatch.setattr(os, 'utime', denied)
+        with pytest.raises(RuntimeError, match='Run with `sudo`'):
+            store.deploy('swcert', *pair(1), key_dst, crt_dst)
+
+    def test_mode_owner(self, tmpdir, pair, monkeypatch):
+        chowned = []
+        monkeypatch.setattr(os, 'chown', lambda *args, **kwargs: chowned.append(args))
+        store = Store(home=os.path.join(tmpdir, 'store'))
+        key_dst = os.path.join(tmpdir, 'nginx', 'swcert.key')
+        crt_dst = os.path.join(tmpdir, 'nginx', 'swcert.crt')
+        umask = os.umask(0o077)
+        try:
+            store.deploy('swcert', *pair(1), key_dst, crt_dst)
+        finally:
+            os.umask(umask)
+
+        assert not chowned  # never given to the real user
+        for path in (key_dst, crt_dst, os.path.join(store.links, 'swcert', 'swcert.pem')):
+            stat = os.stat(path)
+            assert (stat.st_uid, stat.st_mode & 0o777) == (os.geteuid(), 0o644)
+        for path in (store.home, store.links, os.path.realpath(os.path.join(store.links, 'swcert')),
+                     os.path.dirname(key_dst)):
+            stat = os.stat(path)
+            assert (stat.st_uid, stat.st_mode & 0o777) == (os.geteuid(), 0o755)
+
+    def test_pair_never_mixed(self, tmpdir, pair):
+        store = Store(home=os.path.join(tmpdir, 'store'), keep=100)
+        key_dst = os.path.join(tmpdir, 'nginx', 'swcert.key')
+        crt_dst = os.path.join(tmpdir, 'nginx', 'swcert.crt')
+        store.deploy('swcert', *pair(0), key_dst, crt_dst)
+        generation_dir = os.path.dirname(os.path.realpath(crt_dst))
+
+        mixed = []
+        stop = threading.Event()
+
+        def reader():
+            while not stop.is_set():
+                generation = os.path.realpath(os.path.join(store.links, 'swcert'))
+                key = read(os.path.join(generation, 'swcert.key'))
+                crt = read(os.path.join(generation, 'swcert.crt'))
+                if key.split()[1] != crt.split()[1]:
+                    mixed.append((key, crt))
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        for i in range(1, 50):
+            store.deploy('swcert', *pair(i), key_dst, crt_dst)
+        stop.set()
+        thread.join()
+        assert not mixed
+        assert os.path.isdir(generation_dir)
+
+    def test_rollback(self, tmpdir, pair):
+        store = Store(home=os.path.join(tmpdir, 'store'))
+        key_dst = os.path.join(tmpdir, 'nginx', 'swcert.key')
+        crt_dst = os.path.join(tmpdir, 'nginx', 'swcert.crt')
+        store.deploy('swcert', *pair(1), key_dst, crt_dst)
+        with pytest.raises(RuntimeError):
+            store.rollback('swcert')
+
+        store.deploy('swcert', *pair(2), key_dst, crt_dst)
+        store.rollback('swcert')
+        assert (read(key_dst), read(crt_dst)) == ('key 1', 'crt 1')
+        store.rollback('swcert')
+        assert read(crt_dst) == 'crt 2'
+
+
+class TestGc:
+    def test_keep(self, tmpdir, pair):
+        store = Store(home=os.path.join(tmpdir, 'store'), keep=2)
+        key_dst = os.path.join(tmpdir, 'nginx', 'swcert.key')
+        crt_dst = os.path.join(tmpdir, 'nginx', 'swcert.crt')
+        generations = []
+        for i in range(5):
+            store.deploy('swcert', *pair(i), key_dst, crt_dst)
+            generations.append(store.current('swcert'))
+            os.utime(generations[-1], ns=(i * 10 ** 9, i * 10 ** 9))  # mtime order regardless of fs resolution
+
+        assert store.gc() == []  # the 2 last, the deployed one is among them
+        assert store.generations() == [generations[4], generations[3]]
+        assert read(crt_dst) == 'crt 4'
+
+    def test_linked_kept(self, tmpdir, pair):
+        store = Store(home=os.path.join(tmpdir, 'store'), keep=0)
+        store.deploy('swcert', *pair(1), os.path.join(tmpdir, 'a.key'), os.path.join(tmpdir, 'a.crt'))
+        store.deploy('swcert', *pair(2), os.path.join(tmpdir, 'a.key'), os.path.join(tmpdir, 'a.crt'))
+        store.add(*pair(3))
+        assert len(store.gc()) == 1
+        assert store.previous('swcert') in store.generations()
+        assert read(os.path.join(tmpdir, 'a.crt')) == 'crt 2'
@@ -0,0 +1,97 @@
+import os
+import os.path
+import subprocess
+
+import pytest
+
+from swcertificate import Ca, utils
+from swcertificate.system_trust import SystemTrust
+
+
+def make_ca(tmpdir, name, subj=None):
+    ca = Ca(ca_key=os.path.join(tmpdir, f'{name}.key'), ca_crt=os.path.join(tmpdir, f'{name}.crt'))
+    ca.make_ca_key()
+    if subj:
+        ca.backend.make_ca_crt(ca.ca_key, ca.ca_crt, subj=subj)
+    else:
+        ca.make_ca_crt()
+    return ca.ca_crt
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture
+def trust(tmpdir):
+    """certs dir with a bundle of 2 other CAs"""
+    certs_dir = os.path.join(tmpdir, 'certs')
+    os.makedirs(certs_dir)
+    with open(os.path.join(certs_dir, 'ca-certificates.crt'), 'wb') as f:
+        for name in ('other1', 'other2'):
+            f.write(read(make_ca(tmpdir, name, subj=f'/CN={name}/O=Other')))
+    return SystemTrust(ca_crt=make_ca(tmpdir, 'swcert'), pem=os.path.join(certs_dir, 'swcert_CA.pem'),
+                       certs_dir=certs_dir, bundle=os.path.join(certs_dir, 'ca-certificates.crt'),
+                       hooks=os.path.join(tmpdir, 'update.d'))
+
+
+def hash_links(certs_dir):
+    return sorted(name for name in os.listdir(certs_dir) if os.path.islink(os.path.join(certs_dir, name)) and
+                  name != 'swcert_CA.pem')
+
+
+class TestInstall:
+    def test_incremental(self, trust):
+        bundle_before = read(trust.bundle)
+        assert trust.install() == 'incremental'
+
+        assert os.readlink(trust.pem) == trust.ca_crt
+        subject_hash = subprocess.run(['openssl', 'x509', '-subject_hash', '-noout', '-in', trust.ca_crt],
+                                      check=True, capture_output=True, text=True).stdout.strip()
+        assert hash_links(trust.certs_dir) == [f'{subject_hash}.0']
+        assert read(trust.bundle) == bundle_before + read(trust.ca_crt)
+
+        mtime = os.stat(trust.bundle).st_mtime_ns
+        assert trust.install() == 'incremental'
+        assert os.stat(trust.bundle).st_mtime_ns == mtime
+
+    def test_replace(self, tmpdir, trust):
+        bundle_before = read(trust.bundle)
+        trust.install()
+        ca = Ca(ca_key=os.path.join(tmpdir, 'swcert.key'), ca_crt=trust.ca_crt)
+        ca.make_ca_crt()  # same subject, new crt
+        trust.install()
+
+        assert read(trust.bundle) == bundle_before + read(trust.ca_crt)
+        assert len(hash_links(trust.certs_dir)) == 1
+
+    def test_hooks(self, tmpdir, trust):
+        os.makedirs(trust.hooks)
+        hook = os.path.join(trust.hooks, 'keystore')
+        out = os.path.join(tmpdir, 'hook.out')
+        with open(hook, 'w') as f:
+            f.write(f'#!/bin/sh\ncat > {out}\n')
+        os.chmod(hook, 0o755)
+
+        trust.install()
+        assert read(out) == f'+{trust.pem}\n'.encode('utf-8')
+
+    def test_fresh(self, tmpdir, trust, monkeypatch):
+        rebuilds = []
+        monkeypatch.setattr(utils, 'etc_install', lambda: rebuilds.append(1))
+        os.remove(trust.bundle)
+        assert trust.install() == 'fresh'
+        assert rebuilds == [1]
+
+
+class TestSubjectDer:
+    def test_ok(self, tmpdir):
+        x509 = pytest.importorskip('cryptography.x509')
+        crt = make_ca(tmpdir, 'ca')
+        der = utils.pem_blocks(read(crt))[0][1]
+        assert SystemTrust.subject_der(der) == x509.load_der_x509_certificate(der).subject.public_bytes()
+
+    def test_garbage(self):
+        with pytest.raises((ValueError, IndexError)):
+            SystemTrust.subject_der(b'\x30\x82\xff')
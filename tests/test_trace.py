@@ -0,0 +1,109 @@
+import json
+import os.path
+import threading
+
+import pytest
+
+from swcertificate import utils
+from swcertificate.trace import Tracer, in_context, tracer
+
+
+@pytest.fixture
+def enabled():
+    tracer.enable()
+    yield tracer
+    tracer.enabled = False
+
+
+def subprocess_span(trace, cmd, exit_status):
+    with trace.span(cmd.split()[0], cat='subprocess', cmd=cmd, exit=exit_status):
+        pass
+
+
+class TestTracer:
+    def test_disabled(self):
+        trace = Tracer()
+        with trace.span('some', cat='phase') as args:
+            args['x'] = 1
+        assert trace.spans == []
+
+    def test_error(self):
+        trace = Tracer()
+        trace.enable()
+        with pytest.raises(SystemExit):
+            with trace.span('some', cat='phase'):
+                raise SystemExit('fatal')
+        assert trace.spans[0]['args']['error'] == 'fatal'
+
+    def test_phases(self):
+        trace = Tracer()
+        trace.enable()
+        with trace.span('issuance', cat='phase'):
+            with trace.span('openssl', cat='subprocess', cmd='openssl x509', exit=0):
+                pass
+            thread = threading.Thread(target=in_context(subprocess_span), args=(trace, 'certutil -L', 255))
+            thread.start()
+            thread.join()
+        with trace.span('deploy', cat='phase'):
+            pass
+
+        phases = trace.phases()
+        assert [phase['name'] for phase, _subprocs in phases] == ['issuance', 'deploy']
+        assert len(phases[0][1]) == 2  # the thread was handed the phase
+        report = trace.report()
+        assert 'issuance' in report and 'exit 255 certutil -L' in report
+
+    def test_overlapping_phases(self):
+        trace = Tracer()
+        trace.enable()
+        both_open = threading.Barrier(2)
+
+        def phase(name, cmd):
+            with trace.span(name, cat='phase'):
+                both_open.wait()
+                with trace.span('nested', cat='func'):
+                    subprocess_span(trace, cmd, 0)
+                both_open.wait()
+
+        threads = [threading.Thread(target=phase, args=('NSS sync', 'certutil -A')),
+                   threading.Thread(target=phase, args=('issuance', 'openssl x509'))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with trace.span('deploy', cat='phase'):
+            thread = threading.Thread(target=subprocess_span, args=(trace, 'nginx -t', 0))  # no context, no phase
+            thread.start()
+            thread.join()
+
+        phases = {phase['name']: [span['args']['cmd'] for span in subprocs] for phase, subprocs in trace.phases()}
+        assert phases == {'NSS sync': ['certutil -A'], 'issuance': ['openssl x509'], 'deploy': []}
+
+
+class TestInstrumented:
+    def test_subproc(self, enabled):
+        utils.subproc_out(run=['echo', 'hello'])
+        assert not utils.subproc(run=['false'])
+        echo, false = enabled.spans
+        assert echo['cat'] == 'subprocess'
+        assert echo['args']['cmd'] == 'echo hello'
+        assert echo['args']['exit'] == 0 and echo['args']['stdout_bytes'] == 6
+        assert false['args']['exit'] == 1
+
+    def test_copy(self, enabled, tmpdir):
+        src = os.path.join(tmpdir, 'src')
+        with open(src, 'w') as f:
+            f.write('12345')
+        utils.copy(src, os.path.join(tmpdir, 'dst'))
+        assert enabled.spans[0]['args']['bytes'] == 5
+
+    def test_chrome_trace(self, enabled, tmpdir):
+        with enabled.span('deploy', cat='phase'):
+            utils.subproc_out(run=['true'])
+        path = os.path.join(tmpdir, 'trace.json')
+        enabled.write_chrome_trace(path)
+        with open(path) as f:
+            events = json.load(f)['traceEvents']
+        assert [event['name'] for event in events] == ['deploy', 'true']
+        assert all(event['ph'] == 'X' and event['dur'] >= 0 for event in events)
+        assert events[0]['ts'] <= events[1]['ts']
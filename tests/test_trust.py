@@ -0,0 +1,57 @@
+import os.path
+
+import pytest
+
+from swcertificate import Ca, Ledger, Nss, Trust
+
+
+class FakeCa:
+    ca_crt = 'ca.crt'
+    backend = None
+
+    def __init__(self):
+        self.calls = []
+
+    def trusted_paths(self):
+        return []
+
+    def find_or_new_ca_key(self):
+        self.calls.append('key')
+
+    def find_or_new_ca_crt(self):
+        self.calls.append('crt')
+
+
+@pytest.fixture
+def trust(tmpdir, monkeypatch):
+    nss_dir = os.path.join(tmpdir, 'nss')
+    os.makedirs(nss_dir)
+    open(os.path.join(nss_dir, 'cert9.db'), 'a').close()
+    syncs = []
+    monkeypatch.setattr(Nss, 'find', lambda nss_dirs: [nss_dir])
+    monkeypatch.setattr(Nss, 'sync', lambda nss_dirs, ca_serial, ca_crt: syncs.append(nss_dirs) or ({}, {}))
+    monkeypatch.setattr(Ca, 'get_crt_fingerprint', lambda ca_crt, backend: 'ab:cd')
+    monkeypatch.setattr(Ca, 'get_crt_serial', lambda ca_crt, backend: '01')
+    trust = Trust(FakeCa(), ledger=Ledger(ledger=os.path.join(tmpdir, 'trust.json')))
+    trust.syncs = syncs
+    return trust
+
+
+class TestTrust:
+    def test_ledger_skips_sync(self, trust, monkeypatch):
+        monkeypatch.setattr('swcertificate.utils.is_installed', lambda binary: True)
+        assert trust.ensure(nss_dirs=['home']) == {}
+        assert len(trust.syncs) == 1 and trust.ca.calls == ['key', 'crt']
+
+        assert trust.ensure(nss_dirs=['home']) == {}
+        assert len(trust.syncs) == 1  # nothing changed, recorded by the first one
+
+    def test_no_certutil(self, trust, monkeypatch):
+        monkeypatch.setattr('swcertificate.utils.is_installed', lambda binary: False)
+        with pytest.raises(RuntimeError, match='Install `certutil`'):
+            trust.ensure(nss_dirs=['home'])
+        assert not trust.syncs
+
+    def test_no_nss_dirs(self, trust):
+        with pytest.raises(RuntimeError, match='NSS dirs not found'):
+            trust.sync([], [], has_certutil=True)
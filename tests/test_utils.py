@@ -56,6 +56,30 @@ class TestCopy:
         assert os.path.isfile(dst)
 
 
+class TestIsSame:
+    def test_ok(self, tmpdir):
+        src = os.path.join(tmpdir, 'file')
+        with open(src, 'w') as f:
+            f.write('some')
+        dst = os.path.join(tmpdir, 'file2')
+        utils.copy(src, dst)
+        assert utils.is_same(src, dst)
+
+    def test_differ(self, tmpdir):
+        src = os.path.join(tmpdir, 'file')
+        with open(src, 'w') as f:
+            f.write('some')
+        dst = os.path.join(tmpdir, 'file2')
+        with open(dst, 'w') as f:
+            f.write('other')
+        assert not utils.is_same(src, dst)
+
+    def test_no_dst(self, tmpdir):
+        src = os.path.join(tmpdir, 'file')
+        open(src, 'a').close()
+        assert not utils.is_same(src, os.path.join(tmpdir, 'file2'))
+
+
 class TestIsInstalled:
     def test_ok(self):
         assert utils.is_installed('echo')
@@ -0,0 +1,40 @@
+import os
+import os.path
+import threading
+import time
+
+from swcertificate.watch import Watcher
+
+
+def touch(path):
+    with open(path, 'w') as f:
+        f.write('x')
+
+
+class TestWatcher:
+    def test_burst(self, tmpdir):
+        watch_dir = str(tmpdir)
+        with Watcher({watch_dir: None}, debounce=0.2) as watcher:
+            def writer():
+                for i in range(5):
+                    touch(os.path.join(watch_dir, f'host{i}.lan'))
+                    time.sleep(0.05)
+            threading.Thread(target=writer).start()
+            changed = watcher.burst()
+            assert changed == {os.path.join(watch_dir, f'host{i}.lan') for i in range(5)}
+            assert watcher.read(0.3) == set()
+
+    def test_rename(self, tmpdir):
+        watch_dir = str(tmpdir)
+        with Watcher({watch_dir: None}, debounce=0) as watcher:
+            touch(os.path.join(watch_dir, '.domains.123.tmp'))
+            os.replace(os.path.join(watch_dir, '.domains.123.tmp'), os.path.join(watch_dir, '.domains'))
+            assert watcher.burst() == {os.path.join(watch_dir, '.domains')}
+
+    def test_names(self, tmpdir):
+        watch_dir = str(tmpdir)
+        with Watcher({watch_dir: {'ca.crt'}}, debounce=0) as watcher:
+            touch(os.path.join(watch_dir, 'ca.key'))
+            assert watcher.read(0.1) == set()
+            touch(os.path.join(watch_dir, 'ca.crt'))
+            assert watcher.burst() == {os.path.join(watch_dir, 'ca.crt')}